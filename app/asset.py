@@ -1,54 +1,270 @@
 import os
-from arxiv import ArxivRecord, ArxivAPI
-from typing import List
-from app.utils import NLP
+from arxiv import ArxivRecord, ArxivAPI, RateLimiter
+from typing import Iterable, List, Optional
+from app.utils import PhraseMatcher, RecordTokens
+from app.dailyfile import DailyFile, MappedRecord
+from app.cache import BoundedCache, SingleFlight
+from app.index import InvertedIndex
+from app.rank import RelevanceRanker, TermStats
+from app.embed import HashingEncoder, default_encoder, load_vectors, write_vectors
+import numpy as np
 from datetime import datetime, timedelta
 import zipfile
 import pickle
+import time
+from collections import deque
+import bisect
+from concurrent.futures import Future, ThreadPoolExecutor, wait as wait_futures
+import threading
+from array import array
 
 _default_asset_root = os.path.join(os.path.dirname(os.path.dirname(__file__)), "arxiv")
 
 
 class ArxivSet:
-    def __init__(self, records: List[ArxivRecord]) -> None:
-        self.records = records
-        self.id2records = {r.id: r for r in self.records}
+    """
+    Records keyed by id in insertion order. Set operations keep the record of the leftmost set
+    and run in time linear in the total size of their inputs.
+    """
+
+    def __init__(self, records: Iterable[ArxivRecord]) -> None:
+        self.id2records = {r.id: r for r in records}
+
+    @property
+    def records(self):
+        return list(self.id2records.values())
 
     def add(self, record: ArxivRecord):
-        if record.id in self.id2records:
-            old_record = self.id2records[record.id]
-            self.records.remove(old_record)
+        # a replaced record moves to the end, as if it was removed and added again
+        self.id2records.pop(record.id, None)
         self.id2records[record.id] = record
-        self.records.append(record)
 
     def get_records(self):
-        return [record for record in self.records]
+        return list(self.id2records.values())
 
-    def union(self, other: "ArxivSet"):
-        res = self.get_records()
-        for r in other.records:
-            if r.id not in self.id2records:
-                res.append(r)
-        return ArxivSet(res)
+    def get(self, id) -> Optional[ArxivRecord]:
+        return self.id2records.get(id)
 
-    def intersect(self, other: "ArxivSet"):
-        res = []
-        for id, r in self.id2records.items():
-            if id in other.id2records:
-                res.append(r)
-        return ArxivSet(res)
+    def update(self, *others: "ArxivSet"):
+        for other in others:
+            for r in other:
+                if r.id not in self.id2records:
+                    self.id2records[r.id] = r
+        return self
+
+    def intersection_update(self, *others: "ArxivSet"):
+        self.id2records = self.intersect(*others).id2records
+        return self
+
+    def difference_update(self, *others: "ArxivSet"):
+        for other in others:
+            for r in other:
+                self.id2records.pop(r.id, None)
+        return self
+
+    def union(self, *others: "ArxivSet"):
+        return ArxivSet(self).update(*others)
+
+    def intersect(self, *others: "ArxivSet"):
+        records = self
+        for other in others:
+            index = other._id_index()
+            records = [r for r in records if r.id in index]
+        return ArxivSet(records)
+
+    def difference(self, *others: "ArxivSet"):
+        return ArxivSet(self).difference_update(*others)
+
+    def _id_index(self):
+        return self.id2records
+
+    def to_columnar(self):
+        return ColumnarArxivSet(self)
+
+    def __setstate__(self, state):
+        # sets pickled before the id-keyed store also carry a `records` list
+        state.pop("records", None)
+        self.__dict__.update(state)
+
+    def __iter__(self):
+        return iter(self.id2records.values())
+
+    def __contains__(self, id):
+        return id in self.id2records
 
     def __len__(self):
-        return len(self.records)
+        return len(self.id2records)
+
+
+class ColumnarArxivSet(ArxivSet):
+    """
+    Read-only ArxivSet keeping every field in its own column instead of one object per record.
+    Records are only materialized by `get_records`, so keep the set itself around, not the records.
+    """
+
+    def __init__(self, records: Iterable[ArxivRecord]) -> None:
+        self.ids = []
+        self.titles = []
+        self.abstracts = []
+        self.published = []
+        self.updated = []
+        self.category_table = []
+        self.category_codes = array("H")
+        self.category_offsets = array("I", [0])
+        self.authors = []
+        self.author_offsets = array("I", [0])
+        self.tokens = []
+        self.id2rows = {}
+
+        category2code = {}
+        for record in records:
+            if record.id in self.id2rows:
+                raise ValueError(f"Duplicate record {record.id}")
+            self.id2rows[record.id] = len(self.ids)
+            self.ids.append(record.id)
+            self.titles.append(record.title)
+            self.abstracts.append(record.abstract)
+            self.published.append(record.published)
+            self.updated.append(record.updated)
+            for category in record.categories:
+                if category not in category2code:
+                    category2code[category] = len(self.category_table)
+                    self.category_table.append(category)
+                self.category_codes.append(category2code[category])
+            self.category_offsets.append(len(self.category_codes))
+            self.authors.extend(record.authors)
+            self.author_offsets.append(len(self.authors))
+            self.tokens.append(record.tokens)
+
+    def get_record(self, row) -> ArxivRecord:
+        codes = self.category_codes[self.category_offsets[row]:self.category_offsets[row + 1]]
+        record = ArxivRecord(
+            id=self.ids[row],
+            title=self.titles[row],
+            abstract=self.abstracts[row],
+            categories=[self.category_table[c] for c in codes],
+            authors=self.authors[self.author_offsets[row]:self.author_offsets[row + 1]],
+            published=self.published[row],
+            updated=self.updated[row],
+        )
+        record.tokens = self.tokens[row]
+        return record
+
+    def add(self, record: ArxivRecord):
+        raise TypeError("ColumnarArxivSet is read-only")
+
+    def update(self, *others: "ArxivSet"):
+        raise TypeError("ColumnarArxivSet is read-only")
+
+    def intersection_update(self, *others: "ArxivSet"):
+        raise TypeError("ColumnarArxivSet is read-only")
+
+    def difference_update(self, *others: "ArxivSet"):
+        raise TypeError("ColumnarArxivSet is read-only")
+
+    def _id_index(self):
+        return self.id2rows
+
+    def intersect(self, *others: "ArxivSet"):
+        rows = range(len(self.ids))
+        for other in others:
+            index = other._id_index()
+            rows = [row for row in rows if self.ids[row] in index]
+        return ArxivSet(self.get_record(row) for row in rows)
 
+    def difference(self, *others: "ArxivSet"):
+        rows = range(len(self.ids))
+        for other in others:
+            index = other._id_index()
+            rows = [row for row in rows if self.ids[row] not in index]
+        return ArxivSet(self.get_record(row) for row in rows)
+
+    def get_records(self):
+        return list(self)
+
+    def __iter__(self):
+        return (self.get_record(row) for row in range(len(self.ids)))
+
+    def to_columnar(self):
+        return self
+
+    def get(self, id) -> Optional[ArxivRecord]:
+        row = self.id2rows.get(id)
+        return self.get_record(row) if row is not None else None
+
+    def __contains__(self, id):
+        return id in self.id2rows
+
+    def __len__(self):
+        return len(self.ids)
 
 
 class ArxivDaily(ArxivSet):
-    def __init__(self, date, pset, records: List[ArxivRecord]) -> None:
+    def __init__(self, date, pset, records: Iterable[ArxivRecord]) -> None:
         super().__init__(records)
         self.date = date
         self.pset = pset
 
+    def to_columnar(self):
+        return ColumnarArxivDaily(self.date, self.pset, self)
+
+
+class ColumnarArxivDaily(ColumnarArxivSet):
+    def __init__(self, date, pset, records: Iterable[ArxivRecord]) -> None:
+        super().__init__(records)
+        self.date = date
+        self.pset = pset
+
+
+class MappedArxivDaily(ArxivSet):
+    """
+    Read-only daily set backed by a memory-mapped DailyFile. Iterating yields MappedRecords,
+    which decode only the fields that are accessed.
+    """
+
+    def __init__(self, file: DailyFile) -> None:
+        self.file = file
+        self.date = file.date
+        self.pset = file.pset
+
+    @property
+    def id2records(self):
+        return {r.id: r for r in self}
+
+    def add(self, record: ArxivRecord):
+        raise TypeError("MappedArxivDaily is read-only")
+
+    def update(self, *others: "ArxivSet"):
+        raise TypeError("MappedArxivDaily is read-only")
+
+    def intersection_update(self, *others: "ArxivSet"):
+        raise TypeError("MappedArxivDaily is read-only")
+
+    def difference_update(self, *others: "ArxivSet"):
+        raise TypeError("MappedArxivDaily is read-only")
+
+    def _id_index(self):
+        return self
+
+    def get_records(self):
+        return list(self)
+
+    def to_columnar(self):
+        return self
+
+    def __iter__(self):
+        return (MappedRecord(self.file, row) for row in range(len(self.file)))
+
+    def get(self, id) -> Optional[MappedRecord]:
+        row = self.file.find(id)
+        return MappedRecord(self.file, row) if row >= 0 else None
+
+    def __contains__(self, id):
+        return self.file.find(id) >= 0
+
+    def __len__(self):
+        return len(self.file)
+
 
 class ArxivFilter:
     def __init__(
@@ -57,11 +273,29 @@ class ArxivFilter:
         keypoints_in_abstract=None,
         keypoints_in_title=None,
         authors=None,
+        semantic=None,
+        semantic_threshold=0.25,
+        encoder: HashingEncoder = default_encoder,
     ) -> None:
+        """
+        Args:
+            semantic: List[str] | None, queries a record has to be similar to (cosine of their embeddings)
+            semantic_threshold: least similarity of a record to any of the semantic queries
+        """
         self.categories = self._none_or_set(categories)
         self.keywd_in_abstract = self._none_or_set(keypoints_in_abstract)
         self.keywd_in_title = self._none_or_set(keypoints_in_title)
         self.authors = self._none_or_set(authors)
+        self.abstract_matcher = self._none_or_matcher(self.keywd_in_abstract)
+        self.title_matcher = self._none_or_matcher(self.keywd_in_title)
+        # category -> whether it is one of self.categories, categories repeat across records
+        self._category_hits = {}
+        if semantic is not None and not isinstance(semantic, (list, tuple)):
+            semantic = [semantic]
+        self.semantic = semantic
+        self.semantic_threshold = semantic_threshold
+        self.encoder = encoder
+        self.semantic_queries = encoder.encode_texts(semantic) if semantic is not None else None
 
     def _none_or_set(self, val):
         if val is None:
@@ -71,36 +305,54 @@ class ArxivFilter:
                 val = [val]
         return set([v.lower() for v in val])
 
+    def _none_or_matcher(self, keywords):
+        if keywords is None:
+            return None
+        return PhraseMatcher(keywords)
+
     def _filt_by_category(self, record: ArxivRecord):
         if self.categories is None:
             return True
         else:
-            lower_record_categories = set([c.lower() for c in record.categories])
-            st = self.categories.intersection(lower_record_categories)
-            return len(st) > 0
+            for c in record.categories:
+                hit = self._category_hits.get(c)
+                if hit is None:
+                    hit = self._category_hits[c] = c.lower() in self.categories
+                if hit:
+                    return True
+            return False
 
     def _filt_by_authors(self, record: ArxivRecord):
         if self.authors is None:
             return True
         else:
-            lower_record_authors = set([a.lower() for a in record.authors])
-            st = self.authors.intersection(lower_record_authors)
-            return len(st) > 0
-
-    def _filt_by_keyword(self, keywords, s: str):
-        if keywords is None:
-            return True
-        else:
-            for kwd in keywords:
-                if NLP.contain_phrase(s, kwd):
-                    return True
-            return False
+            return any(a.lower() in self.authors for a in record.authors)
 
     def _filt_by_keypoint_in_title(self, record: ArxivRecord):
-        return self._filt_by_keyword(self.keywd_in_title, record.title)
+        if self.title_matcher is None:
+            return True
+        return self.title_matcher.contain_any_tokens(RecordTokens.of(record).title)
 
     def _filt_by_keypoint_in_abstract(self, record: ArxivRecord):
-        return self._filt_by_keyword(self.keywd_in_abstract, record.abstract)
+        if self.abstract_matcher is None:
+            return True
+        return self.abstract_matcher.contain_any_tokens(RecordTokens.of(record).abstract)
+
+    def semantic_scores(self, records: List[ArxivRecord]) -> np.ndarray:
+        """
+        Highest cosine similarity of each record to the semantic queries, computed in one batch.
+        """
+        if len(records) == 0 or len(self.semantic_queries) == 0:
+            return np.full(len(records), -np.inf, dtype=np.float32)
+        return (self.encoder.record_vectors(records) @ self.semantic_queries.T).max(axis=1)
+
+    def _semantic_mask(self, records: List[ArxivRecord]):
+        if self.semantic_queries is None:
+            return [True] * len(records)
+        return self.semantic_scores(records) >= self.semantic_threshold
+
+    def _filt_by_semantic(self, record: ArxivRecord):
+        return bool(self._semantic_mask([record])[0])
 
     def _filt(self, records: List[ArxivRecord]):
         res = []
@@ -108,22 +360,104 @@ class ArxivFilter:
             if (
                 self._filt_by_category(record)
                 and self._filt_by_authors(record)
-                and self._filt_by_keypoint_in_abstract(record)
                 and self._filt_by_keypoint_in_title(record)
+                and self._filt_by_keypoint_in_abstract(record)
             ):
                 res.append(record)
+        if self.semantic_queries is not None:
+            res = [record for record, keep in zip(res, self._semantic_mask(res)) if keep]
         return res
 
     def __call__(self, data: ArxivSet):
         return ArxivSet(self._filt(data.get_records()))
 
 
+def estimate_daily_size(daily: ArxivSet):
+    """
+    Rough size in bytes of a daily set held in memory.
+    """
+    if isinstance(daily, MappedArxivDaily):
+        vectors = daily.file.vectors
+        return os.path.getsize(daily.file.path) + (vectors.nbytes if vectors is not None else 0)
+    # per record: the record object, its tuples and tokens besides the strings
+    size = 0
+    for record in daily:
+        size += 600 + len(record.id) + len(record.title) + 2 * len(record.abstract)
+        size += sum(len(a) + 50 for a in record.authors)
+    return size
+
+
+class DailyPending(Exception):
+    """
+    Raised when daily sets are still being harvested in the background.
+    """
+
+    def __init__(self, keys) -> None:
+        super().__init__(f"Harvesting {', '.join(f'({pset}, {date})' for pset, date in keys)}")
+        self.keys = keys
+
+
+class FetchQueueFull(Exception):
+    """
+    Raised when `max_pending_fetches` daily sets are already waiting for their background harvest.
+    """
+
+
 class ArxivAsset:
-    def __init__(self, root=_default_asset_root):
+    def __init__(
+        self,
+        root=_default_asset_root,
+        columnar=False,
+        cache: Optional[BoundedCache] = None,
+        cache_max_bytes=256 << 20,
+        recent_ttl=None,
+        index: Optional[InvertedIndex] = None,
+        encoder: HashingEncoder = default_encoder,
+        store=None,
+        fetch_workers=2,
+        max_pending_fetches=64,
+        limiter: Optional[RateLimiter] = None,
+    ):
+        """
+        Args:
+            columnar: keep harvested daily sets in memory as ColumnarArxivDaily
+            cache: BoundedCache of loaded daily sets keyed by (pset, date), by default the 64 most recently used
+                   within cache_max_bytes
+            cache_max_bytes: estimated size (see `estimate_daily_size`) of the default cache, None for no bound
+            recent_ttl: seconds after which the cache of a recent date (the last `recent_days` days),
+                        whose records may still change, is harvested again. None to never expire.
+            index: InvertedIndex updated with every cached daily set, required by `search`
+            encoder: embeds the records of every cached daily set for semantic filters
+            store: db.DBInterface filled by the crawl daemon; when set, get_by_date queries it
+                   instead of loading whole daily sets
+            fetch_workers: number of background harvests of `fetch`
+            max_pending_fetches: daily sets `fetch` harvests or queues at most, beyond which it raises FetchQueueFull
+            limiter: RateLimiter every OAI request of the harvests takes a token from,
+                     by default 1 request per second with bursts of fetch_workers
+        """
         self.root = root
         if not os.path.exists(self.root):
             os.mkdir(self.root)
-        self._cached_daily = {}
+        self.columnar = columnar
+        if cache is None:
+            cache = BoundedCache(max_entries=64, max_bytes=cache_max_bytes, sizeof=estimate_daily_size)
+        self._cached_daily = cache
+        self.recent_ttl = recent_ttl
+        self.recent_days = 2
+        self.index = index
+        self.encoder = encoder
+        self.store = store
+        # (date, categories) -> TermStats of the records of the store
+        self._store_stats = BoundedCache(max_entries=16)
+        self.fetch_workers = fetch_workers
+        self.max_pending_fetches = max_pending_fetches
+        self.limiter = limiter if limiter is not None else RateLimiter(rate=1.0, capacity=fetch_workers)
+        # (pset, date) -> Future of the running background harvest
+        self._fetches = {}
+        self._fetch_lock = threading.Lock()
+        self._fetch_executor = None
+        # concurrent misses of the same (pset, date) share one load or harvest
+        self._single_flight = SingleFlight()
 
     @classmethod
     def is_valid_pset(cls, pset):
@@ -147,65 +481,306 @@ class ArxivAsset:
         return os.path.join(self.root, pset, date)
 
     def cache(self, data: ArxivDaily, pset, date: str):
-        path = self._get_cache_path(pset, date) + ".zip"
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        d_bytes = pickle.dumps(data)
-        with zipfile.ZipFile(path, "w") as zf:
-            zf.writestr(date, d_bytes)
+        path = self._get_cache_path(pset, date)
+        DailyFile.write(path + ".pday", date, pset, data)
+        identity = DailyFile.identity_of(os.stat(path + ".pday"))
+        write_vectors(path + ".vec", self.encoder.encode_records(data), identity)
+        # the daily set loaded before maps the previous file
+        self._cached_daily.pop((pset, date), None)
+        if self.index is not None:
+            self.index.add_daily(pset, date, data)
+
+    def _ingest(self, daily: ArxivDaily):
+        """
+        Prepare a daily set for queries: tokenize its records once for all keyword filters.
+        """
+        if isinstance(daily, MappedArxivDaily):
+            # tokens are stored in the file
+            return daily
+        for record in daily:
+            RecordTokens.of(record)
+        return daily.to_columnar() if self.columnar else daily
+
+    @staticmethod
+    def day_window(date: str):
+        """
+        Returns the (start, end) dates of the records of the daily set of date: harvested by OAI datestamp
+        in [start, end], queried from a store by published or updated date in the same bounds.
+        """
+        d_yesterday = datetime.strptime(date, "%Y-%m-%d") - timedelta(days=1)
+        return d_yesterday.strftime("%Y-%m-%d"), date
 
     def request_and_cache(self, pset, date: str):
         try:
-            d_date = datetime.strptime(date, "%Y-%m-%d")
-            d_yesterday = d_date - timedelta(days=1)
-            s_yesterday = d_yesterday.strftime("%Y-%m-%d")
-            records = ArxivAPI.get_records_by_oai(
-                from_time=s_yesterday, until_time=date, set=pset
-            )
-            arxiv_daily = ArxivDaily(date, pset, records)
+            start, end = self.day_window(date)
+            arxiv_daily = ArxivDaily(date, pset, [])
+            for records in ArxivAPI.iter_records_by_oai(
+                from_time=start, until_time=end, pset=pset, limiter=self.limiter
+            ):
+                for record in records:
+                    arxiv_daily.add(record)
+            arxiv_daily = self._ingest(arxiv_daily)
             self.cache(arxiv_daily, pset, date)
             return arxiv_daily
 
         except FileNotFoundError:
             return None
 
-    def load_cache(self, pset, date: str):
-        if pset in self._cached_daily:
-            if date in self._cached_daily[pset]:
-                return self._cached_daily[pset][date]
-
+    def _load_legacy_cache(self, pset, date: str):
+        """
+        Load a pickled ArxivDaily (.zip or plain) and migrate it to a daily file.
+        """
         path = self._get_cache_path(pset, date)
         zippath = path + ".zip"
+        if os.path.exists(zippath):
+            with zipfile.ZipFile(zippath, "r") as zf:
+                d_bytes = zf.read(date)
+                res = pickle.loads(d_bytes)
+        else:
+            with open(path, "rb") as f:
+                res = pickle.load(f)
+        self.cache(self._ingest(res), pset, date)
+
+    def _ttl(self, date: str):
+        """
+        Returns the time to live of the cache of date, None if it never changes.
+        """
+        if self.recent_ttl is None:
+            return None
+        d_date = datetime.strptime(date, "%Y-%m-%d")
+        if d_date + timedelta(days=self.recent_days) > datetime.utcnow():
+            return self.recent_ttl
+        return None
+
+    def load_cache(self, pset, date: str):
+        res = self._cached_daily.get((pset, date))
+        if res is not None:
+            return res
+
+        path = self._get_cache_path(pset, date) + ".pday"
         try:
-            if os.path.exists(zippath):
-                with zipfile.ZipFile(zippath, "r") as zf:
-                    d_bytes = zf.read(date)
-                    res = pickle.loads(d_bytes)
-            else:
-                with open(path, "rb") as f:
-                    res = pickle.load(f)
-            self._cached_daily.setdefault(pset, {})
-            self._cached_daily[pset][date] = res
+            if not os.path.exists(path):
+                self._load_legacy_cache(pset, date)
+            ttl = self._ttl(date)
+            if ttl is not None and os.path.getmtime(path) + ttl < time.time():
+                return None
+            try:
+                res = MappedArxivDaily(DailyFile(path))
+            except ValueError:
+                # written by another version of DailyFile
+                return None
+            res.file.vectors = self._load_vectors(pset, date, res)
+            self._cached_daily.put((pset, date), res, ttl=ttl)
 
             return res
         except FileNotFoundError:
             return None
 
-    def get_by_date(self, date, categories=None, primary_set=None):
+    def is_stale(self, pset, date: str, daily) -> bool:
+        """
+        Whether the daily file of (pset, date) was rewritten, by another process for instance, since daily was loaded.
+        """
+        if not isinstance(daily, MappedArxivDaily):
+            return False
+        try:
+            st = os.stat(self._get_cache_path(pset, date) + ".pday")
+        except FileNotFoundError:
+            return False
+        return DailyFile.identity_of(st) != daily.file.identity
+
+    def reload(self, pset, date: str):
+        """
+        Drop the loaded daily set of (pset, date) and load its file again, None if it is not cached.
+        """
+        self._cached_daily.pop((pset, date), None)
+        return self.load_cache(pset, date)
+
+    def _load_vectors(self, pset, date: str, daily: MappedArxivDaily):
+        """
+        Map the vectors of a daily file, embedding its records first if they are missing or embed
+        another version of the file.
+        """
+        path = self._get_cache_path(pset, date) + ".vec"
+        n, dim, identity = len(daily), self.encoder.dim, daily.file.identity
+        try:
+            return load_vectors(path, n, dim, identity)
+        except (FileNotFoundError, ValueError):
+            write_vectors(path, self.encoder.encode_records(daily), identity)
+            return load_vectors(path, n, dim, identity)
+
+    def migrate(self):
+        """
+        Convert every legacy .zip cache under root to a daily file.
+        """
+        for pset in os.listdir(self.root):
+            pset_dir = os.path.join(self.root, pset)
+            if not os.path.isdir(pset_dir):
+                continue
+            for name in os.listdir(pset_dir):
+                date, ext = os.path.splitext(name)
+                if ext == ".zip" and not os.path.exists(os.path.join(pset_dir, date + ".pday")):
+                    self._load_legacy_cache(pset, date)
+
+    def build_index(self):
+        """
+        Add every cached daily set under root which is not in the index yet.
+        """
+        for pset in os.listdir(self.root):
+            pset_dir = os.path.join(self.root, pset)
+            if not os.path.isdir(pset_dir):
+                continue
+            for name in sorted(os.listdir(pset_dir)):
+                date, ext = os.path.splitext(name)
+                if ext == ".pday" and (pset, date) not in self.index.segments:
+                    daily = self.load_cache(pset, date)
+                    if daily is not None:
+                        self.index.add_daily(pset, date, daily)
+
+    def search(self, phrases=(), authors=(), start=None, end=None):
+        """
+        Yield the cached records containing all phrases (in title or abstract) and written by all authors,
+        see InvertedIndex.search. Daily sets which are not cached any more are skipped.
+        """
+        for id, pset, date in self.index.search(phrases, authors, start, end):
+            daily = self.load_cache(pset, date)
+            record = daily.get(id) if daily is not None else None
+            if record is not None:
+                yield record
+
+    def _load_or_request(self, pset, date: str):
+        res = self.load_cache(pset, date)
+        if res is None:
+            res = self.request_and_cache(pset, date)
+        return res
+
+    def get_daily(self, pset, date: str):
+        """
+        Returns the daily set of (pset, date) from the cache, harvesting it on a miss.
+        """
+        return self._single_flight.do((pset, date), self._load_or_request, pset, date)
+
+    def fetch(self, pset, date: str) -> Future:
+        """
+        Future of get_daily(pset, date) that never waits for a harvest: a cached daily set is loaded at once,
+        a miss is harvested on the fetch executor. Fetches of the same daily set share one harvest.
+        Raises FetchQueueFull if max_pending_fetches other daily sets are being harvested.
+        """
+        daily = self.load_cache(pset, date)
+        if daily is not None:
+            future = Future()
+            future.set_result(daily)
+            return future
+
+        key = (pset, date)
+        with self._fetch_lock:
+            future = self._fetches.get(key)
+            if future is not None:
+                return future
+            if len(self._fetches) >= self.max_pending_fetches:
+                raise FetchQueueFull(f"{len(self._fetches)} daily sets are already being harvested")
+            if self._fetch_executor is None:
+                self._fetch_executor = ThreadPoolExecutor(self.fetch_workers, thread_name_prefix="fetch")
+                # the executor joins its threads, queued harvests included, at interpreter exit before the
+                # atexit handlers run; the hooks of threading run in reverse order, so this one runs first
+                threading._register_atexit(self.close)
+            future = self._fetches[key] = self._fetch_executor.submit(self.get_daily, pset, date)
+        future.add_done_callback(lambda f: self._fetch_done(key, f))
+        return future
+
+    def _fetch_done(self, key, future):
+        with self._fetch_lock:
+            if self._fetches.get(key) is future:
+                del self._fetches[key]
+
+    def wait_for(self, keys, timeout):
+        """
+        Fetch the daily sets of keys, (pset, date) pairs, and wait for them at most timeout seconds.
+        Returns {key: daily set}, raises DailyPending if some are still being harvested.
+        """
+        futures = {key: self.fetch(*key) for key in keys}
+        _, not_done = wait_futures(futures.values(), timeout=timeout)
+        if not_done:
+            raise DailyPending([key for key, future in futures.items() if not future.done()])
+        return {key: future.result() for key, future in futures.items()}
+
+    def prefetch_range(self, start: str, end: str, categories=None, primary_set=None, timeout=0.0):
+        """
+        wait_for the daily sets of every available date in [start, end], so that get_by_range does not harvest.
+        """
+        if self.store is not None:
+            return
+        psets = self._psets(categories, primary_set)
+        d_date = datetime.strptime(start, "%Y-%m-%d")
+        d_end = min(datetime.strptime(end, "%Y-%m-%d"), datetime.utcnow() - timedelta(days=1))
+        keys = []
+        while d_date <= d_end:
+            keys.extend((pset, d_date.strftime("%Y-%m-%d")) for pset in psets)
+            d_date += timedelta(days=1)
+        self.wait_for(keys, timeout)
+
+    def close(self):
+        """
+        Drop the queued background harvests, the running ones finish. Called at interpreter exit.
+        """
+        if self._fetch_executor is not None:
+            self._fetch_executor.shutdown(wait=False, cancel_futures=True)
+            self._fetch_executor = None
+
+    def _psets(self, categories=None, primary_set=None):
+        psets = None
+        if categories is not None:
+            # categories of no available primary set have no records
+            psets = set(self.find_pset(category) for category in categories)
+            psets.discard(None)
+        else:
+            psets = set(primary_set)
+        return psets
+
+    def rank_by_date(self, date, records: Iterable[ArxivRecord], ranker: RelevanceRanker, categories=None, primary_set=None):
+        """
+        Sort records of date, as returned by get_by_date with the same categories/primary_set, by relevance.
+        """
+        if self.store is not None:
+            return ranker.rank(list(records), [self._store_term_stats(date, categories, primary_set)])
+        stats = []
+        for pset in sorted(self._psets(categories, primary_set)):
+            daily = self.get_daily(pset, date)
+            if daily is not None:
+                stats.append(TermStats.of(daily))
+        return ranker.rank(records, stats)
+
+    def _store_term_stats(self, date, categories=None, primary_set=None) -> TermStats:
+        """
+        Term statistics of every record of date in the store within categories, whatever config narrowed
+        the records to rank down to, so that scores do not depend on the config.
+        """
+        if categories is None:
+            psets = self._psets(categories, primary_set) or []
+            categories = [c for pset in psets for c in self.get_all_categories(pset)]
+        key = (date, tuple(sorted(categories)))
+        stats = self._store_stats.get(key)
+        if stats is None:
+            stats = TermStats(self.store.query_records(*self.day_window(date), categories))
+            # the crawl daemon may still update the records of a recent date
+            recent = datetime.strptime(date, "%Y-%m-%d") + timedelta(days=self.recent_days) > datetime.utcnow()
+            self._store_stats.put(key, stats, ttl=(self.recent_ttl or 300) if recent else None)
+        return stats
+
+    def get_by_date(self, date, categories=None, primary_set=None, config=None, wait=None):
         """
         If primary_set is None, then get primary_set by categories.
+        With a store, the categories, the date and the keywords of config are matched by its indexes,
+        the result is then a superset of config.filt of the result without store.
 
         Args:
             date: date
             categories: List[str] | None
             primary_set: str | None
+            config: CategoryFilterConfig | None, only used with a store
+            wait: None to harvest missing daily sets in the calling thread, otherwise seconds to wait for
+                  their background harvest before raising DailyPending
         """
-        psets = None
-        if categories is not None:
-            psets = set()
-            for category in categories:
-                psets.add(self.find_pset(category))
-        else:
-            psets = set(primary_set)
+        psets = self._psets(categories, primary_set)
         if psets is None:
             return None
 
@@ -214,14 +789,86 @@ class ArxivAsset:
         if d_date + timedelta(days=1) > now:
             return None
 
+        if self.store is not None:
+            if categories is None:
+                categories = [c for pset in psets for c in self.get_all_categories(pset)]
+            predicates = config.store_predicates() if config is not None else {}
+            return ArxivSet(self.store.query_records(*self.day_window(date), categories, **predicates))
+
+        if wait is not None:
+            dailies = self.wait_for([(pset, date) for pset in psets], wait)
         result = ArxivSet([])
         filter = ArxivFilter(categories=categories) if categories else None
         for pset in psets:
-            cur_res = self.load_cache(pset, date)
-            if cur_res is None:
-                cur_res = self.request_and_cache(pset, date)
+            cur_res = self.get_daily(pset, date) if wait is None else dailies[(pset, date)]
             if filter:
                 cur_res = filter(cur_res)
-            result = result.union(cur_res)
+            result.update(cur_res)
 
         return result
+
+    def iter_by_date(
+        self, date, categories=None, primary_set=None, config=None, after=None, chunk_size=256, wait=None
+    ):
+        """
+        Returns an iterator over the records of get_by_date passing config (if any) in id order,
+        starting after the id `after`; None if the date is not available.
+        The day is loaded at once, records are filtered `chunk_size` at a time as the iterator is consumed.
+        """
+        st = self.get_by_date(date, categories, primary_set, config=config, wait=wait)
+        if st is None:
+            return None
+        ids = sorted(st.id2records)
+        start = bisect.bisect_right(ids, after) if after is not None else 0
+        return self._iter_chunks(st, ids[start:], config, chunk_size)
+
+    @staticmethod
+    def _iter_chunks(st: ArxivSet, ids: List[str], config, chunk_size):
+        for i in range(0, len(ids), chunk_size):
+            chunk = [st.get(id) for id in ids[i:i + chunk_size]]
+            yield from config.filt(chunk) if config is not None else chunk
+
+    def _query_day(self, date: str, categories=None, config=None):
+        st = self.get_by_date(date, categories=categories, config=config)
+        if st is not None and config is not None:
+            st = config.filt(st)
+        return st
+
+    def get_by_range(self, start: str, end: str, categories=None, config=None, max_workers=4):
+        """
+        Yield the records of every date in [start, end] (oldest first), each paper only once.
+        Days are loaded and filtered by `max_workers` threads, at most `max_workers` days are held at a time.
+
+        Args:
+            categories: List[str] | None, see get_by_date
+            config: CategoryFilterConfig | None, applied to each day
+        """
+        d_start = datetime.strptime(start, "%Y-%m-%d")
+        d_end = datetime.strptime(end, "%Y-%m-%d")
+        dates = []
+        while d_start <= d_end:
+            dates.append(d_start.strftime("%Y-%m-%d"))
+            d_start += timedelta(days=1)
+
+        seen = set()
+        pending = deque()
+        executor = ThreadPoolExecutor(max_workers)
+        try:
+            for date in dates:
+                pending.append(executor.submit(self._query_day, date, categories, config))
+                if len(pending) >= max_workers:
+                    yield from self._unseen(pending.popleft().result(), seen)
+            while pending:
+                yield from self._unseen(pending.popleft().result(), seen)
+        finally:
+            # the generator is closed early when the client disconnects, do not wait for the queued days
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _unseen(data: Optional[ArxivSet], seen: set):
+        if data is None:
+            return
+        for record in data:
+            if record.id not in seen:
+                seen.add(record.id)
+                yield record
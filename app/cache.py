@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class BoundedCache:
+    """
+    Thread-safe mapping bounded by number of entries and/or their estimated size in bytes.
+    When full, the least recently ("lru") or least frequently ("lfu", ties by recency) used entry is evicted.
+    Entries can be given a time to live.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, policy="lru", sizeof=None) -> None:
+        """
+        Args:
+            max_entries: int | None
+            max_bytes: int | None, entries are measured by `sizeof`
+            policy: "lru" | "lfu"
+            sizeof: value -> estimated size in bytes
+        """
+        if policy not in ("lru", "lfu"):
+            raise ValueError(f"Unknown eviction policy {policy}")
+        if max_bytes is not None and sizeof is None:
+            raise ValueError("max_bytes requires sizeof")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.sizeof = sizeof
+        # key -> [value, size, expire_at, n_hits], least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.n_bytes -= entry[1]
+        return entry
+
+    def _expired(self, entry, now):
+        return entry[2] is not None and entry[2] <= now
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, time.monotonic()):
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            entry[3] += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, ttl=None):
+        size = self.sizeof(value) if self.sizeof is not None else 0
+        expire_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            n_hits = 0
+            if key in self._entries:
+                n_hits = self._remove(key)[3]
+            self._entries[key] = [value, size, expire_at, n_hits]
+            self.n_bytes += size
+            self._evict(keep=key)
+
+    def _is_full(self):
+        if self.max_entries is not None and len(self._entries) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self.n_bytes > self.max_bytes
+
+    def _evict(self, keep):
+        now = time.monotonic()
+        for key in [key for key, entry in self._entries.items() if self._expired(entry, now)]:
+            self._remove(key)
+            self.expirations += 1
+        while self._is_full() and len(self._entries) > 1:
+            if self.policy == "lru":
+                victim = next(iter(self._entries))
+            else:
+                victim = min((key for key in self._entries if key != keep), key=lambda key: self._entries[key][3])
+            self._remove(victim)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            return self._remove(key)[0]
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.n_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.n_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and not self._expired(entry, time.monotonic())
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time; callers arriving while it runs wait for and share its result.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        if not leader:
+            return call.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
@@ -1,4 +1,15 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional
 from app.asset import ArxivFilter, ArxivSet
+from arxiv import ArxivRecord
+
+logger = logging.getLogger(__name__)
 
 
 class CategoryFilterConfig:
@@ -7,20 +18,81 @@ class CategoryFilterConfig:
         self.authors = d.get("authors", [])
         self.keywd_in_title = d.get("keywd_in_title", [])
         self.keywd_in_abstract = d.get("keywd_in_abstract", [])
+        self.semantic = d.get("semantic", [])
+        self.semantic_threshold = float(d.get("semantic_threshold", 0.25))
 
         self.category_filter = ArxivFilter(categories=self.categories)
         self.authors_filter = ArxivFilter(authors=self.authors)
         self.title_filter = ArxivFilter(keypoints_in_title=self.keywd_in_title)
         self.abstract_filter = ArxivFilter(keypoints_in_abstract=self.keywd_in_abstract)
+        self.semantic_filter = ArxivFilter(semantic=self.semantic, semantic_threshold=self.semantic_threshold)
+        self._compile()
+
+    def _compile(self):
+        """
+        Compile the config into `category AND (authors OR title OR abstract OR semantic)`, cheapest checks first.
+        Empty criteria never match and are left out, a None criterion matches everything.
+        The semantic criterion is kept apart, to be evaluated in batches.
+        """
+        self._any_of = []
+        self._semantic = None
+        for check, keys in [
+            (self.authors_filter._filt_by_authors, self.authors_filter.authors),
+            (self.title_filter._filt_by_keypoint_in_title, self.title_filter.keywd_in_title),
+            (self.abstract_filter._filt_by_keypoint_in_abstract, self.abstract_filter.keywd_in_abstract),
+            (None, self.semantic_filter.semantic),
+        ]:
+            if keys is None:
+                self._any_of = None
+                self._semantic = None
+                break
+            if len(keys) > 0:
+                if check is None:
+                    self._semantic = self.semantic_filter
+                else:
+                    self._any_of.append(check)
+
+    def store_predicates(self) -> dict:
+        """
+        Keyword arguments of DBInterface.query_records narrowing a query down to the candidates of this config,
+        empty when the config cannot be pushed down (a None criterion, or a semantic criterion).
+        """
+        if self._any_of is None or self._semantic is not None:
+            return {}
+        return {
+            "title_phrases": list(self.keywd_in_title),
+            "abstract_phrases": list(self.keywd_in_abstract),
+            "authors": list(self.authors),
+        }
+
+    def _match_keys(self, record: ArxivRecord):
+        for check in self._any_of:
+            if check(record):
+                return True
+        return False
+
+    def match(self, record: ArxivRecord):
+        if not self.category_filter._filt_by_category(record):
+            return False
+        if self._any_of is None or self._match_keys(record):
+            return True
+        return self._semantic is not None and self._semantic._filt_by_semantic(record)
 
     def filt(self, data: ArxivSet):
-        tmp = self.category_filter(data)
-        filters = [self.authors_filter, self.title_filter, self.abstract_filter]
-        tmps = [f(tmp) for f in filters]
-        res = ArxivSet([])
-        for t in tmps:
-            res = res.union(t)
-        return res
+        """
+        Single pass over data, the result keeps the order of data.
+        Semantic similarities are computed in one batch for the records no other criterion matches.
+        """
+        if self._semantic is None:
+            return ArxivSet(record for record in data if self.match(record))
+
+        candidates = [record for record in data if self.category_filter._filt_by_category(record)]
+        keep = [self._match_keys(record) for record in candidates]
+        undecided = [i for i, k in enumerate(keep) if not k]
+        mask = self._semantic._semantic_mask([candidates[i] for i in undecided])
+        for i, m in zip(undecided, mask):
+            keep[i] = bool(m)
+        return ArxivSet(record for record, k in zip(candidates, keep) if k)
 
     def get_str_attr(self, attr):
         val = getattr(self, attr)
@@ -30,3 +102,90 @@ class CategoryFilterConfig:
             if isinstance(val, list):
                 return ",".join([str(v) for v in val])
             return str(val)
+
+
+class CompiledConfig:
+    __slots__ = ("name", "config", "digest", "stat", "checked_at")
+
+    def __init__(self, name, config: CategoryFilterConfig, digest, stat, checked_at) -> None:
+        self.name = name
+        self.config = config
+        # sha1 of the file content
+        self.digest = digest
+        # (mtime_ns, size) of the file when last read
+        self.stat = stat
+        self.checked_at = checked_at
+
+
+class ConfigRegistry:
+    """
+    The configs <root>/<name>.json, compiled once into CategoryFilterConfig and shared by every request.
+    A file is stat-ed at most every `poll_interval` seconds and compiled again only when its content changed.
+    """
+
+    def __init__(self, root="configs", poll_interval=1.0, on_change=None) -> None:
+        """
+        Args:
+            on_change: name -> None, called when the config of name changed or was removed
+        """
+        self.root = root
+        self.poll_interval = poll_interval
+        self.on_change = on_change
+        self._entries = {}
+        self._lock = threading.Lock()
+        for name in self.names():
+            self.get(name)
+
+    def get(self, name) -> Optional[CompiledConfig]:
+        """
+        Returns the compiled config of name, None if there is no such config.
+        """
+        entry = self._entries.get(name)
+        now = time.monotonic()
+        if entry is not None and now - entry.checked_at < self.poll_interval:
+            return entry
+        with self._lock:
+            entry = self._refresh(name, now)
+        return entry
+
+    def _refresh(self, name, now):
+        entry = self._entries.get(name)
+        path = os.path.join(self.root, name + ".json")
+        try:
+            st = os.stat(path)
+            stat = (st.st_mtime_ns, st.st_size)
+            if entry is not None and entry.stat == stat:
+                entry.checked_at = now
+                return entry
+            with open(path, "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            if self._entries.pop(name, None) is not None:
+                self._changed(name)
+            return None
+
+        digest = hashlib.sha1(raw).hexdigest()
+        if entry is not None and entry.digest == digest:
+            entry.stat, entry.checked_at = stat, now
+            return entry
+        try:
+            config = CategoryFilterConfig(json.loads(raw))
+        except ValueError as e:
+            # most likely caught while being written, keep serving the previous version
+            logger.warning(f"Invalid config {path}: {e}")
+            return entry
+        self._entries[name] = CompiledConfig(name, config, digest, stat, now)
+        if entry is not None:
+            self._changed(name)
+        return self._entries[name]
+
+    def _changed(self, name):
+        logger.info(f"Config {name} changed")
+        if self.on_change is not None:
+            self.on_change(name)
+
+    def names(self):
+        """
+        Names of the config files currently in root.
+        """
+        return [os.path.basename(path)[:-len(".json")] for path in sorted(glob.glob(os.path.join(self.root, "*.json")))]
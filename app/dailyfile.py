@@ -0,0 +1,267 @@
+"""
+On-disk format of the records of one (pset, date), read through mmap.
+
+    header      magic "PDAY", version (u16), number of records n (u32), number of columns (u16),
+                date (10 bytes), pset (32 bytes, zero padded)
+    directory   per column: name (16 bytes, zero padded), offset (u64), size (u64)
+    columns     string column: n + 1 u32 offsets followed by the utf-8 blob they index
+                "id_index": n u32 rows, sorted by id
+
+All integers are little-endian. List fields are stored joined by a separator.
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Iterable
+from app.utils import RecordTokens, atomic_write
+from arxiv import ArxivRecord
+
+_header = struct.Struct("<4sHIH10s32s")
+_column_entry = struct.Struct("<16sQQ")
+
+
+class DailyFile:
+    MAGIC = b"PDAY"
+    VERSION = 1
+
+    # (column, separator of list fields or None)
+    string_columns = (
+        ("id", None),
+        ("title", None),
+        ("abstract", None),
+        ("categories", " "),
+        ("authors", "\x1f"),
+        ("published", None),
+        ("updated", None),
+        ("title_tokens", " "),
+        ("abstract_tokens", " "),
+    )
+
+    def __init__(self, path) -> None:
+        """
+        Map the file at path. Raises ValueError if it is not a daily file of the current version.
+        """
+        self.path = path
+        self._views = []
+        # n x dim embeddings of the rows, attached by ArxivAsset
+        self.vectors = None
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # (size, mtime_ns) of the mapped file, tells its versions apart
+            self.identity = self.identity_of(os.fstat(f.fileno()))
+        try:
+            self._parse()
+        except (ValueError, struct.error):
+            self.close()
+            raise
+
+    @staticmethod
+    def identity_of(st: os.stat_result):
+        return st.st_size, st.st_mtime_ns
+
+    def _parse(self):
+        buf = self._view(memoryview(self._mmap))
+        magic, version, n, n_columns, date, pset = _header.unpack_from(buf, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f"{self.path} is not a daily file")
+        if version != self.VERSION:
+            raise ValueError(f"{self.path} has version {version}, expected {self.VERSION}")
+        self.n = n
+        self.date = date.decode("utf-8")
+        self.pset = pset.rstrip(b"\0").decode("utf-8")
+
+        self._columns = {}
+        self._blobs = {}
+        self._id_index = None
+        pos = _header.size
+        for _ in range(n_columns):
+            name, offset, size = _column_entry.unpack_from(buf, pos)
+            pos += _column_entry.size
+            name = name.rstrip(b"\0").decode("utf-8")
+            if name == "id_index":
+                self._id_index = self._u32_array(self._view(buf[offset:offset + size]))
+            else:
+                n_offset_bytes = 4 * (n + 1)
+                self._columns[name] = self._u32_array(self._view(buf[offset:offset + n_offset_bytes]))
+                self._blobs[name] = self._view(buf[offset + n_offset_bytes:offset + size])
+        for name, _ in self.string_columns:
+            if name not in self._columns:
+                raise ValueError(f"{self.path} misses column {name}")
+        if self._id_index is None:
+            raise ValueError(f"{self.path} misses its id index")
+
+    def _view(self, view):
+        # every view of the mmap has to be released before it can be closed
+        self._views.append(view)
+        return view
+
+    def _u32_array(self, buf):
+        if sys.byteorder == "little":
+            return self._view(buf.cast("I"))
+        arr = array("I", buf)
+        arr.byteswap()
+        return arr
+
+    @staticmethod
+    def _u32_bytes(values):
+        arr = array("I", values)
+        if sys.byteorder != "little":
+            arr.byteswap()
+        return arr.tobytes()
+
+    def get(self, column, row) -> str:
+        offsets = self._columns[column]
+        return str(self._blobs[column][offsets[row]:offsets[row + 1]], "utf-8")
+
+    def find(self, id) -> int:
+        """
+        Returns the row of id, or -1.
+        """
+        key = id.encode("utf-8")
+        offsets, blob = self._columns["id"], self._blobs["id"]
+        lo, hi = 0, self.n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            row = self._id_index[mid]
+            mid_key = bytes(blob[offsets[row]:offsets[row + 1]])
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                return row
+        return -1
+
+    def close(self):
+        self.vectors = None
+        self._columns = {}
+        self._blobs = {}
+        self._id_index = None
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+    def __len__(self):
+        return self.n
+
+    @classmethod
+    def _field_values(cls, record: ArxivRecord):
+        tokens = RecordTokens.of(record)
+        return {
+            "id": record.id,
+            "title": record.title,
+            "abstract": record.abstract,
+            "categories": record.categories,
+            "authors": record.authors,
+            "published": record.published or "",
+            "updated": record.updated or "",
+            "title_tokens": tokens.title,
+            "abstract_tokens": tokens.abstract,
+        }
+
+    @classmethod
+    def write(cls, path, date: str, pset: str, records: Iterable[ArxivRecord]):
+        rows = [cls._field_values(record) for record in records]
+        n = len(rows)
+        columns = []
+        for name, sep in cls.string_columns:
+            offsets = [0]
+            chunks = []
+            for row in rows:
+                val = row[name]
+                if sep is not None:
+                    val = sep.join(val)
+                b = val.encode("utf-8")
+                chunks.append(b)
+                offsets.append(offsets[-1] + len(b))
+            columns.append((name, cls._u32_bytes(offsets) + b"".join(chunks)))
+        ids = [row["id"].encode("utf-8") for row in rows]
+        columns.append(("id_index", cls._u32_bytes(sorted(range(n), key=ids.__getitem__))))
+
+        header = _header.pack(
+            cls.MAGIC, cls.VERSION, n, len(columns), date.encode("utf-8"), pset.encode("utf-8")
+        )
+        offset = len(header) + _column_entry.size * len(columns)
+        directory = []
+        for name, data in columns:
+            directory.append(_column_entry.pack(name.encode("utf-8"), offset, len(data)))
+            offset += len(data)
+
+        # written to a temporary file first, so that readers never map a partial file
+        with atomic_write(path) as f:
+            f.write(header)
+            f.write(b"".join(directory))
+            for _, data in columns:
+                f.write(data)
+
+
+class MappedRecord:
+    """
+    ArxivRecord-like view of one row of a DailyFile; fields are decoded when accessed.
+    """
+
+    __slots__ = ("_file", "_row", "_tokens")
+
+    def __init__(self, file: DailyFile, row: int) -> None:
+        self._file = file
+        self._row = row
+        self._tokens = None
+
+    def _split(self, column, sep):
+        val = self._file.get(column, self._row)
+        return tuple(sys.intern(v) for v in val.split(sep)) if val else ()
+
+    @property
+    def id(self):
+        return self._file.get("id", self._row)
+
+    @property
+    def title(self):
+        return self._file.get("title", self._row)
+
+    @property
+    def abstract(self):
+        return self._file.get("abstract", self._row)
+
+    @property
+    def categories(self):
+        return self._split("categories", " ")
+
+    @property
+    def authors(self):
+        val = self._file.get("authors", self._row)
+        return tuple(val.split("\x1f")) if val else ()
+
+    @property
+    def published(self):
+        return self._file.get("published", self._row)
+
+    @property
+    def updated(self):
+        return self._file.get("updated", self._row)
+
+    @property
+    def tokens(self):
+        if self._tokens is None:
+            self._tokens = RecordTokens(self._split("title_tokens", " "), self._split("abstract_tokens", " "))
+        return self._tokens
+
+    @tokens.setter
+    def tokens(self, tokens):
+        self._tokens = tokens
+
+    def to_record(self) -> ArxivRecord:
+        record = ArxivRecord(
+            id=self.id,
+            title=self.title,
+            abstract=self.abstract,
+            categories=self.categories,
+            authors=self.authors,
+            published=self.published,
+            updated=self.updated,
+        )
+        record.tokens = self._tokens
+        return record
@@ -0,0 +1,244 @@
+"""
+Digests of the papers passing a config on a date, precomputed by the crawl daemon so that the config pages
+only look records up by id.
+
+A digest is stored as <root>/<config name>/<date>.json:
+    config_digest   sha1 of the config file it was computed with
+    psets           the primary sets the records were taken from
+    ids, pset_index the ids passing the config in listing order, and the index in psets of the daily set of each
+    ranking         positions in ids by decreasing relevance (see RelevanceRanker)
+    highlights      id -> {"title": [[start, end], ...], "abstract": [...]}, character spans of the keywords
+"""
+import json
+import logging
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from app.asset import ArxivAsset, ArxivDaily
+from app.config import CategoryFilterConfig, CompiledConfig, ConfigRegistry
+from app.rank import RelevanceRanker
+from app.utils import NLP, atomic_write
+
+logger = logging.getLogger(__name__)
+
+_default_digest_root = os.path.join(os.path.dirname(os.path.dirname(__file__)), "digests")
+
+
+class Highlighter:
+    """
+    Character spans of the title and abstract keywords of a config in the title and abstract of records.
+    A phrase matches its tokens separated by any whitespace, case insensitively.
+    """
+
+    def __init__(self, config: CategoryFilterConfig) -> None:
+        self.patterns = {
+            "title": self._compile(config.keywd_in_title),
+            "abstract": self._compile(config.keywd_in_abstract),
+        }
+
+    @staticmethod
+    def _compile(phrases):
+        alternatives = []
+        for phrase in phrases or []:
+            tokens = NLP.tokenize(phrase)
+            if tokens:
+                alternatives.append(r"\s*".join(re.escape(token) for token in tokens))
+        if not alternatives:
+            return None
+        # longest first, so that the longest of overlapping phrases is highlighted
+        alternatives.sort(key=len, reverse=True)
+        return re.compile(r"(?<!\w)(?:" + "|".join(alternatives) + r")(?!\w)", re.IGNORECASE)
+
+    def spans(self, record) -> Dict[str, List[List[int]]]:
+        res = {}
+        for field, pattern in self.patterns.items():
+            if pattern is not None:
+                spans = [[m.start(), m.end()] for m in pattern.finditer(getattr(record, field))]
+                if spans:
+                    res[field] = spans
+        return res
+
+    def of(self, records) -> Dict[str, Dict[str, List[List[int]]]]:
+        res = {}
+        for record in records:
+            spans = self.spans(record)
+            if spans:
+                res[record.id] = spans
+        return res
+
+
+class ConfigDigest:
+    VERSION = 1
+
+    __slots__ = ("name", "date", "config_digest", "psets", "ids", "pset_index", "ranking", "highlights")
+
+    def __init__(self, name, date, config_digest, psets, ids, pset_index, ranking, highlights) -> None:
+        self.name = name
+        self.date = date
+        self.config_digest = config_digest
+        self.psets = psets
+        self.ids = ids
+        self.pset_index = pset_index
+        self.ranking = ranking
+        self.highlights = highlights
+
+    @classmethod
+    def build(cls, compiled: CompiledConfig, date: str, asset: ArxivAsset) -> Optional["ConfigDigest"]:
+        """
+        Returns None if the daily sets of date are not cached, they are never harvested here.
+        """
+        config = compiled.config
+        categories = config.categories or []
+        psets = sorted(asset._psets(categories))
+        dailies = [asset.load_cache(pset, date) for pset in psets]
+        if not dailies or None in dailies:
+            return None
+        st = asset.get_by_date(date, categories=categories)
+        if st is None:
+            return None
+        records = config.filt(st).get_records()
+        pset_index = [
+            next(i for i, daily in enumerate(dailies) if daily is not None and record.id in daily)
+            for record in records
+        ]
+        positions = {record.id: i for i, record in enumerate(records)}
+        ranked = asset.rank_by_date(date, records, RelevanceRanker(config), categories=categories)
+        return cls(
+            compiled.name, date, compiled.digest, psets, [record.id for record in records], pset_index,
+            [positions[record.id] for record in ranked], Highlighter(config).of(records),
+        )
+
+    def records(self, asset: ArxivAsset, sort=None, wait=None):
+        """
+        The records of the digest looked up in the daily sets of asset, by relevance if sort is "relevance".
+        wait is that of ArxivAsset.get_by_date.
+        Returns None if some records are not in the daily sets, which are then not those of the digest.
+        """
+        if wait is None:
+            dailies = [asset.get_daily(pset, self.date) for pset in self.psets]
+        else:
+            fetched = asset.wait_for([(pset, self.date) for pset in self.psets], wait)
+            dailies = [fetched[(pset, self.date)] for pset in self.psets]
+        # the crawl daemon rewrites the daily files it publishes digests of
+        dailies = [
+            asset.reload(pset, self.date) if daily is None or asset.is_stale(pset, self.date, daily) else daily
+            for pset, daily in zip(self.psets, dailies)
+        ]
+        order = self.ranking if sort == "relevance" else range(len(self.ids))
+        records = []
+        for i in order:
+            daily = dailies[self.pset_index[i]]
+            record = daily.get(self.ids[i]) if daily is not None else None
+            if record is None:
+                logger.warning(f"Digest of ({self.name}, {self.date}) lists {self.ids[i]}, which is not cached")
+                return None
+            records.append(record)
+        return records
+
+    def to_dict(self):
+        return {"version": self.VERSION, **{attr: getattr(self, attr) for attr in self.__slots__}}
+
+    @classmethod
+    def from_dict(cls, d) -> "ConfigDigest":
+        if d.get("version") != cls.VERSION:
+            raise ValueError(f"Digest version {d.get('version')} is not {cls.VERSION}")
+        return cls(*(d[attr] for attr in cls.__slots__))
+
+
+class DigestStore:
+    """
+    Digest files of <root>, written atomically. Loaded digests are kept until their file changes.
+    """
+
+    def __init__(self, root=_default_digest_root) -> None:
+        self.root = root
+        # (name, date) -> (mtime_ns, ConfigDigest)
+        self._loaded = {}
+
+    def _path(self, name, date):
+        return os.path.join(self.root, name, date + ".json")
+
+    def write(self, digest: ConfigDigest):
+        with atomic_write(self._path(digest.name, digest.date), "w") as f:
+            json.dump(digest.to_dict(), f, separators=(",", ":"))
+
+    def load(self, name, date) -> Optional[ConfigDigest]:
+        """
+        Returns the digest of (name, date), None if there is none or it cannot be read.
+        """
+        path = self._path(name, date)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            loaded = self._loaded.get((name, date))
+            if loaded is not None and loaded[0] == mtime:
+                return loaded[1]
+            with open(path, "r") as f:
+                digest = ConfigDigest.from_dict(json.load(f))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Invalid digest {path}: {e}")
+            return None
+        self._loaded[(name, date)] = (mtime, digest)
+        return digest
+
+
+class DigestPublisher:
+    """
+    Caches the daily sets of freshly harvested dates and writes the digest of every config on them.
+    """
+
+    def __init__(self, asset: ArxivAsset, configs: ConfigRegistry, store: DigestStore, source=None) -> None:
+        """
+        Args:
+            source: db.DBInterface holding the harvested records the daily sets are made of,
+                    None to publish the daily sets cached in asset as they are
+        """
+        self.asset = asset
+        self.configs = configs
+        self.store = store
+        self.source = source
+
+    def _source_has_day(self, pset, date: str):
+        """
+        Whether source holds every record of the daily set of date: its harvest of pset is complete past date,
+        whose datestamps may still receive records until the day is over.
+        """
+        state = self.source.load_harvest_state(pset)
+        return (
+            state is not None and not state["resumption_token"]
+            and state["watermark"] is not None and state["watermark"][:10] > date
+        )
+
+    def _cache_from_source(self, pset, date: str):
+        if not self._source_has_day(pset, date):
+            # the cached daily set, if any, is published as it is
+            return
+        records = self.source.query_records(*ArxivAsset.day_window(date), ArxivAsset.get_all_categories(pset))
+        self.asset.cache(self.asset._ingest(ArxivDaily(date, pset, records)), pset, date)
+
+    def publish(self, psets, date: str):
+        if self.source is not None:
+            for pset in psets:
+                if ArxivAsset.is_valid_pset(pset):
+                    self._cache_from_source(pset, date)
+        for name in self.configs.names():
+            compiled = self.configs.get(name)
+            if compiled is None:
+                continue
+            try:
+                digest = ConfigDigest.build(compiled, date, self.asset)
+                if digest is not None:
+                    self.store.write(digest)
+                    logger.info(f"Digest of ({name}, {date}): {len(digest.ids)} paper(s)")
+            except Exception as e:
+                # only the digest of this config is skipped
+                logger.error(f"Digest of ({name}, {date}) receives an exception: {e}")
+
+    def publish_recent(self, psets, now: datetime, days=2):
+        """
+        Publish the last `days` dates whose papers are complete at now (yesterday first).
+        """
+        for offset in range(1, days + 1):
+            self.publish(psets, (now - timedelta(days=offset)).strftime("%Y-%m-%d"))
@@ -0,0 +1,278 @@
+"""
+Hashed-feature embeddings of records and queries, for semantic filtering without any model download.
+
+Features are the words, word bigrams and character trigrams of the title (weighted twice) and abstract
+tokens, hashed with crc32 into `dim` signed buckets; vectors are L2 normalized, so the dot product is the
+cosine similarity.
+
+Vectors of a daily file are cached next to it (<date>.vec):
+    header  magic "PVEC", version (u16), number of rows n (u32), dim (u16), padding to 16 bytes,
+            size (u64) and mtime in ns (i64) of the daily file embedded
+    body    n x dim little-endian float32, row i embeds row i of the daily file
+"""
+import struct
+import threading
+import zlib
+from typing import Iterable, List
+import numpy as np
+from app.dailyfile import MappedRecord
+from app.utils import NLP, RecordTokens, atomic_write
+
+_header = struct.Struct("<4sHIH4xQq")
+
+# too common to tell records apart
+_stop_words = frozenset(
+    "a an and are as at be by for from has have in into is it its of on or our that the their these this "
+    "to we which with".split()
+)
+
+
+def _written(buf: np.ndarray, size: int, values) -> np.ndarray:
+    """
+    Returns buf with values written at size, reallocated with twice the capacity if they do not fit.
+    Entries before size are never modified, so that readers of buf[:size] need no lock.
+    """
+    end = size + len(values)
+    if end > len(buf):
+        grown = np.empty(max(end, 2 * len(buf)), dtype=buf.dtype)
+        grown[:size] = buf[:size]
+        buf = grown
+    buf[size:end] = values
+    return buf
+
+
+class _Vocabulary:
+    """
+    Tokens seen by an encoder and the hashed features of each, in arrays grown by doubling
+    so that adding tokens only costs their own features.
+    """
+
+    def __init__(self) -> None:
+        # token -> id, or -1 for stop words
+        self.ids = {}
+        self.n = 0
+        # hashes of the tokens added since the arrays were last built
+        self.new_words, self.new_subwords, self.new_counts = [], [], []
+        self.words = np.empty(0, dtype=np.uint64)
+        self.word_buckets = np.empty(0, dtype=np.int64)
+        self.word_signs = np.empty(0, dtype=np.float32)
+        # character trigrams of token i are subword_*[subword_ptr[i]:subword_ptr[i + 1]]
+        self.subword_ptr = np.zeros(1, dtype=np.int64)
+        self.subword_buckets = np.empty(0, dtype=np.int64)
+        self.subword_weights = np.empty(0, dtype=np.float32)
+
+    def add(self, word_hash, subword_hashes) -> int:
+        id = self.n
+        self.n += 1
+        self.new_words.append(word_hash)
+        self.new_subwords.extend(subword_hashes)
+        self.new_counts.append(len(subword_hashes))
+        return id
+
+    def arrays(self, buckets):
+        """
+        Args:
+            buckets: hashes -> (buckets, signs), see HashingEncoder._buckets
+        """
+        if self.new_words:
+            n_built = self.n - len(self.new_words)
+            n_subwords = int(self.subword_ptr[n_built])
+            words = np.array(self.new_words, dtype=np.uint64)
+            word_buckets, word_signs = buckets(words)
+            counts = np.array(self.new_counts, dtype=np.int64)
+            subword_buckets, subword_signs = buckets(np.array(self.new_subwords, dtype=np.uint64))
+            # the trigrams of a word have as much norm as the word, so that "model" and "models" are close
+            subword_weights = np.repeat(1 / np.sqrt(np.maximum(counts, 1)), counts).astype(np.float32)
+            self.words = _written(self.words, n_built, words)
+            self.word_buckets = _written(self.word_buckets, n_built, word_buckets)
+            self.word_signs = _written(self.word_signs, n_built, word_signs)
+            self.subword_ptr = _written(self.subword_ptr, n_built + 1, n_subwords + np.cumsum(counts))
+            self.subword_buckets = _written(self.subword_buckets, n_subwords, subword_buckets)
+            self.subword_weights = _written(self.subword_weights, n_subwords, subword_signs * subword_weights)
+            self.new_words, self.new_subwords, self.new_counts = [], [], []
+        n, n_subwords = self.n, int(self.subword_ptr[self.n])
+        return (
+            self.words[:n], self.word_buckets[:n], self.word_signs[:n], self.subword_ptr[:n + 1],
+            self.subword_buckets[:n_subwords], self.subword_weights[:n_subwords],
+        )
+
+
+class HashingEncoder:
+    VERSION = 2
+    title_weight = 2.0
+    # records encoded at once, bounds the temporary feature arrays
+    batch_size = 512
+
+    def __init__(self, dim=512, max_vocab=1 << 17) -> None:
+        """
+        Args:
+            max_vocab: tokens whose features are kept, the vocabulary starts over beyond it
+        """
+        self.dim = dim
+        self.max_vocab = max_vocab
+        self._vocab = _Vocabulary()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _hash(s):
+        return zlib.crc32(s.encode("utf-8"))
+
+    def _vocabulary(self) -> _Vocabulary:
+        with self._lock:
+            if len(self._vocab.ids) >= self.max_vocab:
+                # features do not depend on token ids, dropping the vocabulary only costs hashing again
+                self._vocab = _Vocabulary()
+            return self._vocab
+
+    def _token_id(self, vocab: _Vocabulary, token):
+        id = vocab.ids.get(token)
+        if id is not None:
+            return id
+        with self._lock:
+            id = vocab.ids.get(token)
+            if id is None:
+                if token in _stop_words or not any(c.isalnum() for c in token):
+                    id = -1
+                else:
+                    padded = f"<{token}>"
+                    id = vocab.add(
+                        self._hash(token), [self._hash(padded[i:i + 3]) for i in range(len(padded) - 2)]
+                    )
+                vocab.ids[token] = id
+            return id
+
+    def _buckets(self, hashes):
+        """
+        Returns the bucket and sign of hashes. The bit above the bucket gives the sign,
+        so that collisions cancel out on average.
+        """
+        buckets = (hashes % np.uint64(self.dim)).astype(np.int64)
+        signs = np.where((hashes // np.uint64(self.dim)) & np.uint64(1), -1.0, 1.0).astype(np.float32)
+        return buckets, signs
+
+    def _vocab_arrays(self, vocab: _Vocabulary):
+        with self._lock:
+            return vocab.arrays(self._buckets)
+
+    def _encode(self, docs: List[List]) -> np.ndarray:
+        """
+        Args:
+            docs: per vector, a list of (tokens, weight)
+        """
+        res = np.empty((len(docs), self.dim), dtype=np.float32)
+        for start in range(0, len(docs), self.batch_size):
+            res[start:start + self.batch_size] = self._encode_batch(docs[start:start + self.batch_size])
+        return res
+
+    def _encode_batch(self, docs: List[List]) -> np.ndarray:
+        vocab = self._vocabulary()
+        get_id = vocab.ids.get
+        ids, field_rows, field_weights, field_lens = [], [], [], []
+        for row, doc in enumerate(docs):
+            for tokens, weight in doc:
+                field_ids = [get_id(token) for token in tokens]
+                if None in field_ids:
+                    field_ids = [self._token_id(vocab, token) for token in tokens]
+                ids.extend(field_ids)
+                field_rows.append(row)
+                field_weights.append(weight)
+                field_lens.append(len(field_ids))
+        word_hashes, word_buckets, word_signs, subword_ptr, subword_buckets, subword_weights = (
+            self._vocab_arrays(vocab)
+        )
+        # per occurrence of a token which is not a stop word
+        ids = np.array(ids, dtype=np.int64)
+        kept = ids >= 0
+        ids = ids[kept]
+        rows = np.repeat(np.array(field_rows, dtype=np.int64), field_lens)[kept]
+        weights = np.repeat(np.array(field_weights, dtype=np.float32), field_lens)[kept]
+        fields = np.repeat(np.arange(len(field_lens)), field_lens)[kept]
+
+        # bigrams of adjacent words of the same field
+        words = word_hashes[ids]
+        same_field = fields[:-1] == fields[1:]
+        bigram_buckets, bigram_signs = self._buckets(
+            (((words[:-1] * np.uint64(1000003)) ^ words[1:]) & np.uint64(0xFFFFFFFF))[same_field]
+        )
+        # every character trigram of every word
+        counts = subword_ptr[ids + 1] - subword_ptr[ids]
+        ends = np.cumsum(counts)
+        subword_idx = np.repeat(subword_ptr[ids] - (ends - counts), counts) + np.arange(ends[-1] if len(ends) else 0)
+
+        buckets = np.concatenate((word_buckets[ids], bigram_buckets, subword_buckets[subword_idx]))
+        feature_rows = np.concatenate((rows, rows[:-1][same_field], np.repeat(rows, counts)))
+        feature_weights = np.concatenate((
+            weights * word_signs[ids],
+            weights[:-1][same_field] * bigram_signs,
+            np.repeat(weights, counts) * subword_weights[subword_idx],
+        ))
+        flat = np.bincount(feature_rows * self.dim + buckets, weights=feature_weights, minlength=len(docs) * self.dim)
+        res = flat.astype(np.float32).reshape(len(docs), self.dim)
+        norms = np.linalg.norm(res, axis=1, keepdims=True)
+        return res / np.maximum(norms, 1e-12)
+
+    def encode_records(self, records: Iterable) -> np.ndarray:
+        docs = []
+        for record in records:
+            tokens = RecordTokens.of(record)
+            docs.append([(tokens.title, self.title_weight), (tokens.abstract, 1.0)])
+        return self._encode(docs)
+
+    def encode_texts(self, texts: Iterable[str]) -> np.ndarray:
+        return self._encode([[(NLP.tokenize(text), 1.0)] for text in texts])
+
+    def record_vectors(self, records: List) -> np.ndarray:
+        """
+        Vectors of records, read from the vectors of their daily file when it has them, encoded otherwise.
+        """
+        res = np.empty((len(records), self.dim), dtype=np.float32)
+        # id(file) -> (vectors, positions in records, rows in file)
+        mapped = {}
+        missing = []
+        for i, record in enumerate(records):
+            vectors = record._file.vectors if isinstance(record, MappedRecord) else None
+            if vectors is not None and vectors.shape[1] == self.dim:
+                entry = mapped.setdefault(id(vectors), (vectors, [], []))
+                entry[1].append(i)
+                entry[2].append(record._row)
+            else:
+                missing.append(i)
+        for vectors, positions, rows in mapped.values():
+            res[positions] = vectors[rows]
+        if missing:
+            res[missing] = self.encode_records([records[i] for i in missing])
+        return res
+
+
+default_encoder = HashingEncoder()
+
+
+def write_vectors(path, vectors: np.ndarray, source=(0, 0)):
+    """
+    Args:
+        source: (size, mtime_ns) of the daily file embedded, see DailyFile.identity
+    """
+    with atomic_write(path) as f:
+        f.write(_header.pack(b"PVEC", HashingEncoder.VERSION, vectors.shape[0], vectors.shape[1], *source))
+        f.write(np.ascontiguousarray(vectors, dtype="<f4").tobytes())
+
+
+def load_vectors(path, n, dim, source=None) -> np.ndarray:
+    """
+    Map the vectors at path. Raises ValueError unless they are n vectors of dim of the current version,
+    embedding the daily file of identity source if it is not None.
+    """
+    with open(path, "rb") as f:
+        header = f.read(_header.size)
+    if len(header) < _header.size:
+        raise ValueError(f"{path} is not a vectors file")
+    magic, version, n_rows, n_dim, size, mtime_ns = _header.unpack(header)
+    if magic != b"PVEC" or version != HashingEncoder.VERSION:
+        raise ValueError(f"{path} is not a vectors file of version {HashingEncoder.VERSION}")
+    if (n_rows, n_dim) != (n, dim):
+        raise ValueError(f"{path} has {n_rows} x {n_dim} vectors, expected {n} x {dim}")
+    if source is not None and (size, mtime_ns) != tuple(source):
+        raise ValueError(f"{path} embeds another version of its daily file")
+    if n == 0:
+        return np.zeros((0, dim), dtype=np.float32)
+    return np.memmap(path, dtype="<f4", mode="r", offset=_header.size, shape=(n, dim))
@@ -0,0 +1,63 @@
+"""
+JSON and NDJSON bodies of the /api routes, generated record by record so that nothing but the current
+record is held in memory.
+
+Papers are listed in id order; the cursor of the next page is the id of the last paper received.
+"""
+import json
+from itertools import islice
+from typing import Iterator, List, Optional
+
+paper_fields = ("id", "title", "abstract", "categories", "authors", "published", "updated")
+default_limit = 100
+max_limit = 1000
+
+
+def parse_fields(s: Optional[str]) -> List[str]:
+    """
+    Raises ValueError for an unknown field.
+    """
+    if not s:
+        return list(paper_fields)
+    fields = s.split(",")
+    unknown = [f for f in fields if f not in paper_fields]
+    if unknown:
+        raise ValueError(f"Unknown fields {','.join(unknown)}, available fields are {','.join(paper_fields)}")
+    return fields
+
+
+def parse_limit(s: Optional[str], default=default_limit) -> Optional[int]:
+    """
+    Raises ValueError unless s is empty or in [1, max_limit].
+    """
+    if not s:
+        return default
+    limit = int(s)
+    if not 0 < limit <= max_limit:
+        raise ValueError(f"limit must be in [1, {max_limit}]")
+    return limit
+
+
+def _paper(record, fields) -> str:
+    return json.dumps({field: getattr(record, field) for field in fields}, ensure_ascii=False)
+
+
+def ndjson_lines(records: Iterator, fields, limit=None):
+    """
+    One paper per line, at most limit papers (all if None).
+    """
+    for record in islice(records, limit):
+        yield _paper(record, fields) + "\n"
+
+
+def json_chunks(date, records: Iterator, fields, limit=default_limit):
+    """
+    {"date": ..., "papers": [...], "next_cursor": ...}, next_cursor is null on the last page.
+    """
+    yield '{"date": ' + json.dumps(date) + ', "papers": ['
+    last = None
+    for i, record in enumerate(islice(records, limit)):
+        yield (", " if i else "") + _paper(record, fields)
+        last = record.id
+    next_cursor = last if last is not None and next(records, None) is not None else None
+    yield '], "next_cursor": ' + json.dumps(next_cursor) + "}"
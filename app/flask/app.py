@@ -1,21 +1,101 @@
-from flask import Flask, render_template, request
-from app.asset import ArxivAsset
-from app.config import CategoryFilterConfig
+from flask import Flask, Response, jsonify, make_response, render_template, request, stream_template
+from markupsafe import Markup, escape
+from app.flask import api
+from app.asset import ArxivAsset, DailyPending, FetchQueueFull
+from app.config import CategoryFilterConfig, CompiledConfig, ConfigRegistry
+from app.digest import DigestStore, Highlighter
+from app.index import InvertedIndex
+from app.flask.responses import ResponseCache
+from app.rank import RelevanceRanker
+from db import SQLiteInterface
 from datetime import datetime, timezone, timedelta
 import os
-import json
 
 app = Flask(__name__)
 
-arxiv_asset = ArxivAsset()
+# query the SQLite store filled by the crawl daemon (`daemon.py --sqlite`) instead of harvesting daily sets
+store_path = os.environ.get("PAPERDAILY_SQLITE")
+# estimated size of the loaded daily sets kept in memory
+cache_max_mb = int(os.environ.get("PAPERDAILY_CACHE_MB", 256))
+# missing days are harvested by 4 background threads, never by the request threads
+arxiv_asset = ArxivAsset(
+    cache_max_bytes=cache_max_mb << 20,
+    index=InvertedIndex(),
+    store=SQLiteInterface(store_path) if store_path else None,
+    fetch_workers=4,
+)
+max_range_days = 31
+# seconds a request waits for missing days by default (`wait=` to change it, up to max_fetch_wait)
+# before answering that they are pending
+fetch_wait = 1.0
+max_fetch_wait = 30.0
+pending_retry_after = 5
+response_cache = ResponseCache(recent_days=arxiv_asset.recent_days)
+# a changed config only invalidates its own pages
+config_registry = ConfigRegistry("configs", on_change=lambda name: response_cache.invalidate(("config", name)))
+# digests of the configs written by the crawl daemon
+digest_store = DigestStore()
+
+
+@app.template_filter("highlight")
+def highlight(text, spans):
+    """
+    text with the [start, end] spans wrapped in <mark>.
+    """
+    if not spans:
+        return text
+    parts, last = [], 0
+    for start, end in spans:
+        parts.append(escape(text[last:start]))
+        parts.append(Markup("<mark>") + escape(text[start:end]) + Markup("</mark>"))
+        last = end
+    parts.append(escape(text[last:]))
+    return Markup("").join(parts)
+
+
+def _fetch_wait():
+    try:
+        return min(max(float(request.args.get("wait", fetch_wait)), 0.0), max_fetch_wait)
+    except ValueError:
+        return fetch_wait
+
+
+@app.errorhandler(DailyPending)
+def pending(e: DailyPending):
+    """
+    202 asking to retry while the papers are harvested in the background.
+    """
+    date = ", ".join(sorted(set(date for _, date in e.keys)))
+    if request.path.startswith("/api/"):
+        response = jsonify({"status": "pending", "date": date, "retry_after": pending_retry_after})
+    else:
+        response = make_response(render_template("pending.html", date=date, retry_after=pending_retry_after))
+    response.status_code = 202
+    response.headers["Retry-After"] = str(pending_retry_after)
+    response.cache_control.no_store = True
+    return response
+
+
+@app.errorhandler(FetchQueueFull)
+def busy(e: FetchQueueFull):
+    """
+    503 asking to retry once the harvests already queued are done.
+    """
+    message = "Too many days are being harvested, retry later"
+    if request.path.startswith("/api/"):
+        response = jsonify({"error": message})
+    else:
+        response = Response(message, mimetype="text/plain")
+    response.status_code = 503
+    response.headers["Retry-After"] = str(pending_retry_after)
+    response.cache_control.no_store = True
+    return response
 
 
 def _get_config(name):
-    config_path = os.path.join("configs", name + ".json")
-    if os.path.exists(config_path):
-        with open(config_path, "r") as f:
-            d = json.load(f)
-            return CategoryFilterConfig(d)
+    compiled = config_registry.get(name)
+    if compiled is not None:
+        return compiled.config
     return None
 
 
@@ -31,27 +111,30 @@ def render_papers404(date):
     return render_template("papers404.html", date=date)
 
 
-def _query(date, config: CategoryFilterConfig):
+def _query(date, config: CategoryFilterConfig, sort=None):
+    """
+    Returns the page and whether it lists papers.
+    """
     if not _validate_date(date):
-        return render_papers404("invalid")
+        return render_papers404("invalid"), False
 
-    st = arxiv_asset.get_by_date(date, categories=config.categories)
+    st = arxiv_asset.get_by_date(date, categories=config.categories, config=config, wait=_fetch_wait())
     if st:
         st = config.filt(st)
-        papers = st.get_records()
-        return render_template("paperlist.html", date=date, papers=papers)
+        if sort == "relevance":
+            papers = arxiv_asset.rank_by_date(date, st, RelevanceRanker(config), categories=config.categories)
+        else:
+            papers = st.get_records()
+        html = render_template("paperlist.html", date=date, papers=papers, highlights=Highlighter(config).of(papers))
+        return html, True
     else:
-        return render_papers404(date)
+        return render_papers404(date), False
 
 
-@app.route("/<pset>/")
-def query(pset):
+def _pset_args(pset):
     """
-    Set arguments through url
+    Config dict of the arguments of a /<pset>/ url.
     """
-    if not ArxivAsset.is_valid_pset(pset):
-        return render_papers404("invalid")
-
     d = request.args.to_dict()
 
     def check_and_split(d, attr):
@@ -70,11 +153,28 @@ def query(pset):
     check_and_split(d, "authors")
     check_and_split(d, "keywd_in_title")
     check_and_split(d, "keywd_in_abstract")
+    return d
 
-    date = d.get("date", "")
-    config = CategoryFilterConfig(d)
 
-    return _query(date, config)
+@app.route("/<pset>/")
+def query(pset):
+    """
+    Set arguments through url
+    """
+    if not ArxivAsset.is_valid_pset(pset):
+        return render_papers404("invalid")
+
+    d = _pset_args(pset)
+    date = d.get("date", "")
+    if not _validate_date(date):
+        return render_papers404("invalid")
+    sort = d.pop("sort", None)
+    d.pop("date", None)
+    # the filters do not depend on the order of the values
+    key = ("pset", pset, date, sort, tuple(sorted(
+        (attr, tuple(sorted(val)) if isinstance(val, list) else val) for attr, val in d.items()
+    )))
+    return response_cache.respond(request, key, date, lambda: _query(date, CategoryFilterConfig(d), sort=sort))
 
 
 def query_config(config_name, offset):
@@ -85,11 +185,101 @@ def query_config(config_name, offset):
         return render_papers404(d_today)
     date = d_today - timedelta(days=offset)
     s_date = date.strftime("%Y-%m-%d")
-    config = _get_config(config_name)
+    compiled = config_registry.get(config_name)
 
-    if config is None:
+    if compiled is None:
         return render_papers404(s_date)
-    return _query(s_date, config=config)
+    sort = request.args.get("sort")
+    key = ("config", config_name, compiled.digest, s_date, sort)
+    return response_cache.respond(request, key, s_date, lambda: _query_config(s_date, compiled, sort=sort))
+
+
+def _query_config(date, compiled: CompiledConfig, sort=None):
+    """
+    The page of a config, from the digest of the crawl daemon if it was computed with this version of the config,
+    and whether it lists papers.
+    """
+    digest = digest_store.load(compiled.name, date)
+    if digest is None or digest.config_digest != compiled.digest:
+        return _query(date, compiled.config, sort=sort)
+    papers = digest.records(arxiv_asset, sort=sort, wait=_fetch_wait())
+    if papers is None:
+        return _query(date, compiled.config, sort=sort)
+    return render_template("paperlist.html", date=date, papers=papers, highlights=digest.highlights), True
+
+
+def _api_error(status, message):
+    return jsonify({"error": message}), status
+
+
+def _api_papers(date, config: CategoryFilterConfig):
+    """
+    Papers of date passing config as streamed JSON, or NDJSON with format=ndjson, paginated by
+    limit and cursor (the id of the last paper of the previous page) and restricted to fields.
+    """
+    if not _validate_date(date):
+        return _api_error(400, f"Invalid date {date!r}, expected %Y-%m-%d")
+    ndjson = request.args.get("format") == "ndjson"
+    try:
+        fields = api.parse_fields(request.args.get("fields"))
+        limit = api.parse_limit(request.args.get("limit"), default=None if ndjson else api.default_limit)
+    except ValueError as e:
+        return _api_error(400, str(e))
+
+    records = arxiv_asset.iter_by_date(
+        date, categories=config.categories, config=config, after=request.args.get("cursor") or None,
+        wait=_fetch_wait(),
+    )
+    if records is None:
+        return _api_error(404, f"No papers of {date} yet")
+    if ndjson:
+        return Response(api.ndjson_lines(records, fields, limit), mimetype="application/x-ndjson")
+    return Response(api.json_chunks(date, records, fields, limit), mimetype="application/json")
+
+
+@app.route("/api/<pset>/papers")
+def api_query(pset):
+    """
+    JSON version of /<pset>/.
+    """
+    if not ArxivAsset.is_valid_pset(pset):
+        return _api_error(404, f"Unknown primary set {pset!r}")
+    d = _pset_args(pset)
+    return _api_papers(d.get("date", ""), CategoryFilterConfig(d))
+
+
+@app.route("/api/config/<config_name>/<offset>")
+def api_query_config(config_name, offset):
+    """
+    JSON version of /config/<config_name>/<offset>.
+    """
+    try:
+        offset = int(offset)
+    except ValueError:
+        return _api_error(400, f"Invalid offset {offset!r}")
+    compiled = config_registry.get(config_name)
+    if compiled is None:
+        return _api_error(404, f"Unknown config {config_name!r}")
+    date = (datetime.now(timezone.utc) - timedelta(days=offset)).strftime("%Y-%m-%d")
+    return _api_papers(date, compiled.config)
+
+
+@app.route("/search")
+def search():
+    """
+    Cached papers containing every phrase of q and written by every author, over all dates or [from, to].
+    """
+    phrases = [p for p in request.args.get("q", "").split(",") if p]
+    authors = [a for a in request.args.get("authors", "").split(",") if a]
+    start, end = request.args.get("from"), request.args.get("to")
+    for date in (start, end):
+        if date is not None and not _validate_date(date):
+            return render_papers404("invalid")
+    if not phrases and not authors:
+        return render_papers404("invalid")
+
+    papers = arxiv_asset.search(phrases, authors, start, end)
+    return stream_template("paperlist.html", date=f"{start or ''} ~ {end or ''}", papers=papers)
 
 
 @app.route("/config/<config_name>/yesterday")
@@ -97,6 +287,26 @@ def query_yesterday(config_name):
     return query_config(config_name, 1)
 
 
+@app.route("/config/<config_name>/range")
+def query_config_range(config_name):
+    """
+    Papers of every date in [from, to], streamed day by day.
+    """
+    start, end = request.args.get("from", ""), request.args.get("to", "")
+    if not (_validate_date(start) and _validate_date(end)):
+        return render_papers404("invalid")
+    n_days = (datetime.strptime(end, "%Y-%m-%d") - datetime.strptime(start, "%Y-%m-%d")).days + 1
+    if not 0 < n_days <= max_range_days:
+        return render_papers404("invalid")
+    config = _get_config(config_name)
+    if config is None:
+        return render_papers404(f"{start} ~ {end}")
+
+    arxiv_asset.prefetch_range(start, end, categories=config.categories, timeout=_fetch_wait())
+    papers = arxiv_asset.get_by_range(start, end, categories=config.categories, config=config)
+    return stream_template("paperlist.html", date=f"{start} ~ {end}", papers=papers)
+
+
 @app.route("/config/<config_name>/<offset>")
 def query_config_with_offset(config_name, offset):
     return query_config(config_name, offset)
@@ -0,0 +1,90 @@
+"""
+Cache of rendered pages, served with strong ETags and Last-Modified so that browsers revalidate for free.
+"""
+import hashlib
+from datetime import datetime, timedelta, timezone
+from flask import Response
+from werkzeug import http
+from app.cache import BoundedCache
+
+
+class ResponseCache:
+    """
+    Rendered pages keyed by what determines them (normalized query or config content, date).
+    The page of a date older than `recent_days` never changes and is kept until evicted,
+    the page of a recent date is rendered again after `recent_ttl` seconds.
+    """
+
+    def __init__(self, max_bytes=64 << 20, recent_ttl=300, recent_days=2, max_age=86400, max_etags=1 << 16) -> None:
+        """
+        Args:
+            max_bytes: total size of the cached pages
+            max_age: seconds browsers may reuse the page of an old date without revalidating
+            max_etags: pages whose ETag is remembered, to answer revalidations of evicted pages
+        """
+        self.recent_ttl = recent_ttl
+        self.recent_days = recent_days
+        self.max_age = max_age
+        # key -> (body, etag, headers)
+        self._cache = BoundedCache(max_bytes=max_bytes, sizeof=lambda entry: len(entry[0]))
+        # key -> (etag, headers), kept after the body is evicted
+        self._etags = BoundedCache(max_entries=max_etags)
+
+    def _is_recent(self, date: str):
+        d_date = datetime.strptime(date, "%Y-%m-%d")
+        return d_date + timedelta(days=self.recent_days) > datetime.utcnow()
+
+    def _entry(self, date: str, page: str):
+        body = page.encode("utf-8")
+        etag = hashlib.sha1(body).hexdigest()
+        max_age = self.recent_ttl if self._is_recent(date) else self.max_age
+        headers = {
+            "ETag": http.quote_etag(etag),
+            "Last-Modified": http.http_date(datetime.now(timezone.utc)),
+            "Cache-Control": f"public, max-age={max_age}",
+        }
+        return body, etag, headers
+
+    def respond(self, request, key, date: str, render) -> Response:
+        """
+        Returns the page of key, rendered by `render()` on a miss, or 304 if the request already has it.
+        Only pages listing papers are cached, a page without papers is served uncached.
+
+        Args:
+            date: %Y-%m-%d date of the page, decides how long it is kept
+            render: () -> (str, bool), the page and whether it lists papers
+        """
+        entry = self._cache.get(key)
+        if entry is None:
+            known = self._etags.get(key)
+            if known is not None and request.if_none_match.contains(known[0]):
+                return Response(status=304, headers=known[1])
+            page, listed = render()
+            if not listed:
+                # the papers of the date may come later
+                return Response(page, mimetype="text/html", headers={"Cache-Control": "no-store"})
+            entry = self._entry(date, page)
+            ttl = self.recent_ttl if self._is_recent(date) else None
+            self._cache.put(key, entry, ttl=ttl)
+            self._etags.put(key, entry[1:], ttl=ttl)
+        body, etag, headers = entry
+
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers=headers)
+        return Response(body, mimetype="text/html", headers=headers).make_conditional(request)
+
+    def invalidate(self, prefix: tuple):
+        """
+        Drops the pages whose key starts with prefix.
+        """
+        for cache in (self._cache, self._etags):
+            for key in cache.keys():
+                if key[:len(prefix)] == prefix:
+                    cache.pop(key)
+
+    def clear(self):
+        self._cache.clear()
+        self._etags.clear()
+
+    def stats(self):
+        return self._cache.stats()
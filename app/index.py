@@ -0,0 +1,485 @@
+"""
+Persistent inverted index over the titles, abstracts and authors of every indexed daily set.
+
+Every indexed version of a record gets a document number, increasing in indexing order, and only the
+latest version of an arxiv id is returned by queries. For each (field, term) the index keeps
+    docs        varint deltas of the document numbers containing the term
+    positions   per document, the byte length of its positions followed by their varint deltas
+Authors are indexed as whole lowercased names, without positions.
+
+The index is saved as a snapshot plus a journal of the daily sets added since then, so that adding a day
+only appends to the journal. The journal is folded into the snapshot every `compact_every` days.
+Several processes (the app and the crawl daemon) can share an index: writes take an exclusive flock of
+index.lock, and every index catches up with the days added by the others before a search or a write.
+
+    index.snap      header: magic "PIDX", version (u16), byte length m of the metadata (u32)
+                    metadata: m bytes of utf-8 JSON {"ids": [...], "segments": [[pset, date, first, end], ...],
+                    "postings": [[field, term, n, last, docs size, positions size], ...]}
+                    the docs and positions bytes of every posting list, in the order of the metadata
+    journal.ndjson  one JSON line [pset, date, rows] per daily set
+
+All integers are little-endian. Documents are numbered consecutively by segment in the snapshot.
+"""
+import fcntl
+import json
+import logging
+import os
+import struct
+import sys
+import threading
+from contextlib import contextmanager
+from itertools import accumulate
+from typing import Iterable, List, Optional
+from app.utils import NLP, RecordTokens, atomic_write
+
+logger = logging.getLogger(__name__)
+
+_header = struct.Struct("<4sHI")
+_default_index_root = os.path.join(os.path.dirname(os.path.dirname(__file__)), "arxiv_index")
+
+
+def _put_varint(buf: bytearray, n: int):
+    while n >= 0x80:
+        buf.append((n & 0x7F) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+
+def _iter_varints(buf):
+    n = shift = 0
+    for b in buf:
+        if b < 0x80:
+            yield n | (b << shift)
+            n = shift = 0
+        else:
+            n |= (b & 0x7F) << shift
+            shift += 7
+
+
+def _read_varint(buf, pos):
+    """
+    Returns the varint at pos and the position after it.
+    """
+    n = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _decode_deltas(buf) -> List[int]:
+    if not buf or max(buf) < 0x80:
+        # every delta fits in one byte, usual for the long lists of frequent terms
+        return list(accumulate(buf))
+    return list(accumulate(_iter_varints(buf)))
+
+
+class PostingList:
+    __slots__ = ("docs", "positions", "last", "n")
+
+    def __init__(self) -> None:
+        self.docs = bytearray()
+        self.positions = bytearray()
+        self.last = 0
+        self.n = 0
+
+    def _append_doc(self, doc: int):
+        delta = doc - self.last
+        if delta < 0x80:
+            self.docs.append(delta)
+        else:
+            _put_varint(self.docs, delta)
+        self.last = doc
+        self.n += 1
+
+    def append(self, doc: int, positions=None):
+        """
+        Documents have to be appended in increasing order.
+        """
+        self._append_doc(doc)
+        if positions is None:
+            return
+        if len(positions) == 1 and positions[0] < 0x80:
+            # most terms occur once in a document
+            self.positions += bytes((1, positions[0]))
+            return
+        buf = bytearray()
+        prev = 0
+        for pos in positions:
+            _put_varint(buf, pos - prev)
+            prev = pos
+        _put_varint(self.positions, len(buf))
+        self.positions += buf
+
+    def doc_ids(self) -> List[int]:
+        return _decode_deltas(self.docs)
+
+    def positions_of(self, docs: set) -> dict:
+        """
+        Returns doc -> set of positions for the documents of docs in this list.
+        """
+        res = {}
+        buf = self.positions
+        pos = 0
+        for doc in self.doc_ids():
+            # byte length of the positions of doc
+            size, pos = _read_varint(buf, pos)
+            if doc in docs:
+                res[doc] = set(_decode_deltas(buf[pos:pos + size]))
+            pos += size
+        return res
+
+    def remap(self, mapping, with_positions=True) -> "PostingList":
+        """
+        Returns the list of the documents doc with mapping[doc] >= 0, numbered mapping[doc].
+        mapping has to be increasing on the kept documents.
+        """
+        res = PostingList()
+        buf = self.positions
+        pos = 0
+        for doc in self.doc_ids():
+            if with_positions:
+                start = pos
+                size, pos = _read_varint(buf, pos)
+                pos += size
+            new_doc = mapping[doc]
+            if new_doc >= 0:
+                res._append_doc(new_doc)
+                if with_positions:
+                    res.positions += buf[start:pos]
+        return res
+
+
+class InvertedIndex:
+    MAGIC = b"PIDX"
+    VERSION = 2
+    fields = ("title", "abstract")
+    author_field = "author"
+
+    def __init__(self, root=_default_index_root, compact_every=64) -> None:
+        self.root = root
+        self.compact_every = compact_every
+        os.makedirs(root, exist_ok=True)
+        self._snapshot_path = os.path.join(root, "index.snap")
+        self._journal_path = os.path.join(root, "journal.ndjson")
+        self._lock = threading.Lock()
+        # shared with the other processes using the index
+        self._lock_file = open(os.path.join(root, "index.lock"), "ab")
+        self._reset()
+        with self._locked(exclusive=False):
+            self._load()
+
+    def _reset(self):
+        # per document number
+        self.ids = []
+        self.psets = []
+        self.dates = []
+        # arxiv id -> document number of its latest version
+        self.latest = {}
+        # (field, term) -> PostingList
+        self.postings = {}
+        # indexed (pset, date) -> (first, end) document numbers of its records
+        self.segments = {}
+        # documents of replaced segments, dropped at the next compaction
+        self._n_dead = 0
+        self._n_journal = 0
+        # the snapshot loaded and the bytes of the journal read, to notice the writes of other processes
+        self._snapshot_identity = None
+        self._journal_pos = 0
+
+    @staticmethod
+    def _identity(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    @contextmanager
+    def _locked(self, exclusive):
+        with self._lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        if os.path.exists(os.path.join(self.root, "index.pkl")) and not os.path.exists(self._snapshot_path):
+            logger.warning(f"Ignore the pickled index of {self.root}, run ArxivAsset.build_index() to rebuild it")
+        self._snapshot_identity = self._identity(self._snapshot_path)
+        if self._snapshot_identity is not None:
+            try:
+                self._load_snapshot()
+            except (ValueError, KeyError, struct.error) as e:
+                logger.warning(f"Ignore invalid index snapshot {self._snapshot_path}: {e}")
+                self.ids, self.psets, self.dates = [], [], []
+                self.latest, self.postings, self.segments = {}, {}, {}
+        self._read_journal()
+
+    def _read_journal(self):
+        """
+        Add the days of the journal after the bytes read so far.
+        """
+        try:
+            with open(self._journal_path, "rb") as f:
+                f.seek(self._journal_pos)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        pos = 0
+        while pos < len(data):
+            end = data.find(b"\n", pos)
+            if end < 0:
+                break
+            try:
+                pset, date, rows = json.loads(data[pos:end])
+            except ValueError:
+                break
+            self._add_rows(pset, date, rows)
+            pos = end + 1
+            self._n_journal += 1
+        self._journal_pos += pos
+        if pos < len(data):
+            # torn write of the last entry, dropped so that the next entries stay readable
+            with open(self._journal_path, "r+b") as f:
+                f.truncate(self._journal_pos)
+
+    def _refresh(self):
+        """
+        Catch up with the days added by other processes since the index was loaded.
+        """
+        try:
+            journal_size = os.path.getsize(self._journal_path)
+        except FileNotFoundError:
+            journal_size = 0
+        if self._identity(self._snapshot_path) != self._snapshot_identity or journal_size < self._journal_pos:
+            # compacted by another process
+            self._reset()
+            self._load()
+        elif journal_size > self._journal_pos:
+            self._read_journal()
+
+    def _load_snapshot(self):
+        with open(self._snapshot_path, "rb") as f:
+            data = f.read()
+        magic, version, size = _header.unpack_from(data, 0)
+        if magic != self.MAGIC:
+            raise ValueError("not an index snapshot")
+        if version != self.VERSION:
+            raise ValueError(f"version {version}, expected {self.VERSION}")
+        pos = _header.size + size
+        meta = json.loads(data[_header.size:pos])
+        ids = meta["ids"]
+        psets, dates = [None] * len(ids), [None] * len(ids)
+        segments = {}
+        for pset, date, first, end in meta["segments"]:
+            pset, date = sys.intern(pset), sys.intern(date)
+            segments[(pset, date)] = (first, end)
+            psets[first:end] = [pset] * (end - first)
+            dates[first:end] = [date] * (end - first)
+        if len(psets) != len(ids) or None in psets:
+            raise ValueError("segments do not cover the documents")
+        postings = {}
+        for field, term, n, last, docs_size, positions_size in meta["postings"]:
+            posting = PostingList()
+            posting.n, posting.last = n, last
+            posting.docs = bytearray(data[pos:pos + docs_size])
+            pos += docs_size
+            posting.positions = bytearray(data[pos:pos + positions_size])
+            pos += positions_size
+            postings[(sys.intern(field), term)] = posting
+        if pos != len(data):
+            raise ValueError("truncated postings")
+        self.ids, self.psets, self.dates = ids, psets, dates
+        self.postings, self.segments = postings, segments
+        for doc, id in enumerate(ids):
+            self._set_latest(id, doc)
+
+    def _posting(self, field, term) -> PostingList:
+        posting = self.postings.get((field, term))
+        if posting is None:
+            posting = self.postings[(field, term)] = PostingList()
+        return posting
+
+    def _set_latest(self, id, doc):
+        # the version of the latest date, the last indexed among those of the same date
+        current = self.latest.get(id)
+        if current is None or self.dates[current] <= self.dates[doc]:
+            self.latest[id] = doc
+
+    def _add_rows(self, pset, date, rows):
+        pset, date = sys.intern(pset), sys.intern(date)
+        replaced = self.segments.pop((pset, date), None)
+        orphans = set()
+        if replaced is not None:
+            # the records of the previous version of the segment are no longer returned
+            for doc in range(*replaced):
+                if self.latest.get(self.ids[doc]) == doc:
+                    del self.latest[self.ids[doc]]
+                    orphans.add(self.ids[doc])
+            self._n_dead += replaced[1] - replaced[0]
+        first = len(self.ids)
+        for id, title_tokens, abstract_tokens, authors in rows:
+            doc = len(self.ids)
+            self.ids.append(id)
+            self.psets.append(pset)
+            self.dates.append(date)
+            self._set_latest(id, doc)
+            for field, tokens in zip(self.fields, (title_tokens, abstract_tokens)):
+                term_positions = {}
+                for pos, token in enumerate(tokens):
+                    term_positions.setdefault(token, []).append(pos)
+                for term, positions in term_positions.items():
+                    self._posting(field, term).append(doc, positions)
+            for author in set(a.lower() for a in authors):
+                self._posting(self.author_field, author).append(doc)
+        self.segments[(pset, date)] = (first, len(self.ids))
+        orphans.difference_update(self.latest)
+        if orphans:
+            # records dropped from the segment fall back to their versions of other dates
+            for seg_first, seg_end in self.segments.values():
+                for doc in range(seg_first, seg_end):
+                    if self.ids[doc] in orphans:
+                        self._set_latest(self.ids[doc], doc)
+
+    def add_daily(self, pset, date: str, records: Iterable):
+        """
+        Index the records of (pset, date), replacing those indexed before for (pset, date).
+        Records of earlier dates with the same ids are superseded.
+        """
+        rows = []
+        for record in records:
+            tokens = RecordTokens.of(record)
+            rows.append((record.id, tokens.title, tokens.abstract, tuple(record.authors)))
+        entry = json.dumps([pset, date, rows], ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        with self._locked(exclusive=True):
+            # document numbers follow those of the days added by other processes
+            self._refresh()
+            with open(self._journal_path, "ab") as f:
+                f.write(entry)
+            self._journal_pos += len(entry)
+            self._add_rows(pset, date, rows)
+            self._n_journal += 1
+            if self._n_journal >= self.compact_every:
+                self._save()
+
+    def _compact(self):
+        """
+        Drop the documents of replaced segments and number the others consecutively.
+        """
+        mapping = [-1] * len(self.ids)
+        segments = {}
+        n = 0
+        for key, (first, end) in sorted(self.segments.items(), key=lambda item: item[1]):
+            segments[key] = (n, n + end - first)
+            for doc in range(first, end):
+                mapping[doc] = n
+                n += 1
+        postings = {}
+        for key, posting in self.postings.items():
+            posting = posting.remap(mapping, with_positions=key[0] != self.author_field)
+            if posting.n > 0:
+                postings[key] = posting
+        live = [doc for doc in range(len(self.ids)) if mapping[doc] >= 0]
+        self.ids = [self.ids[doc] for doc in live]
+        self.psets = [self.psets[doc] for doc in live]
+        self.dates = [self.dates[doc] for doc in live]
+        self.latest = {id: mapping[doc] for id, doc in self.latest.items()}
+        self.postings, self.segments = postings, segments
+        self._n_dead = 0
+
+    def _save(self):
+        if self._n_dead > 0:
+            # without replaced segments, the segments cover every document
+            self._compact()
+        meta = {
+            "ids": self.ids,
+            "segments": [[pset, date, first, end] for (pset, date), (first, end) in self.segments.items()],
+            "postings": [
+                [field, term, posting.n, posting.last, len(posting.docs), len(posting.positions)]
+                for (field, term), posting in self.postings.items()
+            ],
+        }
+        meta = json.dumps(meta, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        with atomic_write(self._snapshot_path) as f:
+            f.write(_header.pack(self.MAGIC, self.VERSION, len(meta)))
+            f.write(meta)
+            for posting in self.postings.values():
+                f.write(posting.docs)
+                f.write(posting.positions)
+        open(self._journal_path, "wb").close()
+        self._n_journal = 0
+        self._snapshot_identity = self._identity(self._snapshot_path)
+        self._journal_pos = 0
+
+    def save(self):
+        with self._locked(exclusive=True):
+            self._refresh()
+            self._save()
+
+    def _docs(self, field, term) -> set:
+        posting = self.postings.get((field, term))
+        return set(posting.doc_ids()) if posting is not None else set()
+
+    def _phrase_docs(self, field, tokens, candidates: Optional[set]) -> set:
+        postings = [self.postings.get((field, token)) for token in tokens]
+        if any(posting is None for posting in postings):
+            return set()
+        # intersect the rarest lists first
+        docs = candidates
+        for posting in sorted(postings, key=lambda posting: posting.n):
+            docs = set(posting.doc_ids()) if docs is None else docs.intersection(posting.doc_ids())
+            if not docs:
+                return docs
+        if len(tokens) == 1:
+            return docs
+
+        positions = [posting.positions_of(docs) for posting in postings]
+        return {
+            doc
+            for doc in docs
+            if any(all(p + i in positions[i][doc] for i in range(1, len(tokens))) for p in positions[0][doc])
+        }
+
+    def search(self, phrases=(), authors=(), start=None, end=None, fields=fields):
+        """
+        Returns (id, pset, date) of the latest version of every record containing all phrases
+        (in any of fields) and written by all authors, ordered by indexing order.
+
+        Args:
+            phrases: List[str], matched on tokens like NLP.contain_phrase
+            authors: List[str], whole names, case insensitive
+            start, end: str | None, bounds of the date of the daily set
+        """
+        phrase_tokens = [NLP.tokenize(phrase) for phrase in phrases]
+        with self._locked(exclusive=False):
+            self._refresh()
+            candidates = None
+            for author in authors:
+                docs = self._docs(self.author_field, author.lower())
+                candidates = docs if candidates is None else candidates & docs
+            # longer phrases are usually rarer and narrow candidates early
+            for tokens in sorted((t for t in phrase_tokens if t), key=len, reverse=True):
+                docs = set()
+                for field in fields:
+                    docs |= self._phrase_docs(field, tokens, candidates)
+                candidates = docs
+            if candidates is None:
+                return []
+
+            res = []
+            for doc in sorted(candidates):
+                id, date = self.ids[doc], self.dates[doc]
+                if self.latest.get(id) != doc:
+                    continue
+                if (start is not None and date < start) or (end is not None and date > end):
+                    continue
+                res.append((id, self.psets[doc], date))
+            return res
+
+    def __len__(self):
+        return len(self.latest)
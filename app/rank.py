@@ -0,0 +1,133 @@
+"""
+Relevance ranking of records against the keywords and authors of a config with BM25.
+"""
+from collections import Counter
+from typing import Iterable, List
+import numpy as np
+from app.utils import NLP, RecordTokens
+
+
+class TermStats:
+    """
+    BM25 weights of every (record, term) of a daily set, per field, stored by term:
+    the weights of the term at column c are weights[indptr[c]:indptr[c + 1]], of the records rows[...].
+    Authors are a field of lowercased names weighted 1.
+    """
+
+    k1 = 1.2
+    b = 0.75
+    fields = ("title", "abstract", "author")
+
+    def __init__(self, records: Iterable) -> None:
+        self.id2row = {}
+        field_docs = {field: [] for field in self.fields}
+        for row, record in enumerate(records):
+            self.id2row[record.id] = row
+            tokens = RecordTokens.of(record)
+            field_docs["title"].append(tokens.title)
+            field_docs["abstract"].append(tokens.abstract)
+            field_docs["author"].append(set(a.lower() for a in record.authors))
+        self.n = len(self.id2row)
+        self.vocab = {}
+        self.indptr = {}
+        self.rows = {}
+        self.weights = {}
+        for field in self.fields:
+            self._build(field, field_docs[field])
+
+    def _build(self, field, docs):
+        vocab = {}
+        cols = np.fromiter((vocab.setdefault(term, len(vocab)) for doc in docs for term in doc), dtype=np.int64)
+        doc_len = np.fromiter((len(doc) for doc in docs), dtype=np.int64, count=self.n)
+        rows = np.repeat(np.arange(self.n, dtype=np.int64), doc_len)
+        # sorted by term then record, with the term frequencies
+        keys, tfs = np.unique(cols * max(self.n, 1) + rows, return_counts=True)
+        cols, rows = np.divmod(keys, max(self.n, 1))
+        tfs = tfs.astype(np.float32)
+
+        df = np.bincount(cols, minlength=len(vocab))
+        if field == "author":
+            weights = np.ones_like(tfs)
+        else:
+            avg_len = doc_len.mean() if self.n > 0 else 0.0
+            norm = self.k1 * (1 - self.b + self.b * doc_len / max(avg_len, 1.0))
+            idf = np.log1p((self.n - df + 0.5) / (df + 0.5))
+            weights = idf[cols] * tfs * (self.k1 + 1) / (tfs + norm[rows])
+
+        self.vocab[field] = vocab
+        self.indptr[field] = np.concatenate(([0], np.cumsum(df))).astype(np.int64)
+        self.rows[field] = rows.astype(np.int32)
+        self.weights[field] = weights.astype(np.float32)
+
+    @classmethod
+    def of(cls, daily) -> "TermStats":
+        """
+        Term statistics of a daily set, computed once and cached on it.
+        """
+        stats = getattr(daily, "term_stats", None)
+        if stats is None:
+            stats = daily.term_stats = cls(daily)
+        return stats
+
+    def scores(self, query: dict) -> np.ndarray:
+        """
+        Returns the score of every row, the sparse product of the weights with the query.
+
+        Args:
+            query: field -> {term: weight}
+        """
+        res = np.zeros(self.n, dtype=np.float32)
+        for field, terms in query.items():
+            vocab, indptr = self.vocab[field], self.indptr[field]
+            slices, term_weights = [], []
+            for term, weight in terms.items():
+                col = vocab.get(term)
+                if col is not None:
+                    slices.append(slice(indptr[col], indptr[col + 1]))
+                    term_weights.append(np.full(indptr[col + 1] - indptr[col], weight, dtype=np.float32))
+            if not slices:
+                continue
+            rows = np.concatenate([self.rows[field][s] for s in slices])
+            weights = np.concatenate([self.weights[field][s] for s in slices]) * np.concatenate(term_weights)
+            res += np.bincount(rows, weights=weights, minlength=self.n).astype(np.float32)
+        return res
+
+
+class RelevanceRanker:
+    """
+    Orders records by the BM25 score of their title against the title keywords of a config,
+    of their abstract against its abstract keywords, plus a bonus per configured author.
+    """
+
+    field_weights = {"title": 2.0, "abstract": 1.0, "author": 3.0}
+
+    def __init__(self, config) -> None:
+        """
+        Args:
+            config: CategoryFilterConfig
+        """
+        self.query = {}
+        for field, keywords in [
+            ("title", config.keywd_in_title),
+            ("abstract", config.keywd_in_abstract),
+        ]:
+            terms = Counter(token for keyword in keywords or [] for token in NLP.tokenize(keyword))
+            self.query[field] = {term: self.field_weights[field] * n for term, n in terms.items()}
+        self.query["author"] = {a.lower(): self.field_weights["author"] for a in config.authors or []}
+
+    def rank(self, records: Iterable, stats: List[TermStats]) -> List:
+        """
+        Returns records sorted by decreasing score, ties in their original order.
+        A record is scored by the first of stats (its daily sets) which contains it.
+        """
+        records = list(records)
+        scores = np.zeros(len(records), dtype=np.float32)
+        found = np.zeros(len(records), dtype=bool)
+        for st in stats:
+            st_scores = st.scores(self.query)
+            rows = np.fromiter((st.id2row.get(r.id, -1) for r in records), dtype=np.int64, count=len(records))
+            hit = (rows >= 0) & ~found
+            scores[hit] = st_scores[rows[hit]]
+            found |= hit
+        order = np.argsort(-scores, kind="stable")
+        return [records[i] for i in order]
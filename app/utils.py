@@ -1,15 +1,45 @@
 import nltk
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+# the process umask, read once: os.umask can only be read by setting it
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+@contextmanager
+def atomic_write(path, mode="wb"):
+    """
+    Yield a temporary file next to path, renamed to path once the block succeeds, so that readers never see
+    a partial file. The file gets the permissions open() would give it (0o666 without the umask) rather than
+    the 0o600 of mkstemp, so that other users, such as the web server of the files of the crawl daemon, read it.
+    """
+    dirname = os.path.dirname(path)
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix=os.path.basename(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            os.fchmod(f.fileno(), 0o666 & ~_umask)
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
 
 
 class NLP:
     @staticmethod
-    def contain_phrase(paragraph, phrase, case_insensitive=True):
+    def tokenize(s, case_insensitive=True):
         if case_insensitive:
-            paragraph = paragraph.lower()
-            phrase = phrase.lower()
+            s = s.lower()
+        return nltk.tokenize.word_tokenize(s)
 
-        paragraph_words = nltk.tokenize.word_tokenize(paragraph)
-        phrase_words = nltk.tokenize.word_tokenize(phrase)
+    @staticmethod
+    def contain_phrase(paragraph, phrase, case_insensitive=True):
+        paragraph_words = NLP.tokenize(paragraph, case_insensitive)
+        phrase_words = NLP.tokenize(phrase, case_insensitive)
 
         contains = False
         for i in range(len(paragraph_words)):
@@ -25,3 +55,101 @@ class NLP:
                 break
 
         return contains
+
+
+class PhraseMatcher:
+    """
+    Matches a fixed set of phrases against documents, with the same result as `NLP.contain_phrase` for each phrase.
+    Phrases are tokenized once into a token trie, and a document is tokenized once and scanned in a single pass.
+    """
+
+    # key of the phrase ending at a trie node
+    _END = None
+
+    def __init__(self, phrases, case_insensitive=True) -> None:
+        self.case_insensitive = case_insensitive
+        self.trie = {}
+        # phrases without any token, contained in every non-empty document
+        self.empty_phrases = set()
+        for phrase in phrases:
+            tokens = NLP.tokenize(phrase, case_insensitive)
+            if len(tokens) == 0:
+                self.empty_phrases.add(phrase)
+                continue
+            node = self.trie
+            for token in tokens:
+                node = node.setdefault(token, {})
+            node.setdefault(self._END, set()).add(phrase)
+
+    def tokenize(self, s):
+        return NLP.tokenize(s, self.case_insensitive)
+
+    def _iter_matches(self, tokens):
+        if len(tokens) > 0:
+            yield from self.empty_phrases
+        trie = self.trie
+        for i in range(len(tokens)):
+            node = trie.get(tokens[i])
+            j = i + 1
+            while node is not None:
+                if self._END in node:
+                    yield from node[self._END]
+                if j == len(tokens):
+                    break
+                node = node.get(tokens[j])
+                j += 1
+
+    def match_tokens(self, tokens):
+        """
+        Returns the set of phrases contained in the tokenized document.
+        """
+        return set(self._iter_matches(tokens))
+
+    def contain_any_tokens(self, tokens):
+        if len(tokens) > 0 and self.empty_phrases:
+            return True
+        trie = self.trie
+        # most documents contain no first token of any phrase
+        if trie.keys().isdisjoint(tokens):
+            return False
+        n = len(tokens)
+        for i, token in enumerate(tokens):
+            node = trie.get(token)
+            j = i + 1
+            while node is not None:
+                if self._END in node:
+                    return True
+                if j == n:
+                    break
+                node = node.get(tokens[j])
+                j += 1
+        return False
+
+    def match(self, s):
+        return self.match_tokens(self.tokenize(s))
+
+    def contain_any(self, s):
+        return self.contain_any_tokens(self.tokenize(s))
+
+
+class RecordTokens:
+    """
+    Lowercased tokens of a record's title and abstract, computed once and cached on `record.tokens`.
+    """
+
+    __slots__ = ("title", "abstract")
+
+    def __init__(self, title, abstract) -> None:
+        self.title = title
+        self.abstract = abstract
+
+    @staticmethod
+    def _intern_tokens(s):
+        # tokens repeat a lot across records
+        return tuple(sys.intern(token) for token in NLP.tokenize(s))
+
+    @classmethod
+    def of(cls, record) -> "RecordTokens":
+        if record.tokens is None:
+            record.tokens = cls(cls._intern_tokens(record.title), cls._intern_tokens(record.abstract))
+        return record.tokens
@@ -7,7 +7,11 @@ import requests
 from requests.adapters import HTTPAdapter, Retry
 import aiohttp
 import asyncio
+import threading
+from concurrent.futures import Executor
 import re
+import sys
+from xml.sax.saxutils import unescape
 
 
 logger = logging.getLogger(__name__)
@@ -20,6 +24,14 @@ logger.propagate = False
 
 
 class ArxivRecord:
+    """
+    Categories and authors are stored as tuples, categories (and dates) are interned since they repeat across records.
+    `tokens` caches data derived from the record by the app (see app.utils.RecordTokens) and is not pickled.
+    """
+
+    __slots__ = ("id", "title", "abstract", "categories", "authors", "published", "updated", "tokens")
+    _fields = __slots__[:-1]
+
     def __init__(
         self,
         id="",
@@ -33,16 +45,120 @@ class ArxivRecord:
         self.id = id
         self.title = title
         self.abstract = abstract
-        self.categories = [] if categories is None else categories
-        self.authors = [] if authors is None else authors
-        self.published: Optional[str] = published
-        self.updated: Optional[str] = updated
+        self.categories = () if categories is None else tuple(sys.intern(c) for c in categories)
+        self.authors = () if authors is None else tuple(authors)
+        self.published: Optional[str] = sys.intern(published) if published else published
+        self.updated: Optional[str] = sys.intern(updated) if updated else updated
+        self.tokens = None
+
+    def __getstate__(self):
+        return tuple(getattr(self, attr) for attr in self._fields)
+
+    def __setstate__(self, state):
+        # records pickled before ArxivRecord had __slots__ carry their __dict__
+        if isinstance(state, dict):
+            self.__init__(**state)
+        else:
+            for attr, val in zip(self._fields, state):
+                setattr(self, attr, val)
+            self.tokens = None
+
+
+class OAIError(Exception):
+    def __init__(self, code, message="") -> None:
+        super().__init__(code, message)
+        self.code = code
+        self.message = message
+
+    def __str__(self) -> str:
+        return f"{self.code}: {self.message}"
+
+
+class RateLimiter:
+    """
+    Token bucket shared by concurrent harvests, on an event loop (`acquire`) or in threads (`acquire_blocking`).
+    A limiter is used by either, not both.
+    `pause` empties the bucket and blocks every user of the limiter, e.g. when arxiv answers with Retry-After.
+    """
+
+    def __init__(self, rate=1.0, capacity=1) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._resume_at = 0.0
+        self._lock = asyncio.Lock()
+        self._thread_lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + max(0.0, now - self._last) * self.rate)
+        self._last = now
+
+    def _take(self):
+        """
+        Takes a token and returns 0, or returns the seconds to wait before trying again.
+        """
+        now = time.monotonic()
+        if now < self._resume_at:
+            return self._resume_at - now
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                delay = self._take()
+                if delay <= 0:
+                    return
+                await asyncio.sleep(delay)
+
+    def acquire_blocking(self):
+        with self._thread_lock:
+            while True:
+                delay = self._take()
+                if delay <= 0:
+                    return
+                time.sleep(delay)
+
+    def pause(self, seconds):
+        resume_at = time.monotonic() + seconds
+        if resume_at > self._resume_at:
+            self._resume_at = resume_at
+            self._tokens = 0
+            self._last = resume_at
 
 
 class ArxivAPI:
+    OAI_url = "http://export.arxiv.org/oai2"
     OAI_xmlns = r"http://www.openarchives.org/OAI/2.0/"
     arxiv_xmlns = r"http://arxiv.org/OAI/arXiv/"
 
+    # "iterparse" or "tree", see `parse_oai_xml`
+    oai_parser = "iterparse"
+    # bytes read from a response at a time when its page is parsed as it arrives
+    oai_chunk_size = 64 * 1024
+
+    _OAI_record_tag = f"{{{OAI_xmlns}}}record"
+    _OAI_metadata_tag = f"{{{OAI_xmlns}}}metadata"
+    _OAI_token_tag = f"{{{OAI_xmlns}}}resumptionToken"
+    _OAI_error_tag = f"{{{OAI_xmlns}}}error"
+    _arxiv_authors_tag = f"{{{arxiv_xmlns}}}authors"
+    _arxiv_keyname_tag = f"{{{arxiv_xmlns}}}keyname"
+    _arxiv_forenames_tag = f"{{{arxiv_xmlns}}}forenames"
+    _arxiv_fields = {
+        f"{{{arxiv_xmlns}}}id": "id",
+        f"{{{arxiv_xmlns}}}title": "title",
+        f"{{{arxiv_xmlns}}}abstract": "abstract",
+        f"{{{arxiv_xmlns}}}created": "published",
+        f"{{{arxiv_xmlns}}}updated": "updated",
+        f"{{{arxiv_xmlns}}}categories": "categories",
+    }
+    _whitespace_re = re.compile(r"\s+")
+    _resumption_token_re = re.compile(rb"<resumptionToken\b[^>]*?(?:/>|>([^<]*)</resumptionToken>)")
+
     primary_set = {
         "cs",
         "econ",
@@ -114,18 +230,21 @@ class ArxivAPI:
 
     @classmethod
     def _prettify_text(cls, s: str):
-        s = s.replace('\n', ' ')
-        s = re.sub(r'\s+', ' ', s)
-        return s
+        return cls._whitespace_re.sub(" ", s)
 
     @classmethod
     def _oai_xml_attr_text(cls, metadata_node, attr):
         try:
             text = metadata_node.find(f"{{{cls.arxiv_xmlns}}}{attr}").text
-            return text
+            return text if text else ""
         except AttributeError:
             return ""
 
+    @classmethod
+    def _author_name(cls, forenames, keyname):
+        # collaborations only have a keyname
+        return f"{forenames} {keyname}" if forenames else keyname
+
     @classmethod
     def _oai_xml_authors(cls, metadata_node):
         try:
@@ -133,12 +252,45 @@ class ArxivAPI:
             authors_node = metadata_node.find(f"{{{cls.arxiv_xmlns}}}authors")
             for author_node in authors_node:
                 keyname = author_node.find(f"{{{cls.arxiv_xmlns}}}keyname").text
-                forenames = author_node.find(f"{{{cls.arxiv_xmlns}}}forenames").text
-                results.append(f"{forenames} {keyname}")
+                forenames = author_node.findtext(f"{{{cls.arxiv_xmlns}}}forenames")
+                results.append(cls._author_name(forenames, keyname))
             return results
         except (AttributeError, TypeError):
             return []
 
+    @classmethod
+    def parse_oai_xml(cls, xml, results):
+        """
+        Append the records of an OAI-PMH ListRecords page to results and return its resumption token,
+        using the parser selected by `oai_parser`.
+        """
+        if cls.oai_parser == "iterparse" and isinstance(xml, (str, bytes)):
+            return cls.from_oai_xml_iterparse(xml, results)
+        return cls.from_oai_xml(xml, results)
+
+    @classmethod
+    def parse_oai_page(cls, xml):
+        """
+        Returns (records, resumption_token) of a page. Used as the parsing stage run in an executor.
+        """
+        records = []
+        resumption_token = cls.parse_oai_xml(xml, records)
+        return records, resumption_token
+
+    @classmethod
+    def _peek_resumption_token(cls, xml: bytes):
+        """
+        Find the resumption token of a page without parsing it, so that the next page can be requested
+        while this one is still being parsed.
+        """
+        start = xml.rfind(b"<resumptionToken")
+        if start < 0:
+            return ""
+        match = cls._resumption_token_re.match(xml, start)
+        if match is None or not match.group(1):
+            return ""
+        return unescape(match.group(1).decode("utf-8"))
+
     @classmethod
     def from_oai_xml(cls, xml, results):
         if isinstance(xml, (str, bytes)):
@@ -146,31 +298,84 @@ class ArxivAPI:
         list_records = xml.find(f"{{{cls.OAI_xmlns}}}ListRecords")
         resumption_token = ""
         if list_records is None:
+            error = xml.find(f"{{{cls.OAI_xmlns}}}error")
+            # noRecordsMatch just means an empty window
+            if error is not None and error.get("code") != "noRecordsMatch":
+                raise OAIError(error.get("code"), error.text or "")
             return ""
         for record_node in list_records:
             if f"{{{cls.OAI_xmlns}}}resumptionToken" == record_node.tag:
                 resumption_token = record_node.text if record_node.text else ""
                 break
-            metadata_node = record_node.find(f"{{{cls.OAI_xmlns}}}metadata")[0]
-            record = ArxivRecord()
-            record.id = cls._oai_xml_attr_text(metadata_node, "id")
-            record.title = cls._prettify_text(cls._oai_xml_attr_text(metadata_node, "title"))
-            record.abstract = cls._prettify_text(cls._oai_xml_attr_text(metadata_node, "abstract"))
-            record.published = cls._oai_xml_attr_text(metadata_node, "created")
-            record.updated = cls._oai_xml_attr_text(metadata_node, "updated")
-
+            metadata_node = record_node.find(f"{{{cls.OAI_xmlns}}}metadata")
+            # deleted records come without metadata
+            if metadata_node is None or len(metadata_node) == 0:
+                continue
+            metadata_node = metadata_node[0]
             categories = cls._oai_xml_attr_text(metadata_node, "categories")
-            if categories:
-                record.categories = categories.split(" ")
-
-            record.authors = cls._oai_xml_authors(metadata_node)
-
+            record = ArxivRecord(
+                id=cls._oai_xml_attr_text(metadata_node, "id"),
+                title=cls._prettify_text(cls._oai_xml_attr_text(metadata_node, "title")),
+                abstract=cls._prettify_text(cls._oai_xml_attr_text(metadata_node, "abstract")),
+                categories=categories.split(" ") if categories else None,
+                authors=cls._oai_xml_authors(metadata_node),
+                published=cls._oai_xml_attr_text(metadata_node, "created"),
+                updated=cls._oai_xml_attr_text(metadata_node, "updated"),
+            )
             results.append(record)
         return resumption_token
 
+    @classmethod
+    def _record_from_oai_node(cls, record_node):
+        metadata_node = record_node.find(cls._OAI_metadata_tag)
+        if metadata_node is None or len(metadata_node) == 0:
+            return None
+        fields = {"id": "", "title": "", "abstract": "", "categories": "", "published": "", "updated": ""}
+        authors = []
+        for node in metadata_node[0]:
+            tag = node.tag
+            field = cls._arxiv_fields.get(tag)
+            if field is not None:
+                fields[field] = node.text if node.text else ""
+            elif tag == cls._arxiv_authors_tag:
+                for author_node in node:
+                    keyname = forenames = None
+                    for name_node in author_node:
+                        if name_node.tag == cls._arxiv_keyname_tag:
+                            keyname = name_node.text
+                        elif name_node.tag == cls._arxiv_forenames_tag:
+                            forenames = name_node.text
+                    if keyname is None:
+                        authors = []
+                        break
+                    authors.append(cls._author_name(forenames, keyname))
+        fields["title"] = cls._prettify_text(fields["title"])
+        fields["abstract"] = cls._prettify_text(fields["abstract"])
+        fields["categories"] = fields["categories"].split(" ") if fields["categories"] else None
+        return ArxivRecord(authors=authors, **fields)
+
+    @classmethod
+    def from_oai_xml_iterparse(cls, xml, results):
+        """
+        Same as `from_oai_xml`, but parses the page incrementally and frees every record element
+        once its record is built, so the whole tree is never held in memory.
+        """
+        return cls.from_oai_chunks([xml], results)
+
+    @classmethod
+    def from_oai_chunks(cls, chunks, results):
+        """
+        Same as `from_oai_xml_iterparse` for a page given as an iterable of byte chunks, e.g. read from the
+        response as it arrives, so that neither the page nor its tree is held in memory.
+        """
+        parser = OAIPageParser(cls, results)
+        for chunk in chunks:
+            parser.feed(chunk)
+        return parser.close()
+
     @classmethod
     def generate_url(self, resumption_token, from_time, until_time, pset):
-        basic_url = "http://export.arxiv.org/oai2?verb=ListRecords"
+        basic_url = f"{self.OAI_url}?verb=ListRecords"
         if resumption_token != "":
             true_url = f"{basic_url}&resumptionToken={urllib.parse.quote(resumption_token)}"
         else:
@@ -185,53 +390,187 @@ class ArxivAPI:
         return true_url
 
     @classmethod
-    def get_records_by_oai(
-        cls, from_time=None, until_time=None, pset=None
-    ) -> List[ArxivRecord]:
-        results = []
-        resumption_token = ""
+    def iter_pages_by_oai(
+        cls, from_time=None, until_time=None, pset=None, resumption_token="", limiter: Optional[RateLimiter] = None
+    ):
+        """
+        Yield (records, resumption_token) for each OAI-PMH page as soon as it is parsed, so at most one page is held
+        in memory. The token is the one to request the next page with ("" after the last page); passing it back as
+        `resumption_token` continues an interrupted harvest at that page.
+        Every request takes a token from `limiter` if given, pass the same limiter to harvests of several threads.
+        """
         sess = requests.Session()
         retries = Retry(total=5, status_forcelist=[429, 503], respect_retry_after_header=True)
         sess.mount("http://", HTTPAdapter(max_retries=retries))
 
         while True:
             true_url = cls.generate_url(resumption_token, from_time, until_time, pset)
+            if limiter is not None:
+                limiter.acquire_blocking()
             logger.info(f"Get from {true_url}")
 
-            response = sess.get(true_url)
-            response.raise_for_status()
-            xml = response.content
-            resumption_token = cls.from_oai_xml(xml, results)
+            page = []
+            with sess.get(true_url, stream=True) as response:
+                response.raise_for_status()
+                if cls.oai_parser == "iterparse":
+                    resumption_token = cls.from_oai_chunks(response.iter_content(cls.oai_chunk_size), page)
+                else:
+                    resumption_token = cls.from_oai_xml(response.content, page)
+            yield page, resumption_token
             if resumption_token == "":
                 break
 
-            time.sleep(0.1)
-        return results
+            if limiter is None:
+                time.sleep(0.1)
 
     @classmethod
-    async def async_get_records_by_oai(cls, from_time=None, until_time=None, pset=None) -> List[ArxivRecord]:
+    def iter_records_by_oai(cls, from_time=None, until_time=None, pset=None, limiter: Optional[RateLimiter] = None):
+        """
+        Yield the records of each OAI-PMH page as soon as it is parsed.
+        """
+        for page, _ in cls.iter_pages_by_oai(from_time, until_time, pset, limiter=limiter):
+            yield page
+
+    @classmethod
+    def get_records_by_oai(
+        cls, from_time=None, until_time=None, pset=None
+    ) -> List[ArxivRecord]:
         results = []
-        resumption_token = ""
+        for page in cls.iter_records_by_oai(from_time, until_time, pset):
+            results.extend(page)
+        return results
+
+    @classmethod
+    async def _parsed_page(cls, parsing, peeked_token):
+        records, resumption_token = await parsing
+        if resumption_token != peeked_token:
+            raise ValueError(f"Peeked resumption token {peeked_token!r} differs from the parsed {resumption_token!r}")
+        return records, resumption_token
+
+    @classmethod
+    async def async_iter_pages_by_oai(
+        cls,
+        from_time=None,
+        until_time=None,
+        pset=None,
+        resumption_token="",
+        limiter: Optional[RateLimiter] = None,
+        executor: Optional[Executor] = None,
+    ):
+        """
+        Async version of `iter_pages_by_oai`.
+        Every request takes a token from `limiter`; pass the same limiter to concurrent harvests so that they
+        share one request rate and all back off when any of them receives a 503 with Retry-After.
+        If `executor` is given, pages are parsed there instead of on the event loop, and the next page is
+        fetched while the current one is being parsed.
+        """
+        if limiter is None:
+            limiter = RateLimiter(rate=10)
+        loop = asyncio.get_running_loop()
+        # (future, peeked resumption token) of the page being parsed in executor
+        parsing = None
 
         async with aiohttp.ClientSession() as sess:
             while True:
                 true_url = cls.generate_url(resumption_token, from_time, until_time, pset)
+                await limiter.acquire()
                 logger.info(f"Get from {true_url}")
-                
+
                 async with sess.get(true_url) as response:
                     if response.status == 503:
                         logger.info("Receive 503 status code")
                         if "Retry-After" in response.headers:
                             logger.info(f"retry-after: {response.headers['Retry-After']}")
-                            await asyncio.sleep(float(response.headers['Retry-After']) + 0.5)
+                            limiter.pause(float(response.headers['Retry-After']) + 0.5)
                             continue
+                    response.raise_for_status()
 
-                    xml = await response.read()
-                    resumption_token = cls.from_oai_xml(xml, results)
+                    if executor is None:
+                        page = []
+                        if cls.oai_parser == "iterparse":
+                            parser = OAIPageParser(cls, page)
+                            async for chunk in response.content.iter_chunked(cls.oai_chunk_size):
+                                parser.feed(chunk)
+                            resumption_token = parser.close()
+                        else:
+                            resumption_token = cls.from_oai_xml(await response.read(), page)
+                    else:
+                        xml = await response.read()
+
+                if executor is None:
+                    yield page, resumption_token
+                else:
+                    next_parsing = (
+                        loop.run_in_executor(executor, cls.parse_oai_page, xml),
+                        cls._peek_resumption_token(xml),
+                    )
+                    del xml
+                    if parsing is not None:
+                        yield await cls._parsed_page(*parsing)
+                    parsing = next_parsing
+                    resumption_token = parsing[1]
 
                 if resumption_token == "":
                     break
 
-                await asyncio.sleep(0.1)
+        if parsing is not None:
+            yield await cls._parsed_page(*parsing)
+
+    @classmethod
+    async def async_iter_records_by_oai(
+        cls, from_time=None, until_time=None, pset=None, limiter: Optional[RateLimiter] = None, executor: Optional[Executor] = None
+    ):
+        """
+        Async version of `iter_records_by_oai`.
+        """
+        async for page, _ in cls.async_iter_pages_by_oai(from_time, until_time, pset, limiter=limiter, executor=executor):
+            yield page
 
+    @classmethod
+    async def async_get_records_by_oai(
+        cls, from_time=None, until_time=None, pset=None, limiter: Optional[RateLimiter] = None, executor: Optional[Executor] = None
+    ) -> List[ArxivRecord]:
+        results = []
+        async for page in cls.async_iter_records_by_oai(from_time, until_time, pset, limiter, executor):
+            results.extend(page)
         return results
+
+
+class OAIPageParser:
+    """
+    Incremental parser of an OAI-PMH ListRecords page: `feed` it the page in chunks as they arrive, records are
+    appended to `results` as soon as they are complete and their elements freed, `close` returns the resumption token.
+    """
+
+    def __init__(self, api, results):
+        self.api = api
+        self.results = results
+        self.resumption_token = ""
+        self._parser = etree.XMLPullParser(
+            events=("end",), tag=(api._OAI_record_tag, api._OAI_token_tag, api._OAI_error_tag)
+        )
+
+    def feed(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._parser.feed(data)
+        self._read_events()
+
+    def close(self):
+        self._parser.close()
+        self._read_events()
+        return self.resumption_token
+
+    def _read_events(self):
+        for _, node in self._parser.read_events():
+            if node.tag == self.api._OAI_record_tag:
+                record = self.api._record_from_oai_node(node)
+                if record is not None:
+                    self.results.append(record)
+                node.clear()
+                while node.getprevious() is not None:
+                    del node.getparent()[0]
+            elif node.tag == self.api._OAI_token_tag:
+                self.resumption_token = node.text if node.text else ""
+            elif node.get("code") != "noRecordsMatch":
+                raise OAIError(node.get("code"), node.text or "")
@@ -0,0 +1,99 @@
+"""
+ArxivSet mutation and set algebra at growing sizes.
+
+    python -m benchmarks.bench_arxiv_set [--sizes 10000 100000 1000000]
+
+The list-backed ArxivSet this replaced is measured as "legacy" up to --legacy_max records,
+since its bulk replacement and repeated unions are quadratic.
+"""
+import argparse
+import time
+from app.asset import ArxivSet
+from arxiv import ArxivRecord
+
+
+class LegacyArxivSet:
+    def __init__(self, records) -> None:
+        self.records = records
+        self.id2records = {r.id: r for r in self.records}
+
+    def add(self, record):
+        if record.id in self.id2records:
+            old_record = self.id2records[record.id]
+            self.records.remove(old_record)
+        self.id2records[record.id] = record
+        self.records.append(record)
+
+    def get_records(self):
+        return [record for record in self.records]
+
+    def union(self, other):
+        res = self.get_records()
+        for r in other.records:
+            if r.id not in self.id2records:
+                res.append(r)
+        return LegacyArxivSet(res)
+
+    def intersect(self, other):
+        res = []
+        for id, r in self.id2records.items():
+            if id in other.id2records:
+                res.append(r)
+        return LegacyArxivSet(res)
+
+
+def make_records(n, offset=0):
+    return [ArxivRecord(id=f"{i:08d}") for i in range(offset, offset + n)]
+
+
+def timed(f):
+    start = time.perf_counter()
+    f()
+    return time.perf_counter() - start
+
+
+def bench(set_cls, n, n_parts):
+    records = make_records(n)
+    updates = make_records(n // 2)
+    parts = [set_cls(records[i::n_parts]) for i in range(n_parts)]
+    other = set_cls(make_records(n, offset=n // 2))
+    results = {}
+
+    def add_replacing():
+        st = set_cls(list(records))
+        for r in updates:
+            st.add(r)
+
+    def repeated_union():
+        res = set_cls([])
+        for part in parts:
+            res = res.union(part)
+
+    results["add (replace n/2)"] = timed(add_replacing)
+    results[f"union of {n_parts} parts"] = timed(repeated_union)
+    full = set_cls(records)
+    results["intersect"] = timed(lambda: full.intersect(other))
+    if hasattr(full, "difference"):
+        results["difference"] = timed(lambda: full.difference(other))
+        results[f"n-ary union of {n_parts}"] = timed(lambda: set_cls([]).union(*parts))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--legacy_max", type=int, default=10_000)
+    parser.add_argument("--n_parts", type=int, default=20)
+    args = parser.parse_args()
+
+    for n in args.sizes:
+        impls = [("ArxivSet", ArxivSet)]
+        if n <= args.legacy_max:
+            impls.append(("legacy", LegacyArxivSet))
+        for name, set_cls in impls:
+            for op, t in bench(set_cls, n, args.n_parts).items():
+                print(f"{n:>9} {name:>9} {op:>22}: {t * 1000:10.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
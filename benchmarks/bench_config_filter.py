@@ -0,0 +1,90 @@
+"""
+CategoryFilterConfig.filt on a synthetic day against the previous four-pass evaluation.
+
+    python -m benchmarks.bench_config_filter [--n_records 5000]
+
+Records are tokenized before timing, as ArxivAsset does when a day is loaded.
+"""
+import argparse
+import random
+import time
+from app.asset import ArxivSet
+from app.config import CategoryFilterConfig
+from app.utils import RecordTokens
+from arxiv import ArxivAPI, ArxivRecord
+
+WORDS = (
+    "we propose novel method model learning neural network transformer diffusion graph vision language "
+    "large training data results show state art performance benchmark efficient robust attention "
+    "generative adversarial reinforcement policy optimization convex bound theorem proof"
+).split()
+
+CONFIG = {
+    "categories": ["cs.AI", "cs.CV", "cs.LG", "cs.CL"],
+    "authors": ["yann lecun", "fei-fei li", "geoffrey hinton"],
+    "keywd_in_title": ["diffusion model", "vision transformer", "graph neural network", "reinforcement learning"],
+    "keywd_in_abstract": ["state of the art", "large language model", "generative adversarial network"],
+}
+
+
+def synthetic_text(rnd, k, filler):
+    # most words of a real abstract are not part of any configured phrase
+    words = [rnd.choice(WORDS) if rnd.random() < 0.05 else rnd.choice(filler) for _ in range(k)]
+    if rnd.random() < 0.02:
+        words.insert(rnd.randrange(k), rnd.choice(CONFIG["keywd_in_title"] + CONFIG["keywd_in_abstract"]))
+    return " ".join(words)
+
+
+def synthetic_day(n, seed=0):
+    rnd = random.Random(seed)
+    categories = sorted(ArxivAPI.categories_set["cs"])
+    filler = [f"word{i}" for i in range(5000)]
+    return [
+        ArxivRecord(
+            id=f"2310.{i:05d}",
+            title=synthetic_text(rnd, 10, filler),
+            abstract=synthetic_text(rnd, 150, filler),
+            categories=rnd.sample(categories, k=rnd.randint(1, 3)),
+            authors=[f"Author{rnd.randint(0, 20000)} Name" for _ in range(rnd.randint(1, 8))],
+        )
+        for i in range(n)
+    ]
+
+
+def four_pass_filt(config: CategoryFilterConfig, data: ArxivSet):
+    tmp = config.category_filter(data)
+    tmps = [f(tmp) for f in [config.authors_filter, config.title_filter, config.abstract_filter]]
+    res = ArxivSet([])
+    for t in tmps:
+        res = res.union(t)
+    return res
+
+
+def best_of(f, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_records", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    data = ArxivSet(synthetic_day(args.n_records))
+    for record in data:
+        RecordTokens.of(record)
+    config = CategoryFilterConfig(CONFIG)
+    assert {r.id for r in config.filt(data)} == {r.id for r in four_pass_filt(config, data)}
+
+    print(f"{len(data)} records, {len(config.filt(data))} selected")
+    print(f" four-pass: {best_of(lambda: four_pass_filt(config, data), args.repeat) * 1000:8.2f} ms")
+    print(f"     fused: {best_of(lambda: config.filt(data), args.repeat) * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Cold load of one cached day: pickle in zip (the previous format) against the memory-mapped DailyFile.
+
+    python -m benchmarks.bench_daily_file [--n_records 5000]
+"""
+import argparse
+import os
+import pickle
+import tempfile
+import time
+import zipfile
+from app.asset import ArxivDaily, ArxivFilter, MappedArxivDaily
+from app.dailyfile import DailyFile
+from app.utils import RecordTokens
+from benchmarks.bench_config_filter import synthetic_day
+
+DATE = "2023-10-02"
+
+
+def load_zip(path):
+    with zipfile.ZipFile(path, "r") as zf:
+        return pickle.loads(zf.read(DATE))
+
+
+def load_mapped(path):
+    return MappedArxivDaily(DailyFile(path))
+
+
+def best_of(f, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_records", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    daily = ArxivDaily(DATE, "cs", synthetic_day(args.n_records))
+    for record in daily:
+        RecordTokens.of(record)
+    category_filter = ArxivFilter(categories=["cs.AI", "cs.CV"])
+
+    with tempfile.TemporaryDirectory() as root:
+        zip_path = os.path.join(root, DATE + ".zip")
+        with zipfile.ZipFile(zip_path, "w") as zf:
+            zf.writestr(DATE, pickle.dumps(daily))
+        pday_path = os.path.join(root, DATE + ".pday")
+        DailyFile.write(pday_path, DATE, "cs", daily)
+
+        print(f"{args.n_records} records, zip {os.path.getsize(zip_path) / 2**20:.1f} MiB, "
+              f"pday {os.path.getsize(pday_path) / 2**20:.1f} MiB")
+        for name, load, path in [("zip", load_zip, zip_path), ("pday", load_mapped, pday_path)]:
+            t_load = best_of(lambda: load(path), args.repeat)
+            t_query = best_of(lambda: category_filter(load(path)), args.repeat)
+            print(f"{name:>6}: load {t_load * 1000:8.2f} ms, load + category filter {t_query * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
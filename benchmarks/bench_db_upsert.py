@@ -0,0 +1,61 @@
+"""
+Writing a harvested day to SQLite: the previous single REPLACE INTO transaction against update_records.
+
+    python -m benchmarks.bench_db_upsert [--n_records 5000]
+
+The second write of each path is a re-harvest in which 5% of the records have a new datestamp.
+"""
+import argparse
+import os
+import tempfile
+import time
+from sqlalchemy import text
+from benchmarks.bench_config_filter import synthetic_day
+from db import SQLiteInterface
+
+
+def make_db(root, name):
+    return SQLiteInterface(os.path.join(root, name))
+
+
+def replace_records(db, records):
+    with db.engine.begin() as conn:
+        conn.execute(
+            text("REPLACE INTO paper_crawl VALUES (:id, :title, :abstract, :categories, :authors, :published, :updated);"),
+            [db.record_to_dict(record) for record in records],
+        )
+
+
+def timed(f):
+    start = time.perf_counter()
+    res = f()
+    return time.perf_counter() - start, res
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_records", type=int, default=5000)
+    args = parser.parse_args()
+
+    day = synthetic_day(args.n_records)
+    for record in day:
+        record.published = "2023-10-01"
+    reharvest = synthetic_day(args.n_records)
+    for i, record in enumerate(reharvest):
+        record.published = "2023-10-01"
+        record.updated = "2023-10-03" if i % 20 == 0 else ""
+
+    with tempfile.TemporaryDirectory() as root:
+        db = make_db(root, "replace.db")
+        t_first, _ = timed(lambda: replace_records(db, day))
+        t_second, _ = timed(lambda: replace_records(db, reharvest))
+        print(f"REPLACE INTO: first {t_first * 1000:.0f} ms, re-harvest {t_second * 1000:.0f} ms")
+
+        db = make_db(root, "upsert.db")
+        t_first, counts_first = timed(lambda: db.update_records(day))
+        t_second, counts_second = timed(lambda: db.update_records(reharvest))
+        print(f"update_records: first {t_first * 1000:.0f} ms {counts_first}, re-harvest {t_second * 1000:.0f} ms {counts_second}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Cross-date search with InvertedIndex against scanning every cached day with ArxivFilter.
+
+    python -m benchmarks.bench_index [--n_days 100] [--n_records 500]
+
+Records are tokenized by whitespace, the synthetic text has no punctuation.
+"""
+import argparse
+import tempfile
+import time
+from app.asset import ArxivFilter
+from app.index import InvertedIndex
+from app.utils import RecordTokens
+from benchmarks.bench_config_filter import synthetic_day
+
+QUERIES = [
+    {"phrases": ["diffusion model"]},
+    {"phrases": ["graph neural network"], "authors": ["author17 name"]},
+    {"phrases": ["transformer"]},
+    {"authors": ["author4242 name"]},
+]
+
+
+def scan(days, phrases=(), authors=()):
+    title_filter = ArxivFilter(keypoints_in_title=list(phrases))
+    abstract_filter = ArxivFilter(keypoints_in_abstract=list(phrases))
+    res = []
+    for day in days:
+        for record in day:
+            if authors and not all(a in (x.lower() for x in record.authors) for a in authors):
+                continue
+            if phrases and not (title_filter._filt_by_keypoint_in_title(record) or abstract_filter._filt_by_keypoint_in_abstract(record)):
+                continue
+            res.append(record.id)
+    return res
+
+
+def best_of(f, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_days", type=int, default=100)
+    parser.add_argument("--n_records", type=int, default=500)
+    args = parser.parse_args()
+
+    days = []
+    for i in range(args.n_days):
+        day = synthetic_day(args.n_records, seed=i)
+        for record in day:
+            record.id = f"{i}.{record.id}"
+            record.tokens = RecordTokens(tuple(record.title.lower().split()), tuple(record.abstract.lower().split()))
+        days.append(day)
+
+    with tempfile.TemporaryDirectory() as root:
+        index = InvertedIndex(root, compact_every=args.n_days + 1)
+        start = time.perf_counter()
+        for i, day in enumerate(days):
+            index.add_daily("cs", f"day{i:05d}", day)
+        print(f"index {args.n_days * args.n_records} records: {time.perf_counter() - start:.1f}s")
+        start = time.perf_counter()
+        index.save()
+        print(f"save snapshot: {time.perf_counter() - start:.2f}s")
+        start = time.perf_counter()
+        index = InvertedIndex(root)
+        print(f"load snapshot: {time.perf_counter() - start:.2f}s")
+
+        for query in QUERIES:
+            t_index = best_of(lambda: index.search(**query), 5)
+            hits = index.search(**query)
+            start = time.perf_counter()
+            ids = scan(days, **query)
+            t_scan = time.perf_counter() - start
+            assert [id for id, _, _ in hits] == ids
+            print(f"{query}: {len(hits)} hits, index {t_index * 1000:.1f} ms, scan {t_scan * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Compare ArxivAPI.from_oai_xml (tree) with ArxivAPI.from_oai_xml_iterparse, both given the whole page, and with
+ArxivAPI.from_oai_chunks fed the page as it is read, the way harvests parse responses.
+
+    python -m benchmarks.bench_oai_parser [recorded_page.xml ...]
+
+Without arguments, synthetic pages of the size arxiv serves (1000 records per page) are used.
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from arxiv import ArxivAPI
+from tests.fake_oai import make_page_xml, make_record_xml
+
+
+
+def _read_whole(parse):
+    def parse_file(path, results):
+        with open(path, "rb") as f:
+            return parse(f.read(), results)
+    return parse_file
+
+
+def _parse_stream(path, results):
+    with open(path, "rb") as f:
+        return ArxivAPI.from_oai_chunks(iter(lambda: f.read(ArxivAPI.oai_chunk_size), b""), results)
+
+
+PARSERS = {
+    "tree": _read_whole(ArxivAPI.from_oai_xml),
+    "iterparse": _read_whole(ArxivAPI.from_oai_xml_iterparse),
+    "stream": _parse_stream,
+}
+
+
+def synthetic_pages(n_pages, records_per_page):
+    pages = []
+    for p in range(n_pages):
+        records_xml = [
+            make_record_xml(
+                f"2310.{p:02d}{i:03d}",
+                title=f"On the\n  convergence of transformer {i}",
+                abstract=" ".join(["We study the diffusion of\n   tokens in large models."] * 25),
+                categories="cs.LG cs.AI stat.ML",
+                authors=[(f"Forename{j}", f"Keyname{j}") for j in range(6)],
+                updated="2023-10-02",
+            )
+            for i in range(records_per_page)
+        ]
+        pages.append(make_page_xml(records_xml, resumption_token=f"token|{p + 1}"))
+    return pages
+
+
+def _status_kb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+
+
+def _peak_memory_kb(parser, paths, queue):
+    parse = PARSERS[parser]
+    peak = 0
+    for path in paths:
+        before = _status_kb("VmRSS")
+        # resets VmHWM, the peak resident set, to the current one
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        parse(path, [])
+        peak = max(peak, _status_kb("VmHWM") - before)
+    queue.put(peak)
+
+
+def peak_memory_kb(parser, paths):
+    """
+    Largest rise of the resident set above its level before a page is parsed (Linux only), measured in a fresh
+    process since memory freed by earlier parses stays resident and would be reused.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_peak_memory_kb, args=(parser, paths, queue))
+    proc.start()
+    res = queue.get()
+    proc.join()
+    return res
+
+
+def parse_time(parser, paths, repeat):
+    parse = PARSERS[parser]
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path in paths:
+            parse(path, [])
+        best = min(best, time.perf_counter() - start)
+    return best / len(paths)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pages", nargs="*", help="recorded OAI-PMH ListRecords pages")
+    parser.add_argument("--n_pages", type=int, default=5)
+    parser.add_argument("--records_per_page", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.pages:
+        pages = []
+        for path in args.pages:
+            with open(path, "rb") as f:
+                pages.append(f.read())
+    else:
+        pages = synthetic_pages(args.n_pages, args.records_per_page)
+    n_records = 0
+    for page in pages:
+        records = []
+        ArxivAPI.from_oai_xml(page, records)
+        n_records += len(records)
+    print(f"{len(pages)} page(s), {n_records} record(s), {sum(len(p) for p in pages) / 2**20:.1f} MiB")
+
+    # parsers read the pages from files, as they would from responses, so that the page bytes count in their peak
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = []
+        for i, page in enumerate(pages):
+            paths.append(os.path.join(tmpdir, f"{i}.xml"))
+            with open(paths[-1], "wb") as f:
+                f.write(page)
+        del pages
+        for name in PARSERS:
+            t = parse_time(name, paths, args.repeat)
+            mem = peak_memory_kb(name, paths)
+            print(f"{name:>10}: {t * 1000:8.2f} ms/page, peak rss +{mem / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
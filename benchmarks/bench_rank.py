@@ -0,0 +1,47 @@
+"""
+Ranking the filtered records of a synthetic day with RelevanceRanker.
+
+    python -m benchmarks.bench_rank [--n_records 5000]
+
+Term statistics are built once per daily set, ranking only reads them.
+"""
+import argparse
+import time
+from app.config import CategoryFilterConfig
+from app.rank import RelevanceRanker, TermStats
+from app.utils import RecordTokens
+from benchmarks.bench_config_filter import CONFIG, synthetic_day
+
+
+def best_of(f, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_records", type=int, default=5000)
+    args = parser.parse_args()
+
+    day = synthetic_day(args.n_records)
+    for record in day:
+        RecordTokens.of(record)
+    config = CategoryFilterConfig(CONFIG)
+    filtered = config.filt(day)
+
+    start = time.perf_counter()
+    stats = TermStats(day)
+    print(f"term stats of {len(day)} records: {(time.perf_counter() - start) * 1000:.0f} ms (once per daily set)")
+    ranker = RelevanceRanker(config)
+    t_rank = best_of(lambda: ranker.rank(filtered, [stats]), 20)
+    print(f"rank {len(filtered)} filtered records: {t_rank * 1000:.2f} ms")
+    t_rank = best_of(lambda: ranker.rank(day, [stats]), 20)
+    print(f"rank all {len(day)} records: {t_rank * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Memory held by one cached day in each record layout.
+
+    python -m benchmarks.bench_record_memory [--n_records 5000]
+
+Strings are built from a synthetic OAI page, the way a harvest or cache load creates them.
+"""
+import argparse
+import gc
+import sys
+import tracemalloc
+from app.asset import ArxivSet
+from arxiv import ArxivAPI
+from benchmarks.bench_oai_parser import synthetic_pages
+
+
+class DictRecord:
+    # ArxivRecord before __slots__
+    def __init__(self, id, title, abstract, categories, authors, published, updated):
+        self.id = id
+        self.title = title
+        self.abstract = abstract
+        self.categories = categories
+        self.authors = authors
+        self.published = published
+        self.updated = updated
+
+
+def build_dict_set(page):
+    records = []
+    ArxivAPI.from_oai_xml(page, records)
+    records = [
+        DictRecord(r.id, r.title, r.abstract, [str(c) for c in r.categories], list(r.authors), r.published, r.updated)
+        for r in records
+    ]
+    return records, {r.id: r for r in records}
+
+
+def build_slotted_set(page):
+    records = []
+    ArxivAPI.from_oai_xml(page, records)
+    return ArxivSet(records)
+
+
+def build_columnar_set(page):
+    return build_slotted_set(page).to_columnar()
+
+
+def measure(build, page):
+    gc.collect()
+    tracemalloc.start()
+    data = build(page)
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_records", type=int, default=5000)
+    args = parser.parse_args()
+
+    page = synthetic_pages(1, args.n_records)[0]
+    # titles and abstracts are the same str objects in every layout
+    text_size = sum(sys.getsizeof(r.title) + sys.getsizeof(r.abstract) for r in build_slotted_set(page).get_records())
+    for name, build in [("dict", build_dict_set), ("slotted", build_slotted_set), ("columnar", build_columnar_set)]:
+        size = measure(build, page)
+        overhead = (size - text_size) / args.n_records
+        print(f"{name:>10}: {size / 2**20:7.2f} MiB, {overhead:6.0f} B/record besides title and abstract")
+
+
+if __name__ == "__main__":
+    main()
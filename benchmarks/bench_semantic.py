@@ -0,0 +1,50 @@
+"""
+Semantic filtering of a synthetic day with vectors mapped from the daily cache against encoding every request.
+
+    python -m benchmarks.bench_semantic [--n_records 5000]
+"""
+import argparse
+import tempfile
+import time
+from app.asset import ArxivAsset, ArxivDaily, ArxivFilter
+from app.utils import RecordTokens
+from benchmarks.bench_config_filter import synthetic_day
+
+QUERIES = ["diffusion model for image generation", "graph neural network", "reinforcement learning policy"]
+
+
+def best_of(f, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_records", type=int, default=5000)
+    args = parser.parse_args()
+
+    day = synthetic_day(args.n_records)
+    for record in day:
+        RecordTokens.of(record)
+
+    with tempfile.TemporaryDirectory() as root:
+        asset = ArxivAsset(root)
+        start = time.perf_counter()
+        asset.encoder.encode_records(day)
+        print(f"encode {len(day)} records at ingest: {(time.perf_counter() - start) * 1000:.0f} ms")
+        asset.cache(ArxivDaily("2023-10-02", "cs", day), "cs", "2023-10-02")
+        mapped = asset.load_cache("cs", "2023-10-02").get_records()
+
+        semantic_filter = ArxivFilter(semantic=QUERIES)
+        t_mapped = best_of(lambda: semantic_filter.semantic_scores(mapped), 10)
+        t_encode = best_of(lambda: semantic_filter.semantic_scores(day), 3)
+        print(f"score {len(day)} records, vectors mapped: {t_mapped * 1000:.1f} ms")
+        print(f"score {len(day)} records, encoded per request: {t_encode * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,5 +6,29 @@ CREATE TABLE IF NOT EXISTS paper_crawl
     categories VARCHAR(255),
     authors VARCHAR(10002),
     published DATE NOT NULL,
-    updated DATE
+    updated DATE,
+    INDEX paper_published (published),
+    INDEX paper_updated (updated),
+    FULLTEXT INDEX paper_title_ft (title),
+    FULLTEXT INDEX paper_abstract_ft (abstract)
+);
+-- for a paper_crawl table created before the indexes:
+-- ALTER TABLE paper_crawl ADD INDEX paper_published (published), ADD INDEX paper_updated (updated),
+--     ADD FULLTEXT INDEX paper_title_ft (title), ADD FULLTEXT INDEX paper_abstract_ft (abstract);
+
+CREATE TABLE IF NOT EXISTS paper_category
+(
+    category VARCHAR(31) NOT NULL,
+    id VARCHAR(31) NOT NULL,
+    PRIMARY KEY (category, id),
+    INDEX paper_category_id (id)
+);
+
+CREATE TABLE IF NOT EXISTS harvest_state
+(
+    pset VARCHAR(31) NOT NULL PRIMARY KEY,
+    watermark DATE,
+    from_time DATE,
+    until_time DATE,
+    resumption_token VARCHAR(255) NOT NULL DEFAULT ''
 );
@@ -1,11 +1,16 @@
-from arxiv import ArxivAPI
+from arxiv import ArxivAPI, RateLimiter, OAIError
 import time
 from datetime import timedelta
 from datetime import datetime as ddt
 import datetime
 import logging
 import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import db
+from app.asset import ArxivAsset
+from app.config import ConfigRegistry
+from app.digest import DigestPublisher, DigestStore
+from app.index import InvertedIndex
 
 logger = logging.getLogger(__name__)
 sh = logging.StreamHandler()
@@ -31,10 +36,120 @@ def get_psets(pset=None):
     return psets
 
 
+class DBWriter:
+    """
+    Commits harvested pages in the background, one at a time and in arrival order, on a thread of its own:
+    the records of a page, then the harvest state reached with it. `put` waits while max_pending pages are queued.
+    A failed write is retried until it succeeds or the writer is closed, so that the harvest state never gets
+    ahead of the records.
+    """
+
+    def __init__(self, dbint, max_pending=8, retry_delay=5.0, max_retry_delay=300.0) -> None:
+        self.dbint = dbint
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._executor = None
+        self._task = None
+
+    def start(self):
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="db-writer")
+        self._task = asyncio.create_task(self._run())
+
+    async def put(self, pset, records, state):
+        await self.queue.put((pset, records, state))
+
+    async def call(self, fn, *args):
+        """
+        Run a DB call on the thread of the writer, off the event loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _write(self, pset, records, state):
+        if len(records) > 0:
+            self.dbint.update_records(records)
+        self.dbint.save_harvest_state(pset, state)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.queue.get()
+            try:
+                if item is None:
+                    return
+                delay = self.retry_delay
+                while True:
+                    try:
+                        await loop.run_in_executor(self._executor, self._write, *item)
+                        break
+                    except Exception as e:
+                        logger.error(f"DB write of {item[0]} failed, retry in {delay} seconds: {e}")
+                        await asyncio.sleep(delay)
+                        delay = min(delay * 2, self.max_retry_delay)
+            finally:
+                self.queue.task_done()
+
+    async def flush(self):
+        """
+        Wait until every queued page is committed.
+        """
+        await self.queue.join()
+
+    async def _drain(self):
+        await self.queue.put(None)
+        await self._task
+
+    async def close(self, timeout=60.0):
+        """
+        Commit the queued pages and stop. Pages still not committed after timeout seconds (None to wait for
+        them) are dropped: the harvest state committed last only covers committed records, so the next harvest
+        starts over from it.
+        """
+        if self._task is None:
+            return
+        completed = True
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except asyncio.TimeoutError:
+            completed = False
+            logger.error(f"DB writes still failing after {timeout} seconds, drop {self.queue.qsize()} queued page(s)")
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=completed)
+        self._task = None
+        self._executor = None
+
+
 class PaperCrawlDaemon:
-    def __init__(self, psets, db_ip, db_user, db_passwd):
+    def __init__(
+        self, psets, db_ip, db_user, db_passwd, max_concurrency=4, rate=1.0, parse_workers=0, max_pending_writes=8,
+        sqlite_path=None, publish=True, configs_root="configs", publish_days=2,
+    ):
+        """
+        Args:
+            sqlite_path: store records in this SQLite file instead of MySQL
+            publish: after the harvest of a day, cache the daily sets of the last `publish_days` dates
+                     and write the digest of every config of configs_root on them
+        """
         self.psets = psets
-        self.dbint = db.DBInterface(db_user, db_passwd, db_ip)
+        if sqlite_path is not None:
+            self.dbint = db.SQLiteInterface(sqlite_path)
+        else:
+            self.dbint = db.MySQLInterface(db_user, db_passwd, db_ip)
+        self.max_concurrency = max_concurrency
+        self.limiter = RateLimiter(rate=rate, capacity=max_concurrency)
+        self.parse_workers = parse_workers
+        # pages are parsed on the event loop if None
+        self.parse_executor = None
+        self.max_pending_writes = max_pending_writes
+        self.writer = None
+        self.publish = publish
+        self.configs_root = configs_root
+        self.publish_days = publish_days
+        self.publisher = None
 
     def check_psets(self):
         if isinstance(self.psets, str):
@@ -46,26 +161,95 @@ class PaperCrawlDaemon:
             return False
         return True
 
+    @classmethod
+    def _harvest_window(cls, state, date: str):
+        """
+        Returns (from_time, until_time, resumption_token) of the next harvest of a pset.
+        """
+        if state is not None and state["resumption_token"]:
+            return state["from_time"], state["until_time"], state["resumption_token"]
+        if state is not None and state["watermark"]:
+            # datestamps have day granularity, the watermark day may have received records after the last harvest
+            return state["watermark"], date, ""
+        d_date = datetime.datetime.strptime(date, "%Y-%m-%d")
+        d_yesterday = d_date - timedelta(days=1)
+        return d_yesterday.strftime("%Y-%m-%d"), date, ""
+
     async def _request(self, pset, date: str, sleep_time=5):
+        """
+        Yield (records, state) page by page until pset is harvested up to date, starting from the persisted
+        harvest state. `state` must be saved once the records are written; an interrupted harvest then continues
+        at the page it stopped at.
+        """
+        # a DB round trip must not stall the other harvests on the event loop
+        if self.writer is not None:
+            state = await self.writer.call(self.dbint.load_harvest_state, pset)
+        else:
+            state = await asyncio.get_running_loop().run_in_executor(None, self.dbint.load_harvest_state, pset)
         while True:
+            from_time, until_time, resumption_token = self._harvest_window(state, date)
             try:
-                logging.info(f"Request ({pset}, {date})")
-                d_date = datetime.datetime.strptime(date, "%Y-%m-%d")
-                d_yesterday = d_date - timedelta(days=1)
-                s_yesterday = d_yesterday.strftime("%Y-%m-%d")
-                records = await ArxivAPI.async_get_records_by_oai(
-                    from_time=s_yesterday, until_time=date, pset=pset
-                )
-                return records
+                logging.info(f"Request ({pset}, {from_time} ~ {until_time})")
+                async for records, resumption_token in ArxivAPI.async_iter_pages_by_oai(
+                    from_time=from_time,
+                    until_time=until_time,
+                    pset=pset,
+                    resumption_token=resumption_token,
+                    limiter=self.limiter,
+                    executor=self.parse_executor,
+                ):
+                    if resumption_token:
+                        state = {
+                            "watermark": state["watermark"] if state else None,
+                            "from_time": from_time,
+                            "until_time": until_time,
+                            "resumption_token": resumption_token,
+                        }
+                    else:
+                        state = {"watermark": until_time, "from_time": None, "until_time": None, "resumption_token": ""}
+                    yield records, state
+                if until_time >= date:
+                    return
+            except OAIError as e:
+                if e.code != "badResumptionToken":
+                    logger.error(f"Request ({pset}, {from_time} ~ {until_time}) is rejected: {e}")
+                    return
+                logger.error(f"Resumption token of ({pset}, {from_time} ~ {until_time}) expired, restart the harvest")
+                state = dict(state, resumption_token="")
             except Exception as e:
                 logger.error(f"Request ({pset}, {date}) receives an exception: {e}, waiting for {sleep_time} seconds")
                 await asyncio.sleep(sleep_time)
 
     async def _request_all(self, date: str):
-        results = []
-        for pset in self.psets:
-            results.extend(await self._request(pset, date))
-        return results
+        """
+        Harvest all psets concurrently (at most `max_concurrency` at a time, all sharing `self.limiter`)
+        and yield (pset, records, state) in arrival order.
+        """
+        queue = asyncio.Queue(maxsize=self.max_concurrency)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def harvest(pset):
+            async with semaphore:
+                async for records, state in self._request(pset, date):
+                    await queue.put((pset, records, state))
+
+        async def harvest_all():
+            try:
+                await asyncio.gather(*[harvest(pset) for pset in self.psets])
+            finally:
+                await queue.put(None)
+
+        task = asyncio.create_task(harvest_all())
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                yield item
+            await task
+        finally:
+            if not task.done():
+                task.cancel()
 
     async def crawl_loop(self):
         last_date = None
@@ -75,12 +259,22 @@ class PaperCrawlDaemon:
             if last_date is None or last_date.day != now.day:
                 logger.info("Fetch")
                 last_date = now
-                results = await self._request_all(now.strftime("%Y-%m-%d"))
-                self.dbint.update_records(results)
+                async for pset, records, state in self._request_all(now.strftime("%Y-%m-%d")):
+                    await self.writer.put(pset, records, state)
+                await self.writer.flush()
+                if self.publisher is not None:
+                    await self._publish(now)
 
             logger.info(f"Sleep for {awake_interval_seconds / 3600} hours...")
             await asyncio.sleep(awake_interval_seconds)
 
+    async def _publish(self, now):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.publisher.publish_recent, self.psets, now, self.publish_days)
+        except Exception as e:
+            logger.error(f"Publishing digests receives an exception: {e}")
+
     async def command(self):
         pass
 
@@ -88,11 +282,27 @@ class PaperCrawlDaemon:
         if not self.check_psets():
             return
 
-        tasks = []
-        tasks.append(self.crawl_loop())
-        tasks.append(self.command())
+        if self.parse_workers > 0:
+            self.parse_executor = ProcessPoolExecutor(self.parse_workers)
+        self.writer = DBWriter(self.dbint, self.max_pending_writes)
+        self.writer.start()
+        if self.publish:
+            # the days cached from the stored records are indexed for the /search of the app
+            self.publisher = DigestPublisher(
+                ArxivAsset(index=InvertedIndex()), ConfigRegistry(self.configs_root), DigestStore(), source=self.dbint
+            )
+        try:
+            tasks = []
+            tasks.append(self.crawl_loop())
+            tasks.append(self.command())
 
-        await asyncio.gather(*tasks)
+            await asyncio.gather(*tasks)
+        finally:
+            # harvested pages are committed before exiting
+            await self.writer.close()
+            if self.parse_executor is not None:
+                self.parse_executor.shutdown()
+                self.parse_executor = None
 
 
 if __name__ == "__main__":
@@ -101,13 +311,25 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--pset")
+    parser.add_argument("--concurrency", type=int, default=4, help="number of psets harvested at the same time")
+    parser.add_argument("--rate", type=float, default=1.0, help="requests per second shared by all harvests")
+    parser.add_argument("--parse_workers", type=int, default=0, help="processes parsing pages, 0 to parse on the event loop")
+    parser.add_argument("--write_queue", type=int, default=8, help="harvested pages waiting for the database before harvesting pauses")
+    parser.add_argument("--sqlite", help="store records in this SQLite file instead of MySQL")
+    parser.add_argument("--no_publish", action="store_true", help="do not precompute the daily digests of the configs")
+    parser.add_argument("--configs", default="configs", help="directory of the configs to precompute digests of")
     args = parser.parse_args()
     pset = args.pset
-    db_ip = input("Database address(default 127.0.0.1): ")
-    if len(db_ip) == 0:
-        db_ip = "127.0.0.1"
-    db_user = input("Database user: ")
-    db_passwd = getpass.getpass("Database passwd: ")
+    db_ip, db_user, db_passwd = None, None, None
+    if args.sqlite is None:
+        db_ip = input("Database address(default 127.0.0.1): ")
+        if len(db_ip) == 0:
+            db_ip = "127.0.0.1"
+        db_user = input("Database user: ")
+        db_passwd = getpass.getpass("Database passwd: ")
 
-    pc_daemon = PaperCrawlDaemon(pset, db_ip, db_user, db_passwd)
+    pc_daemon = PaperCrawlDaemon(
+        pset, db_ip, db_user, db_passwd, args.concurrency, args.rate, args.parse_workers, args.write_queue,
+        sqlite_path=args.sqlite, publish=not args.no_publish, configs_root=args.configs,
+    )
     asyncio.run(pc_daemon.run())
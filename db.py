@@ -1,7 +1,8 @@
 from arxiv import ArxivAPI, ArxivRecord
-from typing import List
+from typing import List, Optional
+import abc
 import logging
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, event, text
 
 
 logger = logging.getLogger(__name__)
@@ -13,10 +14,22 @@ logger.addHandler(sh)
 logger.propagate = False
 
 
-class DBInterface:
-    def __init__(self, user, passwd, ip='127.0.0.1', port=3306, pool_recycle=3600):
-        self.engine = create_engine(f"mysql+pymysql://{user}:{passwd}@{ip}/papers?charset=utf8mb4",
-                                        pool_recycle=pool_recycle)
+class DBInterface(abc.ABC):
+    """
+    Paper store over SQLAlchemy. Subclasses provide the statements specific to their database:
+    the upsert and the phrase matching of query_records.
+    """
+    _columns = ('id', 'title', 'abstract', 'categories', 'authors', 'published', 'updated')
+    # characters other than letters and digits that the full-text index keeps inside words
+    _word_chars = ""
+
+    def __init__(self, url, pool_recycle=3600, batch_size=500):
+        """
+        Args:
+            batch_size: records written per statement and transaction by update_records
+        """
+        self.engine = create_engine(url, pool_recycle=pool_recycle)
+        self.batch_size = batch_size
 
     def record_to_dict(self, record: ArxivRecord):
         return {
@@ -29,12 +42,279 @@ class DBInterface:
             'updated': record.updated if record.updated else None
         }
 
-    def update_records(self, records: List[ArxivRecord]):
+    @classmethod
+    def row_to_record(cls, row) -> ArxivRecord:
+        return ArxivRecord(
+            id=row.id,
+            title=row.title,
+            abstract=row.abstract or "",
+            categories=row.categories.split(";;") if row.categories else [],
+            authors=row.authors.split(";;") if row.authors else [],
+            published=str(row.published) if row.published else None,
+            updated=str(row.updated) if row.updated else None,
+        )
+
+    @abc.abstractmethod
+    def _upsert_sql(self):
+        """
+        Returns the statement inserting a record dict, or updating the record of the same id.
+        """
+
+    def _write_categories(self, conn, rc_dicts):
+        """
+        Index the (lowercased) categories of rc_dicts in paper_category.
+        """
+        conn.execute(
+            text("DELETE FROM paper_category WHERE id IN :ids;").bindparams(bindparam('ids', expanding=True)),
+            {'ids': [d['id'] for d in rc_dicts]},
+        )
+        rows = [
+            {'category': category, 'id': d['id']}
+            for d in rc_dicts
+            for category in set(c.lower() for c in d['categories'].split(";;") if c)
+        ]
+        if rows:
+            conn.execute(text("INSERT INTO paper_category (category, id) VALUES (:category, :id);"), rows)
+
+    def update_records(self, records: List[ArxivRecord], batch_size=None):
+        """
+        Insert new records and update those whose `updated` datestamp changed, in transactions of batch_size records.
+        Returns dict(inserted, updated, skipped).
+        """
+        counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
         if len(records) == 0:
-            return
-        rc_dicts = [self.record_to_dict(record) for record in records]
+            return counts
+        batch_size = batch_size or self.batch_size
+        # the last version of a record repeated in records wins
+        rc_dicts = list({record.id: self.record_to_dict(record) for record in records}.values())
+        counts['skipped'] = len(records) - len(rc_dicts)
+
+        select_sql = text("SELECT id, updated FROM paper_crawl WHERE id IN :ids;").bindparams(
+            bindparam('ids', expanding=True)
+        )
+        upsert_sql = text(self._upsert_sql())
+        for start in range(0, len(rc_dicts), batch_size):
+            batch = rc_dicts[start:start + batch_size]
+            with self.engine.begin() as conn:
+                stored = {
+                    row.id: str(row.updated) if row.updated else None
+                    for row in conn.execute(select_sql, {'ids': [d['id'] for d in batch]})
+                }
+                changed = []
+                for d in batch:
+                    if d['id'] not in stored:
+                        counts['inserted'] += 1
+                    elif stored[d['id']] != d['updated']:
+                        counts['updated'] += 1
+                    else:
+                        counts['skipped'] += 1
+                        continue
+                    changed.append(d)
+                if changed:
+                    conn.execute(upsert_sql, changed)
+                    self._write_categories(conn, changed)
+        logger.info(f"DB: insert {counts['inserted']}, update {counts['updated']}, skip {counts['skipped']} record(s)")
+        return counts
+
+    @staticmethod
+    def _like_pattern(s):
+        # escaped with "!", which both MySQL and SQLite string literals leave alone
+        s = s.replace("!", "!!").replace("%", "!%").replace("_", "!_")
+        return f"%{s}%"
+
+    @classmethod
+    def _phrase_words(cls, phrase):
+        """
+        Words of phrase as split by the full-text index: runs of letters, digits and _word_chars.
+        """
+        return "".join(c if c.isalnum() or c in cls._word_chars else " " for c in phrase).split()
+
+    @abc.abstractmethod
+    def _phrase_condition(self, column, phrases, params) -> Optional[str]:
+        """
+        Returns a condition on p.<column> which holds for records containing any of phrases, adding its
+        parameters to params, or None if they cannot be matched by the index.
+        """
 
-        insert_sql = f"REPLACE INTO paper_crawl VALUES (:id, :title, :abstract, :categories, :authors, :published, :updated);"
+    def query_records(
+        self, start: str, end: str, categories=None, title_phrases=None, abstract_phrases=None, authors=None
+    ) -> List[ArxivRecord]:
+        """
+        Records published or updated in [start, end] in any of categories (all if None).
+        If any of title_phrases, abstract_phrases and authors is not None, only the records containing one of the
+        phrases in their title or abstract, or with one of the authors, are returned; phrases are matched by the
+        full-text index on words and authors by substring, so the result is a superset of the records matched
+        by ArxivFilter.
+        """
+        params = {'start': start, 'end': end}
+        conditions = ["(p.published BETWEEN :start AND :end OR p.updated BETWEEN :start AND :end)"]
+        if categories is not None:
+            params['categories'] = [c.lower() for c in categories] or [""]
+            conditions.append("p.id IN (SELECT c.id FROM paper_category c WHERE c.category IN :categories)")
+
+        if title_phrases is not None or abstract_phrases is not None or authors is not None:
+            any_of = []
+            for column, phrases in [("title", title_phrases), ("abstract", abstract_phrases)]:
+                if phrases:
+                    condition = self._phrase_condition(column, phrases, params)
+                    if condition is None:
+                        # cannot be narrowed down by the index
+                        any_of = None
+                        break
+                    any_of.append(condition)
+            if any_of is not None:
+                for i, author in enumerate(authors or []):
+                    params[f'author{i}'] = self._like_pattern(author)
+                    any_of.append(f"p.authors LIKE :author{i} ESCAPE '!'")
+                if not any_of:
+                    return []
+                conditions.append("(" + " OR ".join(any_of) + ")")
+
+        select_sql = text(
+            f"SELECT p.* FROM paper_crawl p WHERE {' AND '.join(conditions)} ORDER BY p.id;"
+        )
+        if categories is not None:
+            select_sql = select_sql.bindparams(bindparam('categories', expanding=True))
+        with self.engine.connect() as conn:
+            return [self.row_to_record(row) for row in conn.execute(select_sql, params)]
+
+    def load_harvest_state(self, pset):
+        """
+        Returns dict(watermark, from_time, until_time, resumption_token) of pset, or None if pset was never harvested.
+        watermark is the `until` of the last completed harvest; a non-empty resumption_token marks an unfinished
+        harvest of [from_time, until_time].
+        """
+        select_sql = "SELECT watermark, from_time, until_time, resumption_token FROM harvest_state WHERE pset = :pset;"
+        with self.engine.connect() as conn:
+            row = conn.execute(text(select_sql), {'pset': pset}).first()
+        if row is None:
+            return None
+        return {
+            'watermark': str(row.watermark) if row.watermark else None,
+            'from_time': str(row.from_time) if row.from_time else None,
+            'until_time': str(row.until_time) if row.until_time else None,
+            'resumption_token': row.resumption_token if row.resumption_token else "",
+        }
+
+    def save_harvest_state(self, pset, state):
+        replace_sql = "REPLACE INTO harvest_state VALUES (:pset, :watermark, :from_time, :until_time, :resumption_token);"
         with self.engine.begin() as conn:
-            conn.execute(text(insert_sql), rc_dicts)
-        logger.info(f"DB: upate {len(records)} record(s)")
+            conn.execute(text(replace_sql), {'pset': pset, **state})
+
+
+class MySQLInterface(DBInterface):
+    """
+    Store in the MySQL database `papers`, created by create_paper_crawl.sql.
+    """
+
+    def __init__(self, user, passwd, ip='127.0.0.1', port=3306, pool_recycle=3600, batch_size=500):
+        super().__init__(
+            f"mysql+pymysql://{user}:{passwd}@{ip}:{port}/papers?charset=utf8mb4",
+            pool_recycle=pool_recycle,
+            batch_size=batch_size,
+        )
+
+    def _upsert_sql(self):
+        columns = ", ".join(self._columns)
+        values = ", ".join(f":{c}" for c in self._columns)
+        updates = ", ".join(f"{c} = VALUES({c})" for c in self._columns[1:])
+        return f"INSERT INTO paper_crawl ({columns}) VALUES ({values}) ON DUPLICATE KEY UPDATE {updates};"
+
+    # InnoDB ignores these words and words shorter than innodb_ft_min_token_size in FULLTEXT indexes
+    _ft_stop_words = frozenset(
+        "a about an are as at be by com de en for from how i in is it la of on or that the this to was what when "
+        "where who will with und www".split()
+    )
+    _ft_min_token_size = 3
+    # the built-in FULLTEXT parser does not split words at underscores
+    _word_chars = "_"
+
+    def _phrase_condition(self, column, phrases, params):
+        words = [[w.lower() for w in self._phrase_words(phrase)] for phrase in phrases]
+        if all(ws and all(len(w) >= self._ft_min_token_size and w not in self._ft_stop_words for w in ws) for ws in words):
+            # any of the quoted phrases, by the FULLTEXT index of column
+            params[f'{column}_phrases'] = " ".join('"' + " ".join(ws) + '"' for ws in words)
+            return f"MATCH(p.{column}) AGAINST (:{column}_phrases IN BOOLEAN MODE)"
+        # a phrase the index cannot find, scan the rows left by the other conditions
+        any_of = []
+        for i, phrase in enumerate(phrases):
+            params[f'{column}_phrase{i}'] = self._like_pattern(phrase)
+            any_of.append(f"p.{column} LIKE :{column}_phrase{i} ESCAPE '!'")
+        return "(" + " OR ".join(any_of) + ")"
+
+
+class SQLiteInterface(DBInterface):
+    """
+    Embedded store in a SQLite file, in WAL mode so that readers do not block the writer.
+    Titles and abstracts are indexed by the FTS5 table paper_fts, kept up to date by triggers.
+    """
+
+    _schema = [
+        """CREATE TABLE IF NOT EXISTS paper_crawl (
+            id TEXT NOT NULL PRIMARY KEY,
+            title TEXT NOT NULL,
+            abstract TEXT,
+            categories TEXT,
+            authors TEXT,
+            published DATE,
+            updated DATE
+        )""",
+        "CREATE INDEX IF NOT EXISTS paper_published ON paper_crawl (published)",
+        "CREATE INDEX IF NOT EXISTS paper_updated ON paper_crawl (updated)",
+        """CREATE TABLE IF NOT EXISTS paper_category (
+            category TEXT NOT NULL,
+            id TEXT NOT NULL,
+            PRIMARY KEY (category, id)
+        ) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS paper_category_id ON paper_category (id)",
+        """CREATE TABLE IF NOT EXISTS harvest_state (
+            pset TEXT NOT NULL PRIMARY KEY,
+            watermark DATE,
+            from_time DATE,
+            until_time DATE,
+            resumption_token TEXT NOT NULL DEFAULT ''
+        )""",
+        """CREATE VIRTUAL TABLE IF NOT EXISTS paper_fts
+            USING fts5(title, abstract, content='paper_crawl', content_rowid='rowid')""",
+        """CREATE TRIGGER IF NOT EXISTS paper_fts_insert AFTER INSERT ON paper_crawl BEGIN
+            INSERT INTO paper_fts (rowid, title, abstract) VALUES (new.rowid, new.title, new.abstract);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS paper_fts_delete AFTER DELETE ON paper_crawl BEGIN
+            INSERT INTO paper_fts (paper_fts, rowid, title, abstract) VALUES ('delete', old.rowid, old.title, old.abstract);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS paper_fts_update AFTER UPDATE ON paper_crawl BEGIN
+            INSERT INTO paper_fts (paper_fts, rowid, title, abstract) VALUES ('delete', old.rowid, old.title, old.abstract);
+            INSERT INTO paper_fts (rowid, title, abstract) VALUES (new.rowid, new.title, new.abstract);
+        END""",
+    ]
+
+    def __init__(self, path, batch_size=500):
+        super().__init__(f"sqlite:///{path}", batch_size=batch_size)
+
+        @event.listens_for(self.engine, "connect")
+        def _on_connect(dbapi_conn, _):
+            cursor = dbapi_conn.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.close()
+
+        with self.engine.begin() as conn:
+            for statement in self._schema:
+                conn.exec_driver_sql(statement)
+
+    def _upsert_sql(self):
+        columns = ", ".join(self._columns)
+        values = ", ".join(f":{c}" for c in self._columns)
+        updates = ", ".join(f"{c} = excluded.{c}" for c in self._columns[1:])
+        return f"INSERT INTO paper_crawl ({columns}) VALUES ({values}) ON CONFLICT(id) DO UPDATE SET {updates};"
+
+    def _phrase_condition(self, column, phrases, params):
+        # FTS5 phrases are sequences of words, whatever separates them
+        quoted = []
+        for phrase in phrases:
+            words = self._phrase_words(phrase)
+            if not words:
+                return None
+            quoted.append('"' + " ".join(words) + '"')
+        params[f'{column}_phrases'] = f"{column} : (" + " OR ".join(quoted) + ")"
+        return f"p.rowid IN (SELECT rowid FROM paper_fts WHERE paper_fts MATCH :{column}_phrases)"
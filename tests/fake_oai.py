@@ -0,0 +1,98 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+
+def make_record_xml(id, title="title", abstract="abstract", categories="cs.AI", authors=(("Judy", "Luka"),),
+                    created="2023-10-01", updated=""):
+    authors_xml = "".join(
+        f"<author><keyname>{escape(k)}</keyname><forenames>{escape(f)}</forenames></author>" for f, k in authors
+    )
+    updated_xml = f"<updated>{updated}</updated>" if updated else ""
+    return (
+        f"<record><header><identifier>oai:arXiv.org:{id}</identifier></header><metadata>"
+        f'<arXiv xmlns="http://arxiv.org/OAI/arXiv/">'
+        f"<id>{id}</id><created>{created}</created>{updated_xml}<authors>{authors_xml}</authors>"
+        f"<title>{escape(title)}</title><categories>{categories}</categories><abstract>{escape(abstract)}</abstract>"
+        f"</arXiv></metadata></record>"
+    )
+
+
+def make_page_xml(records_xml, resumption_token=None):
+    token_xml = ""
+    if resumption_token is not None:
+        token_xml = f"<resumptionToken>{resumption_token}</resumptionToken>"
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/"><ListRecords>'
+        f"{''.join(records_xml)}{token_xml}</ListRecords></OAI-PMH>"
+    ).encode("utf-8")
+
+
+class FakeOAIServer:
+    """
+    Local OAI-PMH endpoint serving `pages_per_set` pages of `records_per_page` records for every requested set.
+    The first `n_throttle` requests are answered with 503 and `Retry-After: retry_after`.
+    """
+
+    def __init__(self, pages_per_set=2, records_per_page=3, n_throttle=0, retry_after=1):
+        self.pages_per_set = pages_per_set
+        self.records_per_page = records_per_page
+        self.n_throttle = n_throttle
+        self.retry_after = retry_after
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}/oai2"
+
+    def page(self, pset, index):
+        records = [
+            make_record_xml(f"{pset}.{index}.{i}", title=f"{pset} paper {index} {i}")
+            for i in range(self.records_per_page)
+        ]
+        token = f"{pset}|{index + 1}" if index + 1 < self.pages_per_set else None
+        return make_page_xml(records, token)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                with server._lock:
+                    server.requests.append((time.monotonic(), query))
+                    throttled = len(server.requests) <= server.n_throttle
+                if throttled:
+                    self.send_response(503)
+                    self.send_header("Retry-After", str(server.retry_after))
+                    self.end_headers()
+                    return
+                if "resumptionToken" in query:
+                    pset, index = query["resumptionToken"][0].split("|")
+                    body = server.page(pset, int(index))
+                else:
+                    body = server.page(query["set"][0], 0)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/xml")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
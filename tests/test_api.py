@@ -0,0 +1,38 @@
+from app.flask import api
+from arxiv import ArxivRecord
+import json
+import pytest
+
+
+def _records(n):
+    return [
+        ArxivRecord(id=str(i), title=f"title {i}", abstract="abstract", categories=["cs.AI"], authors=["a"])
+        for i in range(n)
+    ]
+
+
+def test_parse_arguments():
+    assert api.parse_fields(None) == list(api.paper_fields)
+    assert api.parse_fields("id,title") == ["id", "title"]
+    with pytest.raises(ValueError):
+        api.parse_fields("id,secret")
+    assert api.parse_limit("") == api.default_limit
+    assert api.parse_limit(None, default=None) is None
+    for limit in ["0", str(api.max_limit + 1), "ten"]:
+        with pytest.raises(ValueError):
+            api.parse_limit(limit)
+
+
+def test_json_pages():
+    page = json.loads("".join(api.json_chunks("2023-10-02", iter(_records(5)), ["id"], limit=2)))
+    assert page == {"date": "2023-10-02", "papers": [{"id": "0"}, {"id": "1"}], "next_cursor": "1"}
+    last = json.loads("".join(api.json_chunks("2023-10-02", iter(_records(2)), ["id", "categories"], limit=2)))
+    assert last["papers"][1] == {"id": "1", "categories": ["cs.AI"]}
+    assert last["next_cursor"] is None
+    assert json.loads("".join(api.json_chunks("2023-10-02", iter([]), ["id"])))["papers"] == []
+
+
+def test_ndjson_lines():
+    lines = list(api.ndjson_lines(iter(_records(3)), ["id", "title"]))
+    assert [json.loads(line) for line in lines] == [{"id": str(i), "title": f"title {i}"} for i in range(3)]
+    assert len(list(api.ndjson_lines(iter(_records(3)), ["id"], limit=2))) == 2
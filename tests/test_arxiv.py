@@ -1,8 +1,121 @@
 from app.asset import ArxivAsset
+from arxiv import ArxivAPI, RateLimiter, OAIError
+from tests.fake_oai import FakeOAIServer, make_page_xml, make_record_xml
 from datetime import datetime, timedelta
+import asyncio
+import time
+import pytest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 
 def sample_arxiv():
     arxiv = ArxivAsset()
     yesterday = datetime.strftime((datetime.now(datetime.UTC) - timedelta(days=1)), "%Y-%m-%d")
     print(f"{yesterday}: {len(arxiv.get_by_date('cs.AI', yesterday))}")
+
+
+def test_concurrent_harvest_shares_retry_after(monkeypatch):
+    with FakeOAIServer(pages_per_set=2, records_per_page=3, n_throttle=1, retry_after=1) as server:
+        monkeypatch.setattr(ArxivAPI, "OAI_url", server.url)
+        limiter = RateLimiter(rate=20, capacity=1)
+
+        async def harvest_all():
+            return await asyncio.gather(
+                *[ArxivAPI.async_get_records_by_oai(pset=pset, limiter=limiter) for pset in ["cs", "math", "stat"]]
+            )
+
+        start = time.monotonic()
+        results = asyncio.run(harvest_all())
+
+    assert [len(records) for records in results] == [6, 6, 6]
+    assert len({r.id for records in results for r in records}) == 18
+    # the 503 answered to one harvest must hold back every other request
+    throttled_at = server.requests[0][0]
+    assert all(t - throttled_at >= 1 for t, _ in server.requests[1:])
+    assert time.monotonic() - start >= 1
+
+
+def _records_as_tuples(records):
+    return [(r.id, r.title, r.abstract, r.categories, r.authors, r.published, r.updated) for r in records]
+
+
+def test_iterparse_matches_tree_parser():
+    records_xml = [
+        make_record_xml("2310.00001", title="A  multi-line\n   title", abstract="\n  Some\tabstract.\n", categories="cs.AI cs.CV",
+                        authors=(("Luka", "Judy"), ("", "ATLAS Collaboration")), updated="2023-10-02"),
+        '<record><header status="deleted"><identifier>oai:arXiv.org:2310.00002</identifier></header></record>',
+        make_record_xml("2310.00003", abstract="", authors=()),
+    ]
+    xml = make_page_xml(records_xml, resumption_token="token|1")
+    tree_records, iter_records = [], []
+    assert ArxivAPI.from_oai_xml(xml, tree_records) == "token|1"
+    assert ArxivAPI.from_oai_xml_iterparse(xml, iter_records) == "token|1"
+    assert _records_as_tuples(iter_records) == _records_as_tuples(tree_records)
+    assert iter_records[0].title == "A multi-line title"
+    assert iter_records[0].authors == ("Luka Judy", "ATLAS Collaboration")
+
+
+def test_chunked_pages_match_whole_pages(monkeypatch):
+    xml = make_page_xml([make_record_xml(f"2310.{i:05d}", abstract="Some abstract. " * 20) for i in range(5)], "token|1")
+    chunk_records, tree_records = [], []
+    assert ArxivAPI.from_oai_chunks([xml[i:i + 7] for i in range(0, len(xml), 7)], chunk_records) == "token|1"
+    ArxivAPI.from_oai_xml(xml, tree_records)
+    assert _records_as_tuples(chunk_records) == _records_as_tuples(tree_records)
+
+    # responses are parsed in chunks as they arrive, by both harvests and with either parser
+    monkeypatch.setattr(ArxivAPI, "oai_chunk_size", 64)
+    with FakeOAIServer(pages_per_set=2, records_per_page=3) as server:
+        monkeypatch.setattr(ArxivAPI, "OAI_url", server.url)
+        harvests = {}
+        for oai_parser in ["iterparse", "tree"]:
+            monkeypatch.setattr(ArxivAPI, "oai_parser", oai_parser)
+            harvests[oai_parser, "sync"] = [
+                ([r.id for r in page], token) for page, token in ArxivAPI.iter_pages_by_oai(pset="cs", limiter=RateLimiter(rate=100))
+            ]
+
+            async def harvest():
+                return [([r.id for r in page], token) async for page, token in ArxivAPI.async_iter_pages_by_oai(pset="cs")]
+
+            harvests[oai_parser, "async"] = asyncio.run(harvest())
+    pages = harvests["tree", "sync"]
+    assert [token for _, token in pages] == ["cs|1", ""]
+    assert sum(len(ids) for ids, _ in pages) == 6
+    assert all(h == pages for h in harvests.values())
+
+
+def test_parsers_raise_oai_errors():
+    error_xml = (
+        '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/"><error code="{}">message</error></OAI-PMH>'
+    )
+    for parse in [ArxivAPI.from_oai_xml, ArxivAPI.from_oai_xml_iterparse]:
+        assert parse(error_xml.format("noRecordsMatch").encode(), []) == ""
+        with pytest.raises(OAIError):
+            parse(error_xml.format("badResumptionToken").encode(), [])
+
+
+def test_peek_resumption_token():
+    assert ArxivAPI._peek_resumption_token(make_page_xml([make_record_xml("1")], "6960524|1001")) == "6960524|1001"
+    assert ArxivAPI._peek_resumption_token(make_page_xml([make_record_xml("1")], "a&amp;b")) == "a&b"
+    assert ArxivAPI._peek_resumption_token(make_page_xml([make_record_xml("1")], "")) == ""
+    assert ArxivAPI._peek_resumption_token(make_page_xml([make_record_xml("1")])) == ""
+    last_page = make_page_xml([]).replace(b"</ListRecords>", b'<resumptionToken cursor="1000" completeListSize="1500"/></ListRecords>')
+    assert ArxivAPI._peek_resumption_token(last_page) == ""
+
+
+@pytest.mark.parametrize("executor_cls", [ThreadPoolExecutor, ProcessPoolExecutor])
+def test_harvest_with_parse_executor(monkeypatch, executor_cls):
+    with FakeOAIServer(pages_per_set=4, records_per_page=3) as server:
+        monkeypatch.setattr(ArxivAPI, "OAI_url", server.url)
+
+        async def harvest(executor):
+            pages = []
+            async for page, token in ArxivAPI.async_iter_pages_by_oai(pset="cs", executor=executor):
+                pages.append(([r.id for r in page], token))
+            return pages
+
+        inline_pages = asyncio.run(harvest(None))
+        with executor_cls(2) as executor:
+            executor_pages = asyncio.run(harvest(executor))
+
+    assert executor_pages == inline_pages
+    assert [token for _, token in executor_pages] == ["cs|1", "cs|2", "cs|3", ""]
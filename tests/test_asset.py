@@ -0,0 +1,374 @@
+from app.asset import (
+    ArxivAsset, ArxivDaily, ArxivFilter, ArxivSet, ColumnarArxivDaily, DailyPending, FetchQueueFull,
+    MappedArxivDaily, estimate_daily_size,
+)
+from app.dailyfile import DailyFile
+from app.index import InvertedIndex
+from app.config import CategoryFilterConfig
+from app.rank import RelevanceRanker, TermStats
+from app.utils import RecordTokens
+from arxiv import ArxivAPI, ArxivRecord, RateLimiter
+from concurrent.futures import ThreadPoolExecutor
+from db import SQLiteInterface
+from tests.fake_oai import FakeOAIServer
+import os
+import pickle
+import subprocess
+import sys
+import threading
+import time
+import pytest
+import zipfile
+
+
+def _make_records(n):
+    return [
+        ArxivRecord(
+            id=f"2310.{i:05d}",
+            title=f"title {i}",
+            abstract=f"abstract {i}",
+            categories=["cs.AI", "cs.CV"] if i % 2 else ["cs.LG"],
+            authors=[f"author {j}" for j in range(i % 3)],
+            published="2023-10-01",
+            updated="2023-10-02" if i % 2 else "",
+        )
+        for i in range(n)
+    ]
+
+
+def _as_tuples(records):
+    return [(r.id, r.title, r.abstract, r.categories, r.authors, r.published, r.updated) for r in records]
+
+
+def test_record_pickle():
+    record = _make_records(2)[1]
+    assert _as_tuples([pickle.loads(pickle.dumps(record))]) == _as_tuples([record])
+
+    # state of records pickled before ArxivRecord had __slots__
+    legacy = ArxivRecord.__new__(ArxivRecord)
+    legacy.__setstate__(
+        {"id": "1", "title": "t", "abstract": "a", "categories": ["cs.AI"], "authors": ["x"], "published": "2023-10-01", "updated": ""}
+    )
+    assert legacy.categories == ("cs.AI",) and legacy.authors == ("x",)
+
+
+def test_columnar_set():
+    records = _make_records(10)
+    daily = ArxivDaily("2023-10-02", "cs", records)
+    columnar = daily.to_columnar()
+    assert isinstance(columnar, ColumnarArxivDaily)
+    assert columnar.date == "2023-10-02" and columnar.pset == "cs"
+    assert len(columnar) == 10
+    assert _as_tuples(columnar.get_records()) == _as_tuples(records)
+    assert "2310.00003" in columnar and "2310.00010" not in columnar
+
+    other = ArxivSet(_make_records(12)[8:])
+    assert [r.id for r in columnar.union(other).get_records()] == [r.id for r in _make_records(12)]
+    assert [r.id for r in columnar.intersect(other).get_records()] == ["2310.00008", "2310.00009"]
+    assert _as_tuples(pickle.loads(pickle.dumps(columnar)).get_records()) == _as_tuples(records)
+
+
+def _ids(st):
+    return [r.id for r in st]
+
+
+def test_set_add_replaces_in_place_of_remove():
+    records = _make_records(4)
+    st = ArxivSet(records)
+    updated = ArxivRecord(id=records[1].id, title="new title")
+    st.add(updated)
+    assert len(st) == 4
+    assert _ids(st) == [records[i].id for i in [0, 2, 3, 1]]
+    assert st.id2records[records[1].id] is updated
+
+
+def test_set_algebra():
+    records = _make_records(10)
+    a, b, c = ArxivSet(records[:6]), ArxivSet(records[4:8]), ArxivSet(records[5:])
+    assert _ids(a.union(b, c)) == _ids(records)
+    assert _ids(a.intersect(b, c)) == _ids(records[5:6])
+    assert _ids(a.difference(b, c)) == _ids(records[:4])
+    assert _ids(a) == _ids(records[:6])
+
+    # the leftmost set wins
+    replaced = ArxivSet([ArxivRecord(id=records[0].id, title="other")])
+    assert a.union(replaced).id2records[records[0].id] is records[0]
+
+    a.update(b).difference_update(c)
+    assert _ids(a) == _ids(records[:5])
+    a.intersection_update(b)
+    assert _ids(a) == _ids(records[4:5])
+
+    columnar = ArxivDaily("2023-10-02", "cs", records[:6]).to_columnar()
+    assert _ids(columnar.intersect(b, c)) == _ids(records[5:6])
+    assert _ids(columnar.difference(b)) == _ids(records[:4])
+
+
+def test_legacy_set_pickle():
+    records = _make_records(3)
+    legacy = ArxivDaily.__new__(ArxivDaily)
+    legacy.__setstate__({"records": records, "id2records": {r.id: r for r in records}, "date": "2023-10-02", "pset": "cs"})
+    assert "records" not in legacy.__dict__
+    assert _ids(legacy) == _ids(records) and legacy.date == "2023-10-02"
+
+
+def test_filter_reads_cached_tokens():
+    records = _make_records(3)
+    records[0].tokens = RecordTokens(("vision", "transformer"), ("a", "novel", "idea"))
+    records[1].tokens = RecordTokens(("graph",), ("a", "novel", "idea"))
+    records[2].tokens = RecordTokens(("vision", "transformers"), ())
+    st = ArxivDaily("2023-10-02", "cs", records).to_columnar()
+    assert [r.tokens for r in st] == [r.tokens for r in records]
+
+    title_filter = ArxivFilter(keypoints_in_title=["vision transformer", "graph"])
+    abstract_filter = ArxivFilter(keypoints_in_abstract=["novel idea"])
+    assert _ids(title_filter(st)) == _ids(records[:2])
+    assert _ids(abstract_filter(st)) == _ids(records[:2])
+    # pickled records drop their tokens
+    assert pickle.loads(pickle.dumps(records[0])).tokens is None
+
+
+def _tokenized_records(n):
+    records = _make_records(n)
+    for r in records:
+        r.tokens = RecordTokens(tuple(r.title.lower().split()), tuple(r.abstract.lower().split()))
+    return records
+
+
+def test_daily_file_roundtrip(tmp_path):
+    records = _tokenized_records(20)
+    records.reverse()
+    path = str(tmp_path / "cs" / "2023-10-02.pday")
+    DailyFile.write(path, "2023-10-02", "cs", records)
+
+    daily = MappedArxivDaily(DailyFile(path))
+    assert (daily.date, daily.pset, len(daily)) == ("2023-10-02", "cs", 20)
+    assert _as_tuples(daily) == _as_tuples(records)
+    assert [(r.tokens.title, r.tokens.abstract) for r in daily] == [(r.tokens.title, r.tokens.abstract) for r in records]
+    assert all(r.id in daily for r in records)
+    assert "2310.00020" not in daily and "" not in daily
+    assert _ids(ArxivSet(records[:5]).intersect(daily)) == _ids(records[:5])
+    assert _ids(daily.difference(ArxivSet(records[1:]))) == _ids(records[:1])
+    daily.file.close()
+
+
+def test_daily_file_rejects_other_versions(tmp_path):
+    path = str(tmp_path / "2023-10-02.pday")
+    DailyFile.write(path, "2023-10-02", "cs", _tokenized_records(3))
+    with open(path, "r+b") as f:
+        f.seek(4)
+        f.write(b"\xff\xff")
+    with pytest.raises(ValueError):
+        DailyFile(path)
+
+
+def test_load_cache_migrates_zip(tmp_path):
+    records = _make_records(5)
+    os.makedirs(tmp_path / "cs")
+    with zipfile.ZipFile(tmp_path / "cs" / "2023-10-02.zip", "w") as zf:
+        zf.writestr("2023-10-02", pickle.dumps(ArxivDaily("2023-10-02", "cs", records)))
+
+    asset = ArxivAsset(str(tmp_path))
+    daily = asset.load_cache("cs", "2023-10-02")
+    assert isinstance(daily, MappedArxivDaily)
+    assert _as_tuples(daily) == _as_tuples(records)
+    assert os.path.exists(tmp_path / "cs" / "2023-10-02.pday")
+    assert asset.load_cache("cs", "2023-10-02") is daily
+
+
+def test_concurrent_misses_harvest_once(tmp_path, monkeypatch):
+    with FakeOAIServer(pages_per_set=2, records_per_page=3) as server:
+        monkeypatch.setattr(ArxivAPI, "OAI_url", server.url)
+        asset = ArxivAsset(str(tmp_path))
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(lambda _: asset.get_by_date("2023-10-02", categories=["cs.AI"]), range(8)))
+
+    assert len(server.requests) == 2
+    assert all(len(st) == 6 for st in results)
+    assert sorted(os.listdir(tmp_path / "cs")) == ["2023-10-02.pday", "2023-10-02.vec"]
+
+
+def test_get_by_range_streams_unique_filtered_records(tmp_path):
+    records = _tokenized_records(20)
+    dates = ["2023-10-02", "2023-10-03", "2023-10-04"]
+    for i, date in enumerate(dates):
+        DailyFile.write(str(tmp_path / "cs" / f"{date}.pday"), date, "cs", records[5 * i:5 * i + 10])
+
+    asset = ArxivAsset(str(tmp_path))
+    config = CategoryFilterConfig({"categories": ["cs.AI"], "authors": ["author 1"]})
+    result = asset.get_by_range("2023-10-02", "2023-10-04", categories=config.categories, config=config, max_workers=2)
+    assert [r.id for r in result] == [r.id for r in records if "cs.AI" in r.categories and "author 1" in r.authors]
+
+
+def test_closing_range_does_not_wait_for_queued_days(tmp_path, monkeypatch):
+    queried = []
+
+    def slow_query_day(self, date, categories=None, config=None):
+        queried.append(date)
+        time.sleep(0.2)
+        return ArxivSet([ArxivRecord(id=date, categories=["cs.AI"])])
+
+    monkeypatch.setattr(ArxivAsset, "_query_day", slow_query_day)
+    asset = ArxivAsset(str(tmp_path))
+    result = asset.get_by_range("2023-10-01", "2023-10-20", max_workers=1)
+    assert next(result).id == "2023-10-01"
+    start = time.monotonic()
+    result.close()
+    assert time.monotonic() - start < 0.15
+    time.sleep(0.3)
+    assert len(queried) <= 3
+
+
+def test_cached_days_are_searchable(tmp_path):
+    asset = ArxivAsset(str(tmp_path / "arxiv"), index=InvertedIndex(str(tmp_path / "index")))
+    records = _tokenized_records(6)
+    asset.cache(ArxivDaily("2023-10-02", "cs", records), "cs", "2023-10-02")
+    assert [r.id for r in asset.search(authors=["Author 1"])] == [r.id for r in records if "author 1" in r.authors]
+
+
+def test_loaded_days_are_bounded_by_size(tmp_path):
+    asset = ArxivAsset(str(tmp_path), cache_max_bytes=None)
+    dates = ["2023-10-01", "2023-10-02", "2023-10-03"]
+    sizes = []
+    for i, date in enumerate(dates):
+        asset.cache(ArxivDaily(date, "cs", _tokenized_records(10 * (i + 1))), "cs", date)
+        sizes.append(estimate_daily_size(asset.load_cache("cs", date)))
+    assert sizes == sorted(sizes) and sizes[0] > 0
+
+    asset = ArxivAsset(str(tmp_path), cache_max_bytes=sizes[1] + sizes[2])
+    for date in dates:
+        asset.load_cache("cs", date)
+    assert asset._cached_daily.keys() == [("cs", "2023-10-02"), ("cs", "2023-10-03")]
+    assert asset._cached_daily.n_bytes == sizes[1] + sizes[2]
+
+
+def test_get_by_date_from_store(tmp_path):
+    records = [
+        ArxivRecord(id=str(i), title=f"title {i}", abstract=f"abstract {i} keyword{i % 2}",
+                    categories=["cs.AI" if i % 3 else "cs.LG"], authors=[f"author {i % 4}"],
+                    published="2023-10-02")
+        for i in range(12)
+    ]
+    store = SQLiteInterface(str(tmp_path / "papers.db"))
+    store.update_records(records)
+    asset = ArxivAsset(str(tmp_path / "arxiv"), store=store)
+    config = CategoryFilterConfig({"categories": ["cs.AI"], "keywd_in_abstract": ["keyword1"], "authors": ["author 2"]})
+
+    st = asset.get_by_date("2023-10-02", categories=config.categories, config=config)
+    assert sorted(r.id for r in config.filt(st)) == sorted(r.id for r in config.filt(ArxivSet(records)))
+    assert len(asset.get_by_date("2023-10-02", primary_set=["cs"])) == 12
+    assert os.listdir(tmp_path / "arxiv") == []
+
+    # ranked with the statistics of the whole day, as without store
+    ranker = RelevanceRanker(config)
+    stats = TermStats([r for r in records if "cs.AI" in r.categories])
+    matched = list(config.filt(st))
+    ranked = asset.rank_by_date("2023-10-02", matched, ranker, categories=config.categories)
+    assert [r.id for r in ranked] == [r.id for r in ranker.rank(matched, [stats])]
+    assert asset._store_term_stats("2023-10-02", config.categories).n == stats.n
+
+
+def test_store_days_use_the_harvest_window(tmp_path):
+    assert ArxivAsset.day_window("2023-10-01") == ("2023-09-30", "2023-10-01")
+    store = SQLiteInterface(str(tmp_path / "papers.db"))
+    store.update_records([
+        ArxivRecord(id=str(i), title="title", abstract="", categories=["cs.AI"], authors=[], published=published)
+        for i, published in enumerate(["2023-09-29", "2023-09-30", "2023-10-01", "2023-10-02"])
+    ])
+    asset = ArxivAsset(str(tmp_path / "arxiv"), store=store)
+    assert sorted(r.id for r in asset.get_by_date("2023-10-01", categories=["cs.AI"])) == ["1", "2"]
+    assert asset._store_term_stats("2023-10-01", ["cs.AI"]).n == 2
+
+
+def test_iter_by_date_pages_by_id(tmp_path):
+    records = _tokenized_records(20)
+    DailyFile.write(str(tmp_path / "cs" / "2023-10-02.pday"), "2023-10-02", "cs", list(reversed(records)))
+    asset = ArxivAsset(str(tmp_path))
+    config = CategoryFilterConfig({"categories": ["cs.AI"], "authors": ["author 1"]})
+    expected = [r.id for r in records if "cs.AI" in r.categories and "author 1" in r.authors]
+
+    assert [r.id for r in asset.iter_by_date("2023-10-02", config.categories, config=config, chunk_size=3)] == expected
+    after = asset.iter_by_date("2023-10-02", config.categories, config=config, after=expected[1])
+    assert [r.id for r in after] == expected[2:]
+    assert asset.iter_by_date("2100-01-01", config.categories, config=config) is None
+
+
+def test_misses_are_fetched_in_background(tmp_path, monkeypatch):
+    released = threading.Event()
+    harvests = []
+    request_and_cache = ArxivAsset.request_and_cache
+
+    def slow_request_and_cache(self, pset, date):
+        harvests.append((pset, date))
+        released.wait(5)
+        return request_and_cache(self, pset, date)
+
+    with FakeOAIServer(pages_per_set=1, records_per_page=3) as server:
+        monkeypatch.setattr(ArxivAPI, "OAI_url", server.url)
+        monkeypatch.setattr(ArxivAsset, "request_and_cache", slow_request_and_cache)
+        asset = ArxivAsset(str(tmp_path))
+        for _ in range(3):
+            with pytest.raises(DailyPending) as e:
+                asset.get_by_date("2023-10-02", categories=["cs.AI"], wait=0.01)
+        assert e.value.keys == [("cs", "2023-10-02")]
+        assert asset.fetch("cs", "2023-10-02") is asset.fetch("cs", "2023-10-02")
+
+        released.set()
+        assert len(asset.get_by_date("2023-10-02", categories=["cs.AI"], wait=5)) == 3
+        assert harvests == [("cs", "2023-10-02")]
+        # cached days are loaded without the executor
+        assert asset.fetch("cs", "2023-10-02").done()
+        asset.close()
+
+
+def test_fetches_are_bounded_and_rate_limited(tmp_path, monkeypatch):
+    released = threading.Event()
+    request_and_cache = ArxivAsset.request_and_cache
+
+    def slow_request_and_cache(self, pset, date):
+        released.wait(5)
+        return request_and_cache(self, pset, date)
+
+    with FakeOAIServer(pages_per_set=2, records_per_page=3) as server:
+        monkeypatch.setattr(ArxivAPI, "OAI_url", server.url)
+        monkeypatch.setattr(ArxivAsset, "request_and_cache", slow_request_and_cache)
+        asset = ArxivAsset(str(tmp_path), max_pending_fetches=2, limiter=RateLimiter(rate=10, capacity=1))
+        futures = [asset.fetch("cs", "2023-10-02"), asset.fetch("cs", "2023-10-03")]
+        with pytest.raises(FetchQueueFull):
+            asset.fetch("cs", "2023-10-04")
+        assert asset.fetch("cs", "2023-10-02") is futures[0]
+
+        released.set()
+        assert [len(future.result(5)) for future in futures] == [6, 6]
+        assert len(asset.fetch("cs", "2023-10-04").result(5)) == 6
+        # 6 requests, the first without waiting
+        times = sorted(t for t, _ in server.requests)
+        assert times[-1] - times[0] >= 0.45
+        asset.close()
+
+
+EXIT_WITH_QUEUED_FETCHES = """
+import sys, time
+from app.asset import ArxivAsset
+
+def slow_request_and_cache(self, pset, date):
+    time.sleep(0.3)
+    with open(sys.argv[2], "a") as f:
+        f.write(date + "\\n")
+
+ArxivAsset.request_and_cache = slow_request_and_cache
+asset = ArxivAsset(sys.argv[1], fetch_workers=1)
+for day in range(1, 6):
+    asset.fetch("cs", f"2023-10-0{day}")
+time.sleep(0.1)
+"""
+
+
+def test_exit_drops_queued_fetches(tmp_path):
+    log = tmp_path / "harvests"
+    subprocess.run(
+        [sys.executable, "-c", EXIT_WITH_QUEUED_FETCHES, str(tmp_path / "arxiv"), str(log)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), check=True, timeout=30,
+    )
+    # only the running harvest finished
+    assert log.read_text().split() == ["2023-10-01"]
@@ -0,0 +1,83 @@
+from app.cache import BoundedCache, SingleFlight
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import threading
+import time
+
+
+def test_lru_eviction_and_counters():
+    cache = BoundedCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats() == {"entries": 2, "bytes": 0, "hits": 3, "misses": 1, "evictions": 1, "expirations": 0}
+
+
+def test_lfu_eviction():
+    cache = BoundedCache(max_entries=2, policy="lfu")
+    cache.put("a", 1)
+    cache.put("b", 2)
+    for _ in range(3):
+        cache.get("a")
+    cache.get("b")
+    cache.put("c", 3)
+    assert "a" in cache and "c" in cache and "b" not in cache
+
+
+def test_size_bound():
+    cache = BoundedCache(max_bytes=10, sizeof=len)
+    cache.put("a", "xxxx")
+    cache.put("b", "xxxx")
+    cache.put("c", "xxxx")
+    assert "a" not in cache and len(cache) == 2 and cache.n_bytes == 8
+    # an entry larger than the bound is still kept alone
+    cache.put("d", "x" * 20)
+    assert len(cache) == 1 and cache.get("d") == "x" * 20
+
+
+def test_ttl():
+    cache = BoundedCache()
+    cache.put("recent", 1, ttl=0.05)
+    cache.put("past", 2)
+    assert cache.get("recent") == 1
+    time.sleep(0.06)
+    assert cache.get("recent") is None
+    assert cache.get("past") == 2
+    assert cache.expirations == 1
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    single_flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fetch(key):
+        calls.append(key)
+        started.set()
+        release.wait()
+        return f"result of {key}"
+
+    with ThreadPoolExecutor(8) as executor:
+        leader = executor.submit(single_flight.do, "k", fetch, "k")
+        started.wait()
+        followers = [executor.submit(single_flight.do, "k", fetch, "k") for _ in range(7)]
+        time.sleep(0.05)
+        release.set()
+        results = [leader.result()] + [f.result() for f in followers]
+
+    assert calls == ["k"]
+    assert results == ["result of k"] * 8
+    # a later miss runs again
+    assert single_flight.do("k", lambda: "again") == "again"
+
+
+def test_single_flight_shares_errors():
+    single_flight = SingleFlight()
+    with pytest.raises(KeyError):
+        single_flight.do("k", lambda: {}["missing"])
+    assert single_flight.do("k", lambda: 1) == 1
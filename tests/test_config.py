@@ -1,5 +1,8 @@
-from app.config import CategoryFilterConfig
-from arxiv import ArxivRecord, ArxivSet
+from app.config import CategoryFilterConfig, ConfigRegistry
+from arxiv import ArxivRecord
+from app.asset import ArxivSet
+import json
+import os
 
 
 def test_Config():
@@ -13,16 +16,75 @@ def test_Config():
     )
     records = [
         ArxivRecord(
+            id="1",
             title="tranformer for object detection",
             authors=["luka judy", "ken"],
             categories=["cs.AI"],
         ),
-        ArxivRecord(title="nnmm", categories=["cs.CG"]),
-        ArxivRecord(title="hello world", abstract="A novel idea"),
-        ArxivRecord(authors=["ken tompson", "luka judy"], categories=["cs.AI"]),
+        ArxivRecord(id="2", title="nnmm", categories=["cs.CG"]),
+        ArxivRecord(id="3", title="hello world", abstract="A novel idea"),
+        ArxivRecord(id="4", authors=["ken tompson", "luka judy"], categories=["cs.AI"]),
         ArxivRecord(
+            id="5",
             title="functional analysis", authors=["Henry"], published="2023-10-01"
         ),
     ]
     st = config.filt(ArxivSet(records))
     assert len(st) == 2
+
+
+def test_fused_filt_matches_separate_filters():
+    records = [
+        ArxivRecord(id="1", title="A vision transformer", abstract="novel", authors=["Luka Judy"], categories=["cs.AI"]),
+        ArxivRecord(id="2", title="Graphs", abstract="a novel idea", categories=["cs.CG", "cs.AI"]),
+        ArxivRecord(id="3", title="Transformer", authors=["Ken"], categories=["cs.CV"]),
+        ArxivRecord(id="4", title="nothing", authors=["LUKA JUDY"], categories=["CS.AI"]),
+        ArxivRecord(id="5", title="transformer", categories=["math.AG"]),
+    ]
+    configs = [
+        {"categories": ["cs.AI", "cs.CV"], "authors": ["luka judy"], "keywd_in_title": ["transformer"]},
+        {"categories": ["cs.AI"], "keywd_in_abstract": ["novel idea"]},
+        {"categories": ["cs.AI", "cs.CV"], "authors": None},
+        {"categories": ["cs.AI", "cs.CV", "math.AG"]},
+        {"authors": ["ken"]},
+    ]
+    data = ArxivSet(records)
+    for d in configs:
+        config = CategoryFilterConfig(d)
+        tmp = config.category_filter(data)
+        separate = [f(tmp) for f in [config.authors_filter, config.title_filter, config.abstract_filter]]
+        expected = {r.id for st in separate for r in st}
+        fused = [r.id for r in config.filt(data)]
+        assert set(fused) == expected
+        assert fused == [r.id for r in records if r.id in expected]
+
+
+def test_registry_compiles_once_and_reloads_changes(tmp_path):
+    def write(name, d, mtime):
+        path = tmp_path / f"{name}.json"
+        path.write_text(json.dumps(d))
+        os.utime(path, ns=(mtime, mtime))
+
+    write("a", {"categories": ["cs.AI"], "authors": ["ken"]}, 10**18)
+    write("b", {"categories": ["cs.CV"]}, 10**18)
+    changed = []
+    registry = ConfigRegistry(str(tmp_path), poll_interval=0, on_change=changed.append)
+    assert sorted(registry.names()) == ["a", "b"]
+    a = registry.get("a")
+    assert a.config.authors == ["ken"]
+    assert registry.get("a") is a
+
+    # touched without change
+    write("a", {"categories": ["cs.AI"], "authors": ["ken"]}, 2 * 10**18)
+    assert registry.get("a").config is a.config
+    (tmp_path / "a.json").write_text("{")
+    assert registry.get("a").config is a.config
+    write("a", {"categories": ["cs.AI"], "authors": ["judy"]}, 3 * 10**18)
+    assert registry.get("a").config.authors == ["judy"]
+    assert registry.get("a").digest != a.digest
+    assert changed == ["a"]
+
+    os.remove(tmp_path / "b.json")
+    assert registry.get("b") is None
+    assert registry.get("c") is None
+    assert changed == ["a", "b"]
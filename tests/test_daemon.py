@@ -0,0 +1,164 @@
+from arxiv import ArxivAPI
+from daemon import DBWriter, PaperCrawlDaemon
+from tests.fake_oai import FakeOAIServer
+import asyncio
+import threading
+import time
+
+
+class MemoryDB:
+    def __init__(self, states=None):
+        self.states = dict(states or {})
+        self.records = {}
+
+    def load_harvest_state(self, pset):
+        return self.states.get(pset)
+
+    def save_harvest_state(self, pset, state):
+        self.states[pset] = state
+
+    def update_records(self, records):
+        for r in records:
+            self.records[r.id] = r
+
+
+def _make_daemon(psets, states=None):
+    daemon = PaperCrawlDaemon(psets, "127.0.0.1", "user", "passwd", max_concurrency=2, rate=100)
+    daemon.dbint = MemoryDB(states)
+    return daemon
+
+
+async def _crawl(daemon, date):
+    async for pset, records, state in daemon._request_all(date):
+        daemon.dbint.update_records(records)
+        daemon.dbint.save_harvest_state(pset, state)
+
+
+def test_harvest_advances_watermark(monkeypatch):
+    with FakeOAIServer(pages_per_set=3, records_per_page=2) as server:
+        monkeypatch.setattr(ArxivAPI, "OAI_url", server.url)
+        daemon = _make_daemon(["cs", "math"])
+        asyncio.run(_crawl(daemon, "2023-10-02"))
+
+    assert len(daemon.dbint.records) == 12
+    for pset in ["cs", "math"]:
+        assert daemon.dbint.states[pset]["watermark"] == "2023-10-02"
+        assert daemon.dbint.states[pset]["resumption_token"] == ""
+    first_queries = [q for _, q in server.requests if "resumptionToken" not in q]
+    assert all(q["from"] == ["2023-10-01"] and q["until"] == ["2023-10-02"] for q in first_queries)
+
+
+def test_harvest_resumes_from_checkpoint(monkeypatch):
+    states = {
+        "cs": {"watermark": "2023-09-30", "from_time": "2023-09-30", "until_time": "2023-10-01", "resumption_token": "cs|2"},
+        "math": {"watermark": "2023-10-01", "from_time": None, "until_time": None, "resumption_token": ""},
+    }
+    with FakeOAIServer(pages_per_set=3, records_per_page=2) as server:
+        monkeypatch.setattr(ArxivAPI, "OAI_url", server.url)
+        daemon = _make_daemon(["cs", "math"], states)
+        asyncio.run(_crawl(daemon, "2023-10-02"))
+
+    queries = [q for _, q in server.requests]
+    # cs finishes its interrupted harvest at the last page, then harvests since the new watermark
+    cs_queries = [q for q in queries if q.get("set") == ["cs"] or q.get("resumptionToken", [""])[0].startswith("cs")]
+    assert cs_queries[0] == {"verb": ["ListRecords"], "resumptionToken": ["cs|2"]}
+    first_queries = sorted((q["set"][0], q["from"][0], q["until"][0]) for q in queries if "set" in q)
+    assert first_queries == [("cs", "2023-10-01", "2023-10-02"), ("math", "2023-10-01", "2023-10-02")]
+    assert daemon.dbint.states["cs"]["watermark"] == "2023-10-02"
+    assert len(queries) == 7
+
+
+class SlowDB(MemoryDB):
+    """
+    Logs its writes and fails the first `n_failures` of them.
+    """
+
+    def __init__(self, delay=0.01, n_failures=0):
+        super().__init__()
+        self.delay = delay
+        self.n_failures = n_failures
+        self.log = []
+
+    def update_records(self, records):
+        time.sleep(self.delay)
+        if self.n_failures > 0:
+            self.n_failures -= 1
+            raise ConnectionError("lost connection")
+        super().update_records(records)
+        self.log.append(("records", records[0].id))
+
+    def save_harvest_state(self, pset, state):
+        super().save_harvest_state(pset, state)
+        self.log.append(("state", pset))
+
+
+def _crawl_with_writer(daemon, date, max_pending=1):
+    async def crawl():
+        writer = DBWriter(daemon.dbint, max_pending=max_pending, retry_delay=0.01)
+        writer.start()
+        async for pset, records, state in daemon._request_all(date):
+            await writer.put(pset, records, state)
+            assert writer.queue.qsize() <= max_pending
+        await writer.close()
+
+    asyncio.run(crawl())
+
+
+def test_writer_commits_records_before_state(monkeypatch):
+    with FakeOAIServer(pages_per_set=3, records_per_page=2) as server:
+        monkeypatch.setattr(ArxivAPI, "OAI_url", server.url)
+        daemon = _make_daemon(["cs", "math"])
+        daemon.dbint = SlowDB(n_failures=2)
+        _crawl_with_writer(daemon, "2023-10-02")
+
+    log = daemon.dbint.log
+    assert len(daemon.dbint.records) == 12
+    assert len(log) == 12
+    assert all(kind == "records" for kind, _ in log[::2]) and all(kind == "state" for kind, _ in log[1::2])
+    for pset in ["cs", "math"]:
+        assert daemon.dbint.states[pset]["watermark"] == "2023-10-02"
+
+
+def test_harvest_state_is_loaded_off_the_event_loop(monkeypatch):
+    threads = []
+
+    class ThreadLoggingDB(MemoryDB):
+        def load_harvest_state(self, pset):
+            threads.append(threading.current_thread().name)
+            return super().load_harvest_state(pset)
+
+    with FakeOAIServer(pages_per_set=1, records_per_page=2) as server:
+        monkeypatch.setattr(ArxivAPI, "OAI_url", server.url)
+        daemon = _make_daemon(["cs", "math"])
+        daemon.dbint = ThreadLoggingDB()
+
+        async def crawl():
+            daemon.writer = DBWriter(daemon.dbint)
+            daemon.writer.start()
+            async for pset, records, state in daemon._request_all("2023-10-02"):
+                await daemon.writer.put(pset, records, state)
+            await daemon.writer.close()
+
+        asyncio.run(crawl())
+    assert len(threads) == 2 and all(name.startswith("db-writer") for name in threads)
+    assert len(daemon.dbint.records) == 4
+
+
+def test_writer_close_gives_up_on_a_dead_db(monkeypatch):
+    db = SlowDB(n_failures=1000)
+
+    async def write():
+        writer = DBWriter(db, max_pending=1, retry_delay=0.01)
+        writer.start()
+        with FakeOAIServer(pages_per_set=2, records_per_page=2) as server:
+            monkeypatch.setattr(ArxivAPI, "OAI_url", server.url)
+            daemon = _make_daemon(["cs"])
+            async for pset, records, state in daemon._request_all("2023-10-02"):
+                await writer.put(pset, records, state)
+                break
+        start = time.monotonic()
+        await writer.close(timeout=0.2)
+        return time.monotonic() - start
+
+    assert asyncio.run(write()) < 1
+    assert db.states == {} and db.records == {}
@@ -0,0 +1,84 @@
+from arxiv import ArxivRecord
+from db import DBInterface, MySQLInterface, SQLiteInterface
+from sqlalchemy import text
+import pytest
+
+
+def _make_db(tmp_path, batch_size=2):
+    return SQLiteInterface(str(tmp_path / "papers.db"), batch_size=batch_size)
+
+
+def _record(id, updated="", title="title"):
+    return ArxivRecord(
+        id=id, title=title, abstract="abstract", categories=["cs.AI", "cs.LG"],
+        authors=["a", "b"], published="2023-10-01", updated=updated,
+    )
+
+
+def _rows(db):
+    with db.engine.connect() as conn:
+        return {row.id: (row.title, str(row.updated) if row.updated else None)
+                for row in conn.execute(text("SELECT id, title, updated FROM paper_crawl;"))}
+
+
+def test_update_records_counts_and_skips(tmp_path):
+    db = _make_db(tmp_path)
+    records = [_record(str(i)) for i in range(5)]
+    assert db.update_records(records) == {'inserted': 5, 'updated': 0, 'skipped': 0}
+    assert db.update_records(records) == {'inserted': 0, 'updated': 0, 'skipped': 5}
+
+    records[1] = _record("1", updated="2023-10-03", title="new title")
+    records[2] = _record("2", title="same datestamp")
+    records.append(_record("5"))
+    assert db.update_records(records, batch_size=4) == {'inserted': 1, 'updated': 1, 'skipped': 4}
+    rows = _rows(db)
+    assert len(rows) == 6
+    assert rows["1"] == ("new title", "2023-10-03")
+    assert rows["2"] == ("title", None)
+
+
+def test_update_records_keeps_last_duplicate(tmp_path):
+    db = _make_db(tmp_path)
+    counts = db.update_records([_record("1", title="old"), _record("1", updated="2023-10-03", title="new")])
+    assert counts == {'inserted': 1, 'updated': 0, 'skipped': 1}
+    assert _rows(db) == {"1": ("new", "2023-10-03")}
+
+
+def test_query_records_pushes_down_predicates(tmp_path):
+    db = _make_db(tmp_path)
+    records = [
+        ArxivRecord(id="1", title="Diffusion Models", abstract="images", categories=["cs.CV"],
+                    authors=["Alice"], published="2023-10-01"),
+        ArxivRecord(id="2", title="Graph networks", abstract="a 100% latent diffusion step", categories=["cs.LG"],
+                    authors=["Bob"], published="2023-10-01"),
+        ArxivRecord(id="3", title="Transformers", abstract="attention", categories=["cs.LG"],
+                    authors=["Carol_D"], published="2023-09-01", updated="2023-10-01"),
+        ArxivRecord(id="4", title="Diffusion models", abstract="", categories=["cs.LG"],
+                    authors=["Dan"], published="2023-09-02"),
+    ]
+    db.update_records(records)
+
+    def ids(**kwargs):
+        return [r.id for r in db.query_records("2023-10-01", "2023-10-01", **kwargs)]
+
+    assert ids() == ["1", "2", "3"]
+    assert ids(categories=["cs.LG"]) == ["2", "3"]
+    assert ids(categories=[]) == []
+    assert ids(title_phrases=["diffusion models"]) == ["1"]
+    assert ids(abstract_phrases=["latent diffusion"], authors=["carol_"]) == ["2", "3"]
+    assert ids(abstract_phrases=["100%"]) == ["2"]
+    assert ids(title_phrases=[], abstract_phrases=[], authors=[]) == []
+
+    # the full-text index follows updates
+    db.update_records([ArxivRecord(id="1", title="Flow matching", abstract="images", categories=["cs.CV"],
+                                   authors=["Alice"], published="2023-10-01", updated="2023-10-01")])
+    assert ids(title_phrases=["diffusion"]) == []
+    assert ids(title_phrases=["flow"]) == ["1"]
+    assert db.query_records("2023-10-01", "2023-10-01", ["cs.cv"])[0].categories == ("cs.CV",)
+
+
+def test_phrase_words_follow_the_backend():
+    with pytest.raises(TypeError):
+        DBInterface("sqlite://")
+    assert SQLiteInterface._phrase_words("snake_case (NLP)") == ["snake", "case", "NLP"]
+    assert MySQLInterface._phrase_words("snake_case (NLP)") == ["snake_case", "NLP"]
@@ -0,0 +1,132 @@
+from app.asset import ArxivAsset
+from app.config import CategoryFilterConfig, ConfigRegistry
+from app.dailyfile import DailyFile
+from app.digest import ConfigDigest, DigestPublisher, DigestStore, Highlighter
+from app.rank import RelevanceRanker
+from arxiv import ArxivRecord
+from db import SQLiteInterface
+from datetime import datetime
+import json
+
+DATE = "2023-10-02"
+
+
+def _records():
+    titles = ["Diffusion models for video", "Graph networks", "Latent diffusion models", "Vision transformers"]
+    return [
+        ArxivRecord(id=f"2310.{i:05d}", title=title, abstract=f"We study {title.lower()}. Diffusion models",
+                    categories=["cs.AI" if i % 2 else "cs.CV"], authors=[f"author {i}"], published=DATE)
+        for i, title in enumerate(titles)
+    ]
+
+
+def _setup(tmp_path):
+    DailyFile.write(str(tmp_path / "arxiv" / "cs" / f"{DATE}.pday"), DATE, "cs", _records())
+    (tmp_path / "configs").mkdir()
+    d = {"categories": ["cs.AI", "cs.CV"], "keywd_in_title": ["diffusion models"], "authors": ["author 1"]}
+    (tmp_path / "configs" / "a.json").write_text(json.dumps(d))
+    asset = ArxivAsset(str(tmp_path / "arxiv"))
+    return asset, ConfigRegistry(str(tmp_path / "configs")), DigestStore(str(tmp_path / "digests"))
+
+
+def test_highlight_spans():
+    config = CategoryFilterConfig({"keywd_in_title": ["diffusion models", "diffusion"], "keywd_in_abstract": ["gan"]})
+    record = ArxivRecord(id="1", title="Diffusion  Models and diffusions, diffusion", abstract="A GAN; organ")
+    assert Highlighter(config).spans(record) == {"title": [[0, 17], [34, 43]], "abstract": [[2, 5]]}
+    assert Highlighter(CategoryFilterConfig({})).of([record]) == {}
+
+
+def test_publish_and_lookup(tmp_path):
+    asset, configs, store = _setup(tmp_path)
+    DigestPublisher(asset, configs, store).publish([], DATE)
+
+    compiled = configs.get("a")
+    digest = store.load("a", DATE)
+    assert digest.config_digest == compiled.digest
+    assert store.load("a", DATE) is digest
+    assert store.load("b", DATE) is None
+
+    config = compiled.config
+    expected = config.filt(asset.get_by_date(DATE, categories=config.categories)).get_records()
+    assert [r.id for r in digest.records(asset)] == [r.id for r in expected]
+    ranked = asset.rank_by_date(DATE, expected, RelevanceRanker(config), categories=config.categories)
+    assert [r.id for r in digest.records(asset, sort="relevance")] == [r.id for r in ranked]
+    assert digest.highlights["2310.00000"] == {"title": [[0, 16]]}
+
+    rebuilt = ConfigDigest.build(compiled, DATE, asset)
+    assert rebuilt.to_dict() == digest.to_dict()
+    assert ConfigDigest.build(compiled, "2100-01-01", asset) is None
+
+
+def _harvested_until(watermark):
+    return {"watermark": watermark, "from_time": None, "until_time": None, "resumption_token": ""}
+
+
+def test_publish_twice_from_store(tmp_path):
+    asset, configs, store = _setup(tmp_path)
+    (tmp_path / "arxiv" / "cs" / f"{DATE}.pday").unlink()
+    source = SQLiteInterface(str(tmp_path / "papers.db"))
+    records = _records()
+    source.update_records(records)
+    source.save_harvest_state("cs", _harvested_until("2023-10-03"))
+    publisher = DigestPublisher(asset, configs, store, source=source)
+    publisher.publish(["cs"], DATE)
+    assert store.load("a", DATE).ids == ["2310.00000", "2310.00001", "2310.00002"]
+    # the app maps the daily file before the daemon rewrites it
+    app_asset = ArxivAsset(str(tmp_path / "arxiv"))
+    assert len(app_asset.get_daily("cs", DATE)) == 4
+
+    records[3] = ArxivRecord(id="2310.00003", title="Vision diffusion models", abstract="", categories=["cs.CV"],
+                             authors=[], published=DATE, updated=DATE)
+    records.append(ArxivRecord(id="2310.00004", title="Audio diffusion models", abstract="", categories=["cs.AI"],
+                               authors=[], published=DATE))
+    source.update_records(records)
+    publisher.publish(["cs"], DATE)
+    digest = store.load("a", DATE)
+    assert digest.ids == ["2310.00000", "2310.00001", "2310.00002", "2310.00003", "2310.00004"]
+    for a in (asset, app_asset):
+        assert [r.title for r in digest.records(a)][3:] == ["Vision diffusion models", "Audio diffusion models"]
+
+
+def test_records_not_in_daily_sets(tmp_path):
+    asset, configs, store = _setup(tmp_path)
+    digest = ConfigDigest.build(configs.get("a"), DATE, asset)
+    digest.ids[0] = "2310.99999"
+    assert digest.records(asset) is None
+    assert ConfigDigest.build(configs.get("a"), "2023-10-03", asset) is None
+
+
+def test_incomplete_store_keeps_cached_day(tmp_path):
+    asset, configs, store = _setup(tmp_path)
+    source = SQLiteInterface(str(tmp_path / "papers.db"))
+    source.update_records(_records()[3:])
+    # the day may still receive records
+    source.save_harvest_state("cs", _harvested_until(DATE))
+    publisher = DigestPublisher(asset, configs, store, source=source)
+    publisher.publish_recent(["cs"], datetime(2023, 10, 3, 6))
+    assert len(asset.load_cache("cs", DATE)) == 4
+    assert store.load("a", DATE).ids == ["2310.00000", "2310.00001", "2310.00002"]
+
+    source.save_harvest_state("cs", _harvested_until("2023-10-03"))
+    publisher.publish(["cs"], DATE)
+    assert len(asset.load_cache("cs", DATE)) == 1
+    assert store.load("a", DATE).ids == []
+
+
+def test_bad_config_only_skips_its_digest(tmp_path, monkeypatch):
+    asset, configs, store = _setup(tmp_path)
+    for name, d in [("b", {"categories": ["stat.ML"]}), ("c", {"categories": ["stat.ML", "cs.CV"], "keywd_in_title": ["models"]}), ("d", {})]:
+        (tmp_path / "configs" / f"{name}.json").write_text(json.dumps(d))
+    build = ConfigDigest.build
+
+    def failing_build(compiled, date, asset):
+        if compiled.name == "a":
+            raise ValueError("broken config")
+        return build(compiled, date, asset)
+
+    monkeypatch.setattr(ConfigDigest, "build", failing_build)
+    DigestPublisher(asset, configs, store).publish(["cs"], DATE)
+    assert store.load("a", DATE) is None
+    assert store.load("b", DATE) is None
+    assert store.load("c", DATE).ids == ["2310.00000", "2310.00002"]
+    assert store.load("d", DATE) is None
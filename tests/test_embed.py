@@ -0,0 +1,91 @@
+from app.asset import ArxivAsset, ArxivDaily, ArxivFilter, ArxivSet
+from app.config import CategoryFilterConfig
+from app.embed import HashingEncoder, load_vectors, write_vectors
+from app.utils import RecordTokens
+from arxiv import ArxivRecord
+import numpy as np
+import pytest
+
+
+def _record(id, title, abstract, categories=("cs.LG",)):
+    record = ArxivRecord(id=id, title=title, abstract=abstract, categories=list(categories), authors=[])
+    record.tokens = RecordTokens(tuple(title.lower().split()), tuple(abstract.lower().split()))
+    return record
+
+
+RECORDS = [
+    _record("1", "denoising diffusion models", "we synthesize images with a diffusion model"),
+    _record("2", "regret of linear bandits", "we prove a regret bound for exploration"),
+    _record("3", "graph attention networks", "attention layers on graph structured data", ["cs.AI"]),
+]
+
+
+def test_encoder():
+    encoder = HashingEncoder(dim=256)
+    vectors = encoder.encode_records(RECORDS)
+    assert vectors.shape == (3, 256)
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0)
+    scores = vectors @ encoder.encode_records([_record("q", "diffusion model", "")])[0]
+    assert scores.argmax() == 0 and scores[0] > 0.3
+    assert np.array_equal(HashingEncoder(dim=256).encode_records(RECORDS), vectors)
+
+
+def test_encoder_vocabulary_is_bounded():
+    encoder = HashingEncoder(dim=256, max_vocab=8)
+    vectors = np.concatenate([encoder.encode_records([record]) for record in RECORDS * 2])
+    assert len(encoder._vocab.ids) < 8 + 16
+    assert np.allclose(vectors, HashingEncoder(dim=256).encode_records(RECORDS * 2))
+
+
+def test_vectors_file(tmp_path):
+    vectors = HashingEncoder(dim=64).encode_records(RECORDS)
+    path = str(tmp_path / "2023-10-02.vec")
+    write_vectors(path, vectors)
+    assert np.array_equal(load_vectors(path, 3, 64), vectors)
+    with pytest.raises(ValueError):
+        load_vectors(path, 4, 64)
+    write_vectors(path, vectors, (100, 5))
+    assert np.array_equal(load_vectors(path, 3, 64, (100, 5)), vectors)
+    with pytest.raises(ValueError):
+        load_vectors(path, 3, 64, (100, 6))
+
+
+def test_cached_vectors_are_mapped(tmp_path):
+    asset = ArxivAsset(str(tmp_path))
+    asset.cache(ArxivDaily("2023-10-02", "cs", RECORDS), "cs", "2023-10-02")
+    (tmp_path / "cs" / "2023-10-02.vec").unlink()
+
+    daily = asset.load_cache("cs", "2023-10-02")
+    assert isinstance(daily.file.vectors, np.memmap)
+    assert (tmp_path / "cs" / "2023-10-02.vec").exists()
+    mapped = list(daily)
+    assert np.allclose(asset.encoder.record_vectors(mapped[::-1]), asset.encoder.encode_records(RECORDS[::-1]))
+
+
+def test_vectors_of_another_version_are_embedded_again(tmp_path):
+    asset = ArxivAsset(str(tmp_path))
+    asset.cache(ArxivDaily("2023-10-02", "cs", RECORDS), "cs", "2023-10-02")
+    vec = (tmp_path / "cs" / "2023-10-02.vec").read_bytes()
+    # same number of records, other content
+    swapped = [_record(r.id, r2.title, r2.abstract) for r, r2 in zip(RECORDS, RECORDS[::-1])]
+    ArxivAsset(str(tmp_path)).cache(ArxivDaily("2023-10-02", "cs", swapped), "cs", "2023-10-02")
+    (tmp_path / "cs" / "2023-10-02.vec").write_bytes(vec)
+
+    daily = ArxivAsset(str(tmp_path)).load_cache("cs", "2023-10-02")
+    assert np.allclose(daily.file.vectors, asset.encoder.encode_records(swapped))
+
+
+def test_semantic_filter():
+    st = ArxivSet(RECORDS)
+    assert [r.id for r in ArxivFilter(semantic=["diffusion model for images"])(st)] == ["1"]
+    assert [r.id for r in ArxivFilter(semantic=[])(st)] == []
+
+    config = CategoryFilterConfig({
+        "categories": ["cs.LG", "cs.AI"],
+        "keywd_in_title": ["graph"],
+        "semantic": ["regret bounds", "image diffusion"],
+    })
+    assert [r.id for r in config.filt(st)] == ["1", "2", "3"]
+    assert [config.match(r) for r in RECORDS] == [True, True, True]
+    config = CategoryFilterConfig({"categories": ["cs.LG"], "semantic": ["graph attention"]})
+    assert [r.id for r in config.filt(st)] == []
@@ -0,0 +1,108 @@
+from app.index import InvertedIndex, PostingList
+from app.utils import RecordTokens
+from arxiv import ArxivRecord
+
+
+def _record(id, title, abstract="", authors=()):
+    record = ArxivRecord(id=id, title=title, abstract=abstract, categories=["cs.AI"], authors=list(authors))
+    record.tokens = RecordTokens(tuple(title.lower().split()), tuple(abstract.lower().split()))
+    return record
+
+
+def _fill(index):
+    index.add_daily("cs", "2023-10-01", [
+        _record("1", "a diffusion transformer for images", authors=["Alice A"]),
+        _record("2", "transformer diffusion", "we use a diffusion transformer", authors=["Bob B"]),
+    ])
+    index.add_daily("cs", "2023-10-02", [
+        _record("3", "graph networks", authors=["Alice A", "Bob B"]),
+        _record("1", "a transformer for images", authors=["Alice A"]),
+    ])
+
+
+def _ids(hits):
+    return [id for id, _, _ in hits]
+
+
+def test_posting_list_roundtrip():
+    posting = PostingList()
+    for doc, positions in [(0, [0, 3]), (7, [200]), (300, [1, 2, 1000])]:
+        posting.append(doc, positions)
+    assert posting.doc_ids() == [0, 7, 300]
+    assert posting.positions_of({7, 300}) == {7: {200}, 300: {1, 2, 1000}}
+
+
+def test_search(tmp_path):
+    index = InvertedIndex(str(tmp_path))
+    _fill(index)
+    assert _ids(index.search(["diffusion transformer"])) == ["2"]
+    assert _ids(index.search(["transformer"])) == ["2", "1"]
+    assert _ids(index.search(authors=["alice a"])) == ["3", "1"]
+    assert _ids(index.search(["graph"], authors=["bob b"])) == ["3"]
+    assert _ids(index.search(["transformer"], end="2023-10-01")) == ["2"]
+    assert index.search(["transformer images"]) == []
+    assert index.search() == []
+
+
+def test_reload_from_journal_and_snapshot(tmp_path):
+    index = InvertedIndex(str(tmp_path), compact_every=2)
+    _fill(index)
+    index.add_daily("cs", "2023-10-03", [_record("4", "diffusion transformer")])
+    with open(tmp_path / "journal.ndjson", "ab") as f:
+        f.write(b'["cs","2023-10-05",[["6"')
+
+    reloaded = InvertedIndex(str(tmp_path), compact_every=2)
+    assert _ids(reloaded.search(["diffusion transformer"])) == ["2", "4"]
+    assert set(reloaded.segments) == {("cs", "2023-10-01"), ("cs", "2023-10-02"), ("cs", "2023-10-03")}
+    reloaded.add_daily("cs", "2023-10-04", [_record("5", "diffusion transformer")])
+    assert _ids(InvertedIndex(str(tmp_path)).search(["diffusion transformer"])) == ["2", "4", "5"]
+
+
+def test_snapshot_is_not_pickled(tmp_path):
+    index = InvertedIndex(str(tmp_path))
+    _fill(index)
+    index.save()
+    with open(tmp_path / "index.snap", "rb") as f:
+        assert f.read(4) == b"PIDX"
+    (tmp_path / "index.snap").write_bytes(b"PIDX\x02\x00\xff\xff\x00\x00{")
+    # an invalid snapshot is ignored rather than loaded
+    assert InvertedIndex(str(tmp_path)).search(["transformer"]) == []
+
+
+def test_readding_a_day_replaces_it(tmp_path):
+    index = InvertedIndex(str(tmp_path), compact_every=100)
+    _fill(index)
+    for title in ["graph transformer", "graph diffusion"]:
+        index.add_daily("cs", "2023-10-02", [
+            _record("3", title, authors=["Alice A", "Bob B"]),
+            _record("4", "diffusion transformer"),
+        ])
+    assert _ids(index.search(["graph"])) == ["3"]
+    assert index.search(["graph transformer"]) == []
+    # the version of 2023-10-02 was dropped, the one of 2023-10-01 is the latest again
+    assert _ids(index.search(["diffusion transformer for images"])) == ["1"]
+    assert _ids(index.search(["diffusion transformer"])) == ["1", "2", "4"]
+
+    index.save()
+    assert len(index.ids) == 4
+    assert sum(posting.n for (field, _), posting in index.postings.items() if field == "author") == 4
+    reloaded = InvertedIndex(str(tmp_path))
+    assert _ids(reloaded.search(["diffusion transformer"])) == ["1", "2", "4"]
+    assert _ids(reloaded.search(["graph"], authors=["bob b"])) == ["3"]
+    assert reloaded.segments == {("cs", "2023-10-01"): (0, 2), ("cs", "2023-10-02"): (2, 4)}
+
+
+def test_days_added_by_another_process_are_searchable(tmp_path):
+    app_index = InvertedIndex(str(tmp_path))
+    daemon_index = InvertedIndex(str(tmp_path), compact_every=3)
+    _fill(daemon_index)
+    assert _ids(app_index.search(["transformer"])) == ["2", "1"]
+
+    # both add days to the journal, the third one compacts it into the snapshot
+    app_index.add_daily("cs", "2023-10-03", [_record("4", "sparse transformer")])
+    daemon_index.add_daily("cs", "2023-10-04", [_record("5", "dense transformer")])
+    assert daemon_index._journal_pos == 0
+    assert _ids(app_index.search(["transformer"])) == ["2", "1", "4", "5"]
+    app_index.add_daily("cs", "2023-10-04", [_record("5", "dense graph")])
+    assert _ids(daemon_index.search(["transformer"])) == ["2", "1", "4"]
+    assert _ids(InvertedIndex(str(tmp_path)).search(["transformer"])) == ["2", "1", "4"]
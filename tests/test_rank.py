@@ -0,0 +1,52 @@
+import math
+from app.config import CategoryFilterConfig
+from app.rank import RelevanceRanker, TermStats
+from app.utils import RecordTokens
+from arxiv import ArxivRecord
+
+
+def _record(id, title, abstract, authors=()):
+    record = ArxivRecord(id=id, title=title, abstract=abstract, categories=["cs.AI"], authors=list(authors))
+    record.tokens = RecordTokens(tuple(title.lower().split()), tuple(abstract.lower().split()))
+    return record
+
+
+RECORDS = [
+    _record("1", "graph networks", "a graph of graphs with a diffusion step"),
+    _record("2", "diffusion models", "diffusion diffusion models for images", ["Alice A"]),
+    _record("3", "vision transformer", "attention for images"),
+    _record("4", "diffusion transformer", "a transformer as diffusion backbone"),
+]
+
+
+def _bm25(records, field, term, k1=TermStats.k1, b=TermStats.b):
+    docs = [getattr(r.tokens, field) for r in records]
+    avg_len = sum(len(d) for d in docs) / len(docs)
+    df = sum(term in d for d in docs)
+    idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+    return [
+        idf * d.count(term) * (k1 + 1) / (d.count(term) + k1 * (1 - b + b * len(d) / avg_len))
+        for d in docs
+    ]
+
+
+def test_scores_match_bm25():
+    stats = TermStats(RECORDS)
+    scores = stats.scores({"abstract": {"diffusion": 1.0, "images": 0.5}, "author": {"alice a": 3.0}})
+    expected = [
+        d + 0.5 * i + (3.0 if "Alice A" in r.authors else 0.0)
+        for r, d, i in zip(RECORDS, _bm25(RECORDS, "abstract", "diffusion"), _bm25(RECORDS, "abstract", "images"))
+    ]
+    assert [round(float(s), 4) for s in scores] == [round(s, 4) for s in expected]
+    assert not stats.scores({"title": {"unknown": 1.0}}).any()
+
+
+def test_rank_by_config():
+    config = CategoryFilterConfig({"categories": ["cs.AI"], "keywd_in_title": ["diffusion"], "authors": ["Alice A"]})
+    daily = list(reversed(RECORDS))
+    ranked = RelevanceRanker(config).rank(RECORDS, [TermStats.of(_Daily(daily))])
+    assert [r.id for r in ranked] == ["2", "4", "1", "3"]
+
+
+class _Daily(list):
+    pass
@@ -0,0 +1,80 @@
+from app.flask.responses import ResponseCache
+from datetime import datetime, timedelta
+from flask import Flask, request
+
+
+def _make_app(cache, date, listed=True):
+    app = Flask(__name__)
+    renders = []
+
+    @app.route("/")
+    def page():
+        def render():
+            renders.append(date)
+            return f"<p>{date}</p>", listed
+
+        return cache.respond(request, ("page", request.args.get("q")), date, render)
+
+    return app.test_client(), renders
+
+
+def test_past_pages_render_once_and_revalidate():
+    client, renders = _make_app(ResponseCache(), "2023-10-02")
+    first = client.get("/?q=a")
+    assert first.status_code == 200 and first.data == b"<p>2023-10-02</p>"
+    etag = first.headers["ETag"]
+    assert first.headers["Last-Modified"]
+    assert "max-age=86400" in first.headers["Cache-Control"]
+
+    assert client.get("/?q=a").headers["ETag"] == etag
+    not_modified = client.get("/?q=a", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304 and not_modified.data == b""
+    assert client.get("/?q=a", headers={"If-Modified-Since": first.headers["Last-Modified"]}).status_code == 304
+    assert renders == ["2023-10-02"]
+
+    client.get("/?q=b")
+    assert len(renders) == 2
+
+
+def test_pages_without_papers_are_not_cached():
+    client, renders = _make_app(ResponseCache(), "2023-10-02", listed=False)
+    res = client.get("/")
+    assert res.status_code == 200 and "ETag" not in res.headers
+    assert res.headers["Cache-Control"] == "no-store"
+    client.get("/")
+    assert len(renders) == 2
+
+
+def test_evicted_pages_revalidate_without_rendering():
+    cache = ResponseCache()
+    client, renders = _make_app(cache, "2023-10-02")
+    etag = client.get("/").headers["ETag"]
+    cache._cache.clear()
+    assert client.get("/", headers={"If-None-Match": etag}).status_code == 304
+    assert len(renders) == 1
+    assert client.get("/").status_code == 200
+    assert len(renders) == 2
+
+
+def test_recent_pages_expire():
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+    client, renders = _make_app(ResponseCache(recent_ttl=0), today)
+    assert "max-age=0" in client.get("/").headers["Cache-Control"]
+    client.get("/")
+    assert renders == [today, today]
+
+    past = (datetime.utcnow() - timedelta(days=3)).strftime("%Y-%m-%d")
+    client, renders = _make_app(ResponseCache(recent_ttl=0), past)
+    client.get("/")
+    client.get("/")
+    assert renders == [past]
+
+
+def test_invalidate_by_prefix():
+    cache = ResponseCache()
+    app = Flask(__name__)
+    with app.test_request_context("/"):
+        for key in [("config", "a", 1), ("config", "a", 2), ("config", "b", 1)]:
+            cache.respond(request, key, "2023-10-02", lambda: ("page", True))
+    cache.invalidate(("config", "a"))
+    assert cache.stats()["entries"] == 1
@@ -0,0 +1,49 @@
+from app import utils
+from app.utils import NLP, PhraseMatcher, atomic_write
+import os
+import pytest
+
+
+def test_phrase_matcher_matches_contain_phrase():
+    phrases = [
+        "transformer",
+        "Vision Transformer",
+        "vision transformers",
+        "diffusion model",
+        "diffusion",
+        "state-of-the-art",
+        "GAN",
+        "large language model's",
+        "",
+        "...",
+    ]
+    documents = [
+        "We propose a Vision Transformer for object detection.",
+        "Diffusion models are state-of-the-art generative models, unlike GANs.",
+        "A diffusion model based on the transformer architecture.",
+        "The large language model's output is evaluated...",
+        "gan",
+        "",
+        "Nothing to see here",
+    ]
+    matcher = PhraseMatcher(phrases)
+    for doc in documents:
+        expected = {p for p in phrases if NLP.contain_phrase(doc, p)}
+        assert matcher.match(doc) == expected
+        assert matcher.contain_any(doc) == (len(expected) > 0)
+    assert not PhraseMatcher([]).contain_any(documents[0])
+
+
+def test_atomic_write_permissions(tmp_path):
+    path = str(tmp_path / "sub" / "file")
+    with atomic_write(path) as f:
+        f.write(b"data")
+    assert open(path, "rb").read() == b"data"
+    # readable by other users unless the umask says otherwise, like open()
+    assert os.stat(path).st_mode & 0o777 == 0o666 & ~utils._umask
+    with pytest.raises(ValueError):
+        with atomic_write(path) as f:
+            f.write(b"partial")
+            raise ValueError
+    assert open(path, "rb").read() == b"data"
+    assert os.listdir(tmp_path / "sub") == ["file"]